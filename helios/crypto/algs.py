@@ -14,6 +14,8 @@ import logging
 from Crypto.Util import number
 from Crypto import Random
 
+from zeus.core import verify_power_equation
+
 
 # some utilities
 class Utils:
@@ -199,12 +201,13 @@ class EGPublicKey:
         verify the proof of knowledge of the secret key
         g^response = commitment * y^challenge
         """
-        left_side = pow(self.g, dlog_proof.response, self.p)
-        right_side = (dlog_proof.commitment * pow(self.y, dlog_proof.challenge, self.p)) % self.p
+        check = verify_power_equation(self.p, self.g, dlog_proof.response,
+                                      self.y, dlog_proof.challenge,
+                                      dlog_proof.commitment)
 
         expected_challenge = challenge_generator(dlog_proof.commitment) % self.q
 
-        return ((left_side == right_side) and (dlog_proof.challenge == expected_challenge))
+        return (check and (dlog_proof.challenge == expected_challenge))
 
     @classmethod
     def from_dict(cls, d):
@@ -495,11 +498,15 @@ class EGCiphertext:
         """
 
         # check that g^response = A * alpha^challenge
-        first_check = (pow(self.pk.g, proof.response, self.pk.p) == ((pow(self.alpha, proof.challenge, self.pk.p) * proof.commitment['A']) % self.pk.p))
+        first_check = verify_power_equation(self.pk.p, self.pk.g, proof.response,
+                                            self.alpha, proof.challenge,
+                                            proof.commitment['A'])
 
         # check that y^response = B * (beta/m)^challenge
         beta_over_m = (self.beta * Utils.inverse(plaintext.m, self.pk.p)) % self.pk.p
-        second_check = (pow(self.pk.y, proof.response, self.pk.p) == ((pow(beta_over_m, proof.challenge, self.pk.p) * proof.commitment['B']) % self.pk.p))
+        second_check = verify_power_equation(self.pk.p, self.pk.y, proof.response,
+                                             beta_over_m, proof.challenge,
+                                             proof.commitment['B'])
 
         # print "1,2: %s %s " % (first_check, second_check)
         return (first_check and second_check)
@@ -625,10 +632,14 @@ class EGZKProof(object):
         Verify a DH tuple proof
         """
         # check that little_g^response = A * big_g^challenge
-        first_check = (pow(little_g, self.response, p) == ((pow(big_g, self.challenge, p) * self.commitment['A']) % p))
+        first_check = verify_power_equation(p, little_g, self.response,
+                                            big_g, self.challenge,
+                                            self.commitment['A'])
 
         # check that little_h^response = B * big_h^challenge
-        second_check = (pow(little_h, self.response, p) == ((pow(big_h, self.challenge, p) * self.commitment['B']) % p))
+        second_check = verify_power_equation(p, little_h, self.response,
+                                             big_h, self.challenge,
+                                             self.commitment['B'])
 
         # check the challenge?
         third_check = True
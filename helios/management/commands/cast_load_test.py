@@ -0,0 +1,95 @@
+"""
+Measure vote casting throughput as the number of polls voting at the
+same time grows.
+
+Votes are really cast, so only run this against test elections whose
+polls are open for voting.
+"""
+
+import threading
+from time import time
+
+from django.db import connection, transaction
+from django.core.management.base import BaseCommand, CommandError
+
+from helios.models import Poll
+from zeus.election import get_datatype
+
+
+def make_votes(poll, nr_votes):
+    """Encrypt nr_votes random votes for the voters of poll, in turn."""
+    zeus = poll.zeus
+    voters = list(poll.voters.all()[:nr_votes])
+    if not voters:
+        raise CommandError("Poll %s has no voters" % poll.uuid)
+    votes = []
+    for i in range(nr_votes):
+        voter = voters[i % len(voters)]
+        vote = zeus.mk_random_vote(voter=voter.uuid)[0]
+        helios_vote = zeus._get_helios_vote_dict(vote)
+        enc_vote = get_datatype('phoebus/EncryptedVote',
+                                helios_vote).wrapped_obj
+        votes.append((voter, enc_vote))
+    return votes
+
+
+def cast_votes(poll, votes, errors):
+    try:
+        for voter, enc_vote in votes:
+            with transaction.atomic():
+                poll.cast_vote(voter, enc_vote)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+
+    help = 'Measure vote casting throughput over concurrent polls'
+
+    def add_arguments(self, parser):
+        parser.add_argument('polls',
+                            nargs='+',
+                            help='UUIDs of polls open for voting')
+        parser.add_argument('--votes',
+                            action='store',
+                            dest='nr_votes',
+                            type=int,
+                            default=20,
+                            help='Votes to cast per poll and thread')
+        parser.add_argument('--threads',
+                            action='store',
+                            dest='nr_threads',
+                            type=int,
+                            default=1,
+                            help='Concurrent casting threads per poll')
+
+    def handle(self, *args, **options):
+        polls = [Poll.objects.get(uuid=uuid) for uuid in options['polls']]
+        nr_votes = options['nr_votes']
+        nr_threads = options['nr_threads']
+
+        self.stdout.write("polls,threads,votes,seconds,votes/s")
+        for nr_polls in range(1, len(polls) + 1):
+            batches = []
+            for poll in polls[:nr_polls]:
+                for _ in range(nr_threads):
+                    batches.append((poll, make_votes(poll, nr_votes)))
+
+            errors = []
+            threads = [threading.Thread(target=cast_votes,
+                                        args=(poll, votes, errors))
+                       for poll, votes in batches]
+            t = time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            seconds = time() - t
+            if errors:
+                raise CommandError("Casting failed: %s" % (errors[0],))
+
+            total = nr_votes * len(batches)
+            self.stdout.write("%d,%d,%d,%.2f,%.1f" % (
+                nr_polls, len(threads), total, seconds, total / seconds))
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import models, migrations
+from django.db.models import Count
+
+
+def init_next_vote_index(apps, schema_editor):
+    Poll = apps.get_model('helios', 'Poll')
+    CastVote = apps.get_model('helios', 'CastVote')
+    counts = CastVote.objects.filter(verified_at__isnull=False).values(
+        'poll').annotate(nr_votes=Count('pk'))
+    for count in counts:
+        Poll.objects.filter(pk=count['poll']).update(
+            next_vote_index=count['nr_votes'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helios', '0005_election_cast_consent_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='next_vote_index',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=True,
+        ),
+        migrations.RunPython(init_next_vote_index,
+                             migrations.RunPython.noop),
+    ]
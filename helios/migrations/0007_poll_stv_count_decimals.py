@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helios', '0006_poll_next_vote_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='stv_count_decimals',
+            field=models.PositiveIntegerField(null=True, default=None),
+            preserve_default=True,
+        ),
+    ]
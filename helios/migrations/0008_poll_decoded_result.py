@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helios', '0007_poll_stv_count_decimals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='decoded_result',
+            field=models.BinaryField(null=True, default=None),
+            preserve_default=True,
+        ),
+    ]
@@ -16,9 +16,10 @@ import zipfile
 import os
 import csv
 import tempfile
-import mmap
-import marshal
+import shutil
+import weakref
 import itertools
+import marshal
 import six.moves.urllib.request
 import six.moves.urllib.parse
 import six.moves.urllib.error
@@ -26,7 +27,7 @@ import six.moves.urllib.error
 from datetime import timedelta
 
 from django.template.loader import render_to_string
-from django.db import models, transaction
+from django.db import models, transaction, IntegrityError
 from django.db.models.query import QuerySet
 from django.db.models import Count
 from django.conf import settings
@@ -49,8 +50,11 @@ from heliosauth.models import SMSBackendData, User
 from heliosauth.jsonfield import JSONField
 
 from zeus.core import (numbers_hash, gamma_encoding_max,
-                       gamma_decode, to_absolute_answers, to_canonical,
-                       from_canonical)
+                       gamma_decode, gamma_decode_many, to_absolute_answers,
+                       unpack_selections, to_canonical,
+                       from_canonical, ZeusError)
+from zeus.mixfile import (write_mix_file, read_mix_file, is_mix_file,
+                          MIX_FILE_MAGIC)
 from zeus.slugify import slughifi
 from zeus.election_modules import ELECTION_MODULES_CHOICES, get_poll_module, \
     get_election_module
@@ -108,6 +112,135 @@ def dummy_upload_to(x):
     return ''
 
 
+class MixPartWriter(io.RawIOBase):
+    """Write-only stream storing its data as MixPart rows of at most
+    MIX_PART_SIZE bytes, so that a mix is never held whole in memory."""
+
+    def __init__(self, poll_mix, part_size=None):
+        self.poll_mix = poll_mix
+        self.part_size = part_size or settings.MIX_PART_SIZE
+        self.buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        part_size = self.part_size
+        while len(self.buffer) >= part_size:
+            self.poll_mix.parts.create(data=bytes(self.buffer[:part_size]))
+            del self.buffer[:part_size]
+        return len(data)
+
+    def close(self):
+        if not self.closed and self.buffer:
+            self.poll_mix.parts.create(data=bytes(self.buffer))
+            self.buffer = bytearray()
+        super(MixPartWriter, self).close()
+
+
+class MixPartReader(io.RawIOBase):
+    """Read-only stream over the MixPart rows of a mix, fetching one
+    part at a time."""
+
+    def __init__(self, poll_mix):
+        # QuerySet.iterator() would fetch parts in chunks of 100, so
+        # only the keys are listed up front
+        pks = poll_mix.parts.order_by('pk').values_list('pk', flat=True)
+        self.pks = iter(list(pks))
+        self.part = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not len(self.part):
+            pk = next(self.pks, None)
+            if pk is None:
+                return 0
+            data = MixPart.objects.filter(pk=pk).values_list(
+                'data', flat=True).get()
+            self.part = memoryview(bytes(data or b''))
+        size = min(len(b), len(self.part))
+        b[:size] = self.part[:size]
+        self.part = self.part[size:]
+        return size
+
+
+class FileSystemMixStorage(object):
+    """Mixes kept as mix files under ZEUS_MIXES_PATH."""
+
+    def store(self, poll_mix, mix):
+        fname = str(poll_mix.pk) + ".mix"
+        fpath = os.path.join(ZEUS_MIXES_PATH, fname)
+        try:
+            with open(fpath, "wb") as f:
+                write_mix_file(mix, f)
+        except ZeusError:
+            # malformed mixes are kept as they came
+            os.unlink(fpath)
+            fname = str(poll_mix.pk) + ".canonical"
+            fpath = os.path.join(ZEUS_MIXES_PATH, fname)
+            with open(fpath, "w") as f:
+                to_canonical(mix, out=f)
+        poll_mix.mix_file = fname
+
+    def open(self, poll_mix):
+        return open(poll_mix.mix_file.path, "rb")
+
+    def load(self, poll_mix):
+        fpath = poll_mix.mix_file.path
+        if is_mix_file(fpath):
+            return read_mix_file(fpath)
+        with self.open(poll_mix) as f:
+            return from_canonical(f.read())
+
+
+class DatabaseMixStorage(object):
+    """Mixes kept in the database as MixPart rows of their mix file."""
+
+    def store(self, poll_mix, mix):
+        poll_mix.parts.all().delete()
+        try:
+            with MixPartWriter(poll_mix) as out:
+                write_mix_file(mix, out)
+        except ZeusError:
+            poll_mix.parts.all().delete()
+            with MixPartWriter(poll_mix) as out:
+                out.write(to_canonical(mix).encode('utf-8'))
+
+    def open(self, poll_mix):
+        return io.BufferedReader(MixPartReader(poll_mix))
+
+    def load(self, poll_mix):
+        with self.open(poll_mix) as f:
+            head = f.peek(len(MIX_FILE_MAGIC))[:len(MIX_FILE_MAGIC)]
+            if head != MIX_FILE_MAGIC:
+                # canonical JSON opens with '{"', a marshal dump of the
+                # mix, as parts were written before mix files, does not
+                if head[1:2] in (b'"', b'}'):
+                    return from_canonical(f.read())
+                return marshal.loads(f.read())
+            # mix files are read memory mapped, spool the parts to disk
+            fd, fpath = tempfile.mkstemp(prefix='zeus-mix-')
+            with os.fdopen(fd, 'wb') as out:
+                shutil.copyfileobj(f, out)
+        mix = read_mix_file(fpath)
+        weakref.finalize(mix, os.unlink, fpath)
+        return mix
+
+
+MIX_STORAGE_BACKENDS = {
+    'filesystem': FileSystemMixStorage,
+    'database': DatabaseMixStorage,
+}
+
+
+def get_mix_storage():
+    name = getattr(settings, 'ZEUS_MIX_STORAGE', 'filesystem')
+    return MIX_STORAGE_BACKENDS[name]()
+
+
 class PollMix(models.Model):
 
     MIX_REMOTE_TYPE_CHOICES = (('helios', 'Helios'),
@@ -145,17 +278,6 @@ class PollMix(models.Model):
         ordering = ['-mix_order']
         unique_together = [('poll', 'mix_order')]
 
-    def store_mix_in_file(self, mix):
-        """
-        Expects mix dict object
-        """
-        fname = str(self.pk) + ".canonical"
-        fpath = os.path.join(ZEUS_MIXES_PATH, fname)
-        with open(fpath, "w") as f:
-            to_canonical(mix, out=f)
-        self.mix_file = fname
-        self.save()
-
     def reset_mixing(self):
         if self.status == 'finished' and self.mix:
             raise Exception("Cannot reset finished mix")
@@ -170,36 +292,26 @@ class PollMix(models.Model):
         return True
 
     def zeus_mix(self):
-        with self.mix_file as f:
-            return from_canonical(f.read())
-
-    def mix_parts_iter(self, mix):
-        size = len(mix)
-        index = 0
-        while index < size:
-            yield memoryview(mix)[index:index+settings.MIX_PART_SIZE]
-            index += settings.MIX_PART_SIZE
+        return get_mix_storage().load(self)
 
     def store_mix(self, mix):
         """
-        mix is a dict object
+        mix is a dict object, stored through the ZEUS_MIX_STORAGE backend
         """
-        self.parts.all().delete()
-        mix = marshal.dumps(mix)
-
-        for part in self.mix_parts_iter(mix):
-            self.parts.create(data=part)
+        get_mix_storage().store(self, mix)
+        self.save()
 
-    @transaction.atomic
     def _do_mix(self):
-        last_mix = self.poll.zeus.get_last_mix()
-        new_mix = self.poll.zeus.mix(last_mix)
+        zeus = self.poll.zeus
+        with zeus.open_mixes():
+            last_mix = zeus.get_last_mix()
+            new_mix = zeus.mix(last_mix)
 
-        self.store_mix(new_mix)
-        self.store_mix_in_file(new_mix)
-
-        self.status = 'finished'
-        self.save()
+            # Only storing the result needs the transaction, not the mixing
+            with transaction.atomic():
+                self.store_mix(new_mix)
+                self.status = 'finished'
+                self.save()
         return new_mix
 
     def mix_ciphers(self):
@@ -709,14 +821,20 @@ class Poll(PollTasks, HeliosModel, PollFeatures):
     # results of the election
     result = LDObjectField(type_hint='phoebus/Result',
                            null=True)
+    # result[0] decoded to absolute selections, see decoded_ballots()
+    decoded_result = models.BinaryField(null=True, default=None)
     stv_results = JSONField(null=True)
 
     eligibles_count = models.PositiveIntegerField(default=5)
     has_department_limit = models.BooleanField(default=0)
     department_limit = models.PositiveIntegerField(default=0)
+    # count STV in fixed point with this many decimals, or floats if null
+    stv_count_decimals = models.PositiveIntegerField(null=True, default=None)
 
     voters_last_notified_at = models.DateTimeField(null=True, default=None)
     index = models.PositiveIntegerField(default=1)
+    # index the next verified cast vote gets
+    next_vote_index = models.PositiveIntegerField(default=0)
 
     # voters oauth2 authentication
     oauth2_thirdparty = models.BooleanField(default=False, verbose_name=_("Oauth2 login"))
@@ -1189,7 +1307,6 @@ class Poll(PollTasks, HeliosModel, PollFeatures):
                                         status=status,
                                         mix_error=error if error else None)
                 mix.store_mix(remote_mix)
-                mix.store_mix_in_file(remote_mix)
         except Exception as e:
             logging.exception("Remote mix creation failed.")
             return e
@@ -1259,28 +1376,42 @@ class Poll(PollTasks, HeliosModel, PollFeatures):
         if os.path.exists(zip_path):
             os.unlink(zip_path)
 
-        export_data = self.zeus.export()
-        self.zeus_fingerprint = export_data[0]['election_fingerprint']
-        self.save()
+        zeus = self.zeus
+        with zeus.open_mixes():
+            export_data = zeus.export()
+            self.zeus_fingerprint = export_data[0]['election_fingerprint']
+            self.save()
 
-        zf = zipfile.ZipFile(zip_path, mode='w')
-        data_info = zipfile.ZipInfo('%s_proofs.txt' % self.short_name)
-        data_info.compress_type = zipfile.ZIP_DEFLATED
-        data_info.comment = (
-            "Election %s (%s-%s) zeus proofs" % (self.zeus_fingerprint,
-                                                 self.election.uuid, self.uuid)
-        ).encode()
-        data_info.date_time = datetime.datetime.now().timetuple()
-        data_info.external_attr = 0o777 << 16
-
-        tmpf = tempfile.TemporaryFile(mode="w", suffix='.zeus',
-                                      prefix='tmp', dir='/tmp')
-        to_canonical(export_data[0], out=tmpf)
-        tmpf.flush()
-        zeus_data = mmap.mmap(tmpf.fileno(), 0, mmap.MAP_SHARED, mmap.PROT_READ)
-        zf.writestr(data_info, zeus_data)
-        zf.close()
-        tmpf.close()
+            data_info = zipfile.ZipInfo('%s_proofs.txt' % self.short_name)
+            data_info.compress_type = zipfile.ZIP_DEFLATED
+            data_info.comment = (
+                "Election %s (%s-%s) zeus proofs" % (
+                    self.zeus_fingerprint, self.election.uuid, self.uuid)
+            ).encode()
+            data_info.date_time = datetime.datetime.now().timetuple()
+            data_info.external_attr = 0o777 << 16
+
+            with zipfile.ZipFile(zip_path, mode='w') as zf:
+                with zf.open(data_info, mode='w', force_zip64=True) as entry:
+                    out = io.TextIOWrapper(entry, encoding='utf-8')
+                    to_canonical(export_data[0], out=out)
+                    out.close()
+
+    def decoded_ballots(self, nr_candidates):
+        """
+        The selections of the ballots in result[0], converted to
+        absolute answers. do_store_results keeps them packed in
+        decoded_result; results stored without them are decoded here,
+        and not stored, so that reading the results never writes.
+        """
+        data = self.decoded_result
+        if data is not None:
+            cached_candidates, selections = unpack_selections(data)
+            if (cached_candidates == nr_candidates and
+                    len(selections) == len(self.result[0])):
+                return selections
+        return gamma_decode_many(self.result[0], nr_candidates,
+                                 nr_candidates, absolute=True)
 
     @property
     def pretty_result(self):
@@ -1292,10 +1423,10 @@ class Poll(PollTasks, HeliosModel, PollFeatures):
         answer_selections = []
         selections = []
 
-        for vote in self.result[0]:
+        relative = gamma_decode_many(self.result[0], cands_count, cands_count)
+        for vote, selection, abs_selection in zip(
+                self.result[0], relative, self.decoded_ballots(cands_count)):
             decoded = vote
-            selection = gamma_decode(vote, cands_count, cands_count)
-            abs_selection = to_absolute_answers(selection, cands_count)
             cands = [answers[i] for i in abs_selection]
             cands_objs = []
             for i in abs_selection:
@@ -1997,20 +2128,27 @@ class CastVote(HeliosModel):
     def is_quarantined(self):
         return self.quarantined_p and not self.released_from_quarantine_at
 
-    def set_tinyhash(self):
+    def set_tinyhash(self, min_length=8):
         """
-        find a tiny version of the hash for a URL slug.
+        find a tiny version of the hash for a URL slug, at least
+        min_length long.
         """
         safe_hash = self.vote_hash
         for c in ['/', '+']:
             safe_hash = safe_hash.replace(c, '')
 
-        length = 8
-        while True:
-            vote_tinyhash = safe_hash[:length]
-            if CastVote.objects.filter(vote_tinyhash=vote_tinyhash).count() == 0:
+        # probe every candidate prefix with a single indexed lookup
+        prefixes = [safe_hash[:length]
+                    for length in range(min_length,
+                                        max(len(safe_hash), 8) + 1)]
+        taken = set(CastVote.objects.filter(
+            vote_tinyhash__in=prefixes).values_list('vote_tinyhash',
+                                                    flat=True))
+        for vote_tinyhash in prefixes:
+            if vote_tinyhash not in taken:
                 break
-            length += 1
+        else:
+            raise Exception("No free tinyhash for vote hash %s" % safe_hash)
 
         self.vote_tinyhash = vote_tinyhash
 
@@ -2019,10 +2157,22 @@ class CastVote(HeliosModel):
         override this just to get a hook
         """
         # not saved yet? then we generate a tiny hash
-        if not self.vote_tinyhash:
-            self.set_tinyhash()
+        if self.vote_tinyhash:
+            return super(CastVote, self).save(*args, **kwargs)
 
-        super(CastVote, self).save(*args, **kwargs)
+        self.set_tinyhash()
+        # casts in other polls run concurrently and may take the same
+        # tinyhash between the lookup and the insert
+        while True:
+            try:
+                with transaction.atomic():
+                    return super(CastVote, self).save(*args, **kwargs)
+            except IntegrityError:
+                if not CastVote.objects.filter(
+                        vote_tinyhash=self.vote_tinyhash).exists():
+                    raise
+                # probe again from the next prefix on
+                self.set_tinyhash(len(self.vote_tinyhash) + 1)
 
 
 class AuditedBallotQuerySet(QuerySet):
@@ -263,6 +263,14 @@ COLLATION_LOCALE = 'el_GR.UTF-8'
 
 MIX_PART_SIZE = 104857600
 
+# where mixes are stored, 'filesystem' (ZEUS_MIXES_PATH) or 'database'
+# (MIX_PART_SIZE sized MixPart rows)
+ZEUS_MIX_STORAGE = 'filesystem'
+
+# signing and proof randomness precomputed in the background of every
+# process that casts votes, per queue; 0 disables precomputation
+ZEUS_RANDOMNESS_POOL_SIZE = 256
+
 USE_X_SENDFILE = False
 
 
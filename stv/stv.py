@@ -57,33 +57,63 @@ class Action:
     THRESHOLD = "^THRESHOLD"
 
 
-class Ballot:
+class Ballot(object):
     """A ballot class for Single Transferable Voting.
 
     The ballot class contains an ordered list of candidates (in
-    decreasing order of preference) and an ordered list of weights
-    (new weights are added to the front of the list). The index of the
-    current preference (for the first count and subsequent rounds)
-    is also kept.
+    decreasing order of preference), the index of the current
+    preference (for the first count and subsequent rounds) and the
+    current value of the ballot, the product of the weights it has
+    been transferred with. The transfers themselves are recorded in
+    the count log.
 
     """
 
-    candidates = []
-    weights = [1.0]
-    current_preference = 0
-    _value = 1.0
+    __slots__ = ('candidates', 'current_preference', '_value')
 
     def __init__(self, candidates=[]):
         self.candidates = candidates
+        self.current_preference = 0
+        self._value = 1.0
 
     def add_weight(self, weight):
-        self.weights.insert(0, weight)
         self._value *= weight
 
     def get_value(self):
         return self._value
 
 
+class FixedPointWeight(object):
+    """A transfer weight of numerator / denominator for fixed point
+    ballot values, which are rounded down when multiplied by it."""
+
+    __slots__ = ('numerator', 'denominator')
+
+    def __init__(self, numerator, denominator):
+        self.numerator = numerator
+        self.denominator = denominator
+
+    def __rmul__(self, value):
+        return value * self.numerator // self.denominator
+
+
+def format_votes(votes, decimals=None):
+    """Returns votes as they are logged.
+
+    Without decimals votes are floats, or whole numbers, and are shown
+    as they are. Otherwise votes are fixed point integers in units of
+    10 ** -decimals of a vote, and are shown as exact decimals.
+    """
+
+    if decimals is None:
+        return str(votes)
+    sign = '-' if votes < 0 else ''
+    units, fraction = divmod(abs(votes), 10 ** decimals)
+    if not decimals:
+        return sign + str(units)
+    return "%s%d.%0*d" % (sign, units, decimals, fraction)
+
+
 def randomly_select_first(sequence, key, action, random_generator=None,
                           logger=logger):
     """Selects the first item of equals in a sorted sequence of items.
@@ -124,7 +154,7 @@ def randomly_select_first(sequence, key, action, random_generator=None,
 
 
 def redistribute_ballots(selected, weight, hopefuls, allocated, vote_count,
-                         logger=logger):
+                         logger=logger, decimals=None):
     """Redistributes the ballots from selected to the hopefuls.
 
     Redistributes the ballots currently allocated to the selected
@@ -135,12 +165,14 @@ def redistribute_ballots(selected, weight, hopefuls, allocated, vote_count,
 
     """
 
-    transferred = []
+    remaining = []
     # Keep a hash of ballot moves for logging purposes.
     # Keys are a tuple of the form (from_recipient, to_recipient, value)
     # where value is the current value of the ballot. Each tuple points
-    # to the ballot being moved.
+    # to the number of ballots moved.
     moves = {}
+    # Ballots of the same value are transferred with the same new value
+    transferred_values = {}
 
     for ballot in allocated[selected]:
         reallocated = False
@@ -149,8 +181,12 @@ def redistribute_ballots(selected, weight, hopefuls, allocated, vote_count,
             recipient = ballot.candidates[i]
             if recipient in hopefuls:
                 ballot.current_preference = i
-                ballot.add_weight(weight)
-                current_value = ballot.get_value()
+                value = ballot.get_value()
+                current_value = transferred_values.get(value)
+                if current_value is None:
+                    current_value = value * weight
+                    transferred_values[value] = current_value
+                ballot._value = current_value
                 if recipient in allocated:
                     allocated[recipient].append(ballot)
                 else:
@@ -161,30 +197,25 @@ def redistribute_ballots(selected, weight, hopefuls, allocated, vote_count,
                     vote_count[recipient] = current_value
                 vote_count[selected] -= current_value
                 reallocated = True
-                if (selected, recipient, current_value) in moves:
-                    moves[(selected, recipient, current_value)].append(ballot)
-                else:
-                    moves[(selected, recipient, current_value)] = [ballot]
-                transferred.append(ballot)
+                move = (selected, recipient, current_value)
+                moves[move] = moves.get(move, 0) + 1
             else:
                 i += 1
-    for move, ballots in moves.items():
-        times = len(ballots)
-        description = "from {0} to {1} {2}*{3}={4}".format(move[0],
-                                                            move[1],
-                                                            times,
-                                                            move[2],
-                                                            times * move[2])
+        if not reallocated:
+            remaining.append(ballot)
+    for move, times in moves.items():
+        description = "from {0} to {1} {2}*{3}={4}".format(
+            move[0], move[1], times, format_votes(move[2], decimals),
+            format_votes(times * move[2], decimals))
         logger.debug(LOG_MESSAGE.format(action=Action.TRANSFER,
                                         desc=description))
 
-    allocated[selected][:] = [x for x in allocated[selected]
-                              if x not in transferred]
+    allocated[selected][:] = remaining
 
 
 def elect_reject(candidate, vote_count, constituencies, quota_limit,
                  current_round, elected, rejected, constituencies_elected,
-                 logger=logger):
+                 logger=logger, decimals=None):
     """Elects or rejects the candidate, based on quota restrictions.
 
     If there are no quota limits, the candidate is elected. If there
@@ -209,7 +240,7 @@ def elect_reject(candidate, vote_count, constituencies, quota_limit,
     # If the quota limit has been exceeded, reject the candidate
     if quota_exceeded:
         rejected.append((candidate, current_round, vote_count[candidate]))
-        d = candidate + " = " + str(vote_count[candidate])
+        d = candidate + " = " + format_votes(vote_count[candidate], decimals)
         msg = LOG_MESSAGE.format(action=Action.QUOTA, desc=d)
         logger.info(msg)
         return False
@@ -219,35 +250,43 @@ def elect_reject(candidate, vote_count, constituencies, quota_limit,
         if constituencies:
             current_constituency = constituencies[candidate]
             constituencies_elected[current_constituency] += 1
-        d = candidate + " = " + str(vote_count[candidate])
+        d = candidate + " = " + format_votes(vote_count[candidate], decimals)
         msg = LOG_MESSAGE.format(action=Action.ELECT, desc=d)
         logger.info(msg)
         return True
 
 
-def count_description(vote_count, candidates):
+def count_description(vote_count, candidates, decimals=None):
     """Returns a string with count results.
 
     The string is of the form of {0} = {1} separated by ; where each {0}
     is a candidate and each {1} is the corresponding vote count.
     """
 
-    return ';'.join(["{0} = {1}".format(x, vote_count[x]) for x in candidates])
+    return ';'.join(["{0} = {1}".format(x, format_votes(vote_count[x],
+                                                        decimals))
+                     for x in candidates])
 
 
-def update_candidate_counts(full_data, current_round, vote_count, hopefuls):
+def update_candidate_counts(full_data, current_round, vote_count, hopefuls,
+                            decimals=None):
     hopeful_set = set(hopefuls)
     for candidate, candidate_rounds in full_data:
         if candidate not in hopeful_set:
             continue
 
-        vote_no_decimal = float(vote_count[candidate]) * 10000
-        vote_rounded = int(round(vote_no_decimal))
+        if decimals is None:
+            vote_no_decimal = float(vote_count[candidate]) * 10000
+            vote_rounded = int(round(vote_no_decimal))
+        else:
+            # fixed point counts are rounded half up to 4 decimals
+            scale = 10 ** decimals
+            vote_rounded = (vote_count[candidate] * 20000 + scale) // (2 * scale)
         candidate_rounds.append([current_round, vote_rounded])
 
 
 def count_stv(ballots, seats, droop=True, constituencies=None,
-              quota_limit=0, rnd_gen=None, logger=logger):
+              quota_limit=0, rnd_gen=None, logger=logger, decimals=None):
     """Performs a STV vote for the given ballots and number of seats.
 
     If droop is true the election threshold is calculated according to the
@@ -261,6 +300,12 @@ def count_stv(ballots, seats, droop=True, constituencies=None,
     The quota_limit, if different than zero, is the limit of candidates that
     can be elected by a constituency. It can also be a list of per-constituency
     limits.
+
+    If decimals is given, votes are counted in fixed point integers of
+    10 ** -decimals of a vote instead of floats. Transferred ballot
+    values are rounded down to that precision, so the count is exact
+    and the same on every platform. The vote counts returned are still
+    in votes, and the log shows them as exact decimals.
     """
 
     allocated = {} # The allocation of ballots to candidates
@@ -292,17 +337,28 @@ def count_stv(ballots, seats, droop=True, constituencies=None,
 
     logger.info(LOG_MESSAGE.format(action=Action.THRESHOLD,
                                    desc=threshold))
+    if decimals is None:
+        unit = None
+        full_weight = 1.0
+    else:
+        unit = 10 ** decimals
+        threshold *= unit
+        full_weight = 1
     # Do initial count
     for ballot in ballots:
         selected = ballot.candidates[0]
         for candidate in ballot.candidates:
-            if candidate not in candidates:
+            if candidate not in vote_count:
                 candidates.append(candidate)
                 vote_count[candidate] = 0
             if candidate not in allocated:
                 allocated[candidate] = []
         allocated[selected].append(ballot)
-        vote_count[selected] += 1
+        if unit is None:
+            vote_count[selected] += 1
+        else:
+            ballot._value = unit
+            vote_count[selected] += unit
 
     # In the beginning, all candidates are hopefuls
     hopefuls = [x for x in candidates]
@@ -318,14 +374,16 @@ def count_stv(ballots, seats, droop=True, constituencies=None,
         # Log round
         logger.info(LOG_MESSAGE.format(action=Action.COUNT_ROUND,
                                        desc=current_round))
-        # Log count
-        description = count_description(vote_count, hopefuls)
 
         # using this for testing
-        update_candidate_counts(full_data, current_round, vote_count, hopefuls)
+        update_candidate_counts(full_data, current_round, vote_count, hopefuls,
+                                decimals=decimals)
 
-        logger.info(LOG_MESSAGE.format(action=Action.COUNT,
-                                       desc=description))
+        # Log count
+        if logger.isEnabledFor(logging.INFO):
+            description = count_description(vote_count, hopefuls, decimals)
+            logger.info(LOG_MESSAGE.format(action=Action.COUNT,
+                                           desc=description))
         hopefuls_sorted = sorted(hopefuls, key=vote_count.get, reverse=True)
         # If there is a surplus record it so that we can try to
         # redistribute the best candidate's votes according to their
@@ -348,18 +406,24 @@ def count_stv(ballots, seats, droop=True, constituencies=None,
                                        current_round,
                                        elected, rejected,
                                        constituencies_elected,
-                                       logger=logger)
+                                       logger=logger, decimals=decimals)
             if not was_elected:
-                redistribute_ballots(best_candidate, 1.0, hopefuls, allocated,
-                                     vote_count, logger=logger)
+                redistribute_ballots(best_candidate, full_weight,
+                                     set(hopefuls), allocated, vote_count,
+                                     logger=logger, decimals=decimals)
             if was_elected and surplus > 0:
                 # Calculate the weight for this round
-                weight = float(surplus) / vote_count[best_candidate]
+                if unit is None:
+                    weight = float(surplus) / vote_count[best_candidate]
+                else:
+                    weight = FixedPointWeight(surplus,
+                                              vote_count[best_candidate])
                 # Find the next eligible preference for each one of the ballots
                 # cast for the candidate, and transfer the vote to that
                 # candidate with its value adjusted by the correct weight.
-                redistribute_ballots(best_candidate, weight, hopefuls,
-                                     allocated, vote_count, logger=logger)
+                redistribute_ballots(best_candidate, weight, set(hopefuls),
+                                     allocated, vote_count, logger=logger,
+                                     decimals=decimals)
         # If nobody can get elected, take the least hopeful candidate
         # (i.e., the hopeful candidate with the less votes) and
         # redistribute that candidate's votes.
@@ -372,11 +436,13 @@ def count_stv(ballots, seats, droop=True, constituencies=None,
                                                     logger=logger)
             hopefuls.remove(worst_candidate)
             eliminated.append(worst_candidate)
-            d = worst_candidate + " = " + str(vote_count[worst_candidate])
+            d = worst_candidate + " = " + format_votes(
+                vote_count[worst_candidate], decimals)
             msg = LOG_MESSAGE.format(action=Action.ELIMINATE, desc=d)
             logger.info(msg)
-            redistribute_ballots(worst_candidate, 1.0, hopefuls, allocated,
-                                 vote_count, logger=logger)
+            redistribute_ballots(worst_candidate, full_weight, set(hopefuls),
+                                 allocated, vote_count, logger=logger,
+                                 decimals=decimals)
 
         current_round += 1
         num_hopefuls = len(hopefuls)
@@ -387,22 +453,29 @@ def count_stv(ballots, seats, droop=True, constituencies=None,
     while (seats - num_elected) > 0 and len(eliminated) > 0:
         logger.info(LOG_MESSAGE.format(action=Action.COUNT_ROUND,
                                        desc=current_round))
-        description = count_description(vote_count, eliminated)
-
-        logger.info(LOG_MESSAGE.format(action=Action.ZOMBIES,
-                                       desc=description))
+        if logger.isEnabledFor(logging.INFO):
+            description = count_description(vote_count, eliminated,
+                                            decimals)
+            logger.info(LOG_MESSAGE.format(action=Action.ZOMBIES,
+                                           desc=description))
         best_candidate = eliminated.pop()
         was_elected = elect_reject(best_candidate, vote_count, constituencies,
                                    quota_limit, current_round,
                                    elected, rejected, constituencies_elected,
-                                   logger=logger)
+                                   logger=logger, decimals=decimals)
         if was_elected:
             update_candidate_counts(full_data, current_round, vote_count,
-                                    [best_candidate])
+                                    [best_candidate], decimals=decimals)
 
         current_round += 1
         num_elected = len(elected)
 
+    if unit is not None:
+        elected = [(candidate, elected_round, votes / unit)
+                   for candidate, elected_round, votes in elected]
+        for candidate in vote_count:
+            vote_count[candidate] /= unit
+
     return elected, vote_count, full_data
 
 
@@ -449,6 +522,9 @@ def main(cmd=None):
                         dest='random', help='random selection results')
     parser.add_argument('-l', '--loglevel', default=logging.INFO,
                         dest='loglevel', help='logging level')
+    parser.add_argument('-d', '--decimals', type=int, default=None,
+                        dest='decimals',
+                        help='count in fixed point with this many decimals')
     if cmd is None:
         cmd = sys.argv[1:]
     args = parser.parse_args(cmd)
@@ -489,7 +565,8 @@ def main(cmd=None):
                                                  constituencies,
                                                  quota,
                                                  args.random,
-                                                 logger=logger)
+                                                 logger=logger,
+                                                 decimals=args.decimals)
 
     return elected
 
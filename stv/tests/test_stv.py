@@ -1,5 +1,10 @@
 
-from stv.stv import main
+from stv import stv
+from stv.stv import main, count_stv, Ballot
+from hashlib import sha256
+import io
+import logging
+import random
 import tempfile
 import os
 import csv
@@ -114,3 +119,175 @@ def test_random():
     ])
     assert run_stv(ballots, seats=1, random=['A']) == [('B', 2, 20)]
     assert run_stv(ballots, seats=1, random=['B']) == [('A', 2, 20)]
+
+
+def test_ballot_state():
+    ballots = [Ballot(['A', 'B']), Ballot(['B', 'A'])]
+    ballots[0].add_weight(0.5)
+    ballots[0].current_preference = 1
+    assert ballots[0].get_value() == 0.5
+    assert ballots[1].get_value() == 1.0
+    assert ballots[1].current_preference == 0
+    assert not hasattr(ballots[1], '__dict__')
+
+
+def count_with_log(monkeypatch, ballots, seats, constituencies, quota=0,
+                   state=0):
+    # ties are broken at random, seeded the same way for every count
+    monkeypatch.setattr(stv, 'seed', lambda: random.seed(state))
+    stream = io.StringIO()
+    logger = logging.Logger('stv-test')
+    logger.addHandler(logging.StreamHandler(stream))
+    logger.setLevel(logging.DEBUG)
+    ballots = [Ballot(list(ballot)) for ballot in ballots]
+    result = count_stv(ballots, seats, True, constituencies, quota,
+                       logger=logger)
+    return result, stream.getvalue().splitlines()
+
+
+def test_fixture_counts(monkeypatch):
+    # Results and logs of the counts before ballots kept per-ballot state
+    ballots = make_ballots([
+        ('A', 4),
+        ('BA', 2),
+        ('CD', 8),
+        ('CE', 4),
+        ('D', 1),
+        ('E', 1),
+    ])
+    (elected, vote_count, full_data), log = count_with_log(monkeypatch,
+                                                           ballots, 3, {})
+    assert elected == [('C', 1, 12), ('A', 3, 6.0), ('D', 5, 5.0)]
+    assert vote_count == {'A': 6.0, 'B': 0.0, 'C': 6.0, 'D': 5.0, 'E': 3.0}
+    assert full_data == [
+        ['A', [[1, 40000], [2, 40000], [3, 60000]]],
+        ['B', [[1, 20000], [2, 20000]]],
+        ['C', [[1, 120000]]],
+        ['D', [[1, 10000], [2, 50000], [3, 50000], [4, 50000], [5, 50000]]],
+        ['E', [[1, 10000], [2, 30000], [3, 30000], [4, 30000]]],
+    ]
+    assert log == [
+        '^THRESHOLD 6',
+        '@ROUND 1',
+        '.COUNT A = 4;B = 2;C = 12;D = 1;E = 1',
+        '+ELECT C = 12',
+        '>TRANSFER from C to D 8*0.5=4.0',
+        '>TRANSFER from C to E 4*0.5=2.0',
+        '@ROUND 2',
+        '.COUNT A = 4;B = 2;D = 5.0;E = 3.0',
+        '-ELIMINATE B = 2',
+        '>TRANSFER from B to A 2*1.0=2.0',
+        '@ROUND 3',
+        '.COUNT A = 6.0;D = 5.0;E = 3.0',
+        '+ELECT A = 6.0',
+        '@ROUND 4',
+        '.COUNT D = 5.0;E = 3.0',
+        '-ELIMINATE E = 3.0',
+        '@ROUND 5',
+        '.COUNT D = 5.0',
+        '+ELECT D = 5.0',
+    ]
+
+    ballots = make_ballots([
+        ('AB', 10),
+        ('BA', 5),
+        ('C', 1)
+    ])
+    constituencies = {'A': 0, 'B': 0, 'C': 1}
+    (elected, vote_count, full_data), log = count_with_log(
+        monkeypatch, ballots, 2, constituencies, quota=1)
+    assert elected == [('A', 1, 10), ('C', 3, 1)]
+    assert vote_count == {'A': 5.9999999999999964, 'B': 9.000000000000004,
+                          'C': 1}
+    assert full_data == [
+        ['A', [[1, 100000]]],
+        ['B', [[1, 50000], [2, 90000]]],
+        ['C', [[1, 10000], [2, 10000], [3, 10000]]],
+    ]
+    assert log == [
+        '^THRESHOLD 6',
+        '@ROUND 1',
+        '.COUNT A = 10;B = 5;C = 1',
+        '+ELECT A = 10',
+        '>TRANSFER from A to B 10*0.4=4.0',
+        '@ROUND 2',
+        '.COUNT B = 9.000000000000004;C = 1',
+        '!QUOTA B = 9.000000000000004',
+        '@ROUND 3',
+        '.COUNT C = 1',
+        '+ELECT C = 1',
+    ]
+
+
+def test_stress_count(monkeypatch):
+    rng = random.Random(1)
+    candidates = [str(i) for i in range(30)]
+    popularity = [rng.paretovariate(1.2) for _ in candidates]
+    ballots = []
+    for _ in range(20000):
+        ranked = sorted(candidates,
+                        key=lambda c: -popularity[int(c)] * rng.random())
+        ballots.append(ranked[:rng.randint(1, 8)])
+    constituencies = dict((c, int(c) % 4) for c in candidates)
+
+    (elected, vote_count, full_data), log = count_with_log(
+        monkeypatch, ballots, 10, constituencies, quota=3, state=1)
+
+    # The same count took 4.2s before ballots kept per-ballot state,
+    # and gave these results and log
+    assert elected == [
+        ('17', 1, 8993),
+        ('22', 2, 10282.474480152263),
+        ('18', 3, 7320.401386834367),
+        ('1', 4, 4117.362192343882),
+        ('10', 5, 3832.690521611187),
+        ('7', 6, 2312.4085740531496),
+        ('12', 27, 1598.364736649361),
+        ('15', 29, 1224.1639254755041),
+        ('21', 31, 40.183956008497454),
+        ('4', 33, 14.689359706758008),
+    ]
+    counts = repr((vote_count, full_data)).encode()
+    assert sha256(counts).hexdigest() == \
+        'daec20868b5b06cfb0f50ca6357834fe4f36b0724340c6407ed9604b762d6a6d'
+    assert len(log) == 1140
+    assert sha256(('\n'.join(log) + '\n').encode()).hexdigest() == \
+        'c4a23ac958e4d63355e89186e3dd3b31f3138acd25ff701f8325eb17bf78d027'
+
+
+def test_fixed_point():
+    ballots = make_ballots([('AB', 7), ('B', 1), ('C', 3)])
+    ballots = [Ballot(ballot) for ballot in ballots]
+    stream = io.StringIO()
+    logger = logging.Logger('stv-test')
+    logger.addHandler(logging.StreamHandler(stream))
+    logger.setLevel(logging.DEBUG)
+    elected, vote_count, full_data = count_stv(ballots, 2, True, {},
+                                               logger=logger,
+                                               decimals=4)
+
+    # 3/7 of each ballot is rounded down to 0.4285 of a vote
+    assert elected == [('A', 1, 7.0), ('B', 3, 3.9995)]
+    assert vote_count == {'A': 4.0005, 'B': 3.9995, 'C': 3.0}
+    assert dict(full_data)['B'] == [[1, 10000], [2, 39995], [3, 39995]]
+    log = stream.getvalue().splitlines()
+    assert '>TRANSFER from A to B 7*0.4285=2.9995' in log
+    assert '+ELECT B = 3.9995' in log
+
+
+def test_fixed_point_simple():
+    ballots = make_ballots([
+        ('A', 4),
+        ('BA', 2),
+        ('CD', 8),
+        ('CE', 4),
+        ('D', 1),
+        ('E', 1),
+    ])
+    with temp_dir() as d:
+        ballots_fname = os.path.join(d, 'ballots.csv')
+        with open(ballots_fname, 'w') as f:
+            csv.writer(f).writerows(ballots)
+        elected = main(['--ballots', ballots_fname, '--seats', '3',
+                        '--decimals', '6'])
+    assert elected == [('C', 1, 12.0), ('A', 3, 6.0), ('D', 5, 5.0)]
@@ -2,6 +2,7 @@
 
 import os
 from celery import Celery
+from celery.signals import worker_process_shutdown
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings.local')
@@ -21,3 +22,10 @@ app.autodiscover_tasks()
 @app.task(bind=True)
 def debug_task(self):
     print(('Request: {0!r}'.format(self.request)))
+
+
+@worker_process_shutdown.connect
+def shutdown_crypto_pool(**kwargs):
+    # pool processes exit without running atexit handlers
+    from zeus.core import close_crypto_pool
+    close_crypto_pool()
@@ -3,31 +3,398 @@
 
 
 import sys
+import os
+import atexit
+import marshal
+import tempfile
+import threading
 from datetime import datetime
 from random import randint, choice as rand_choice
 from hashlib import sha256
 from itertools import zip_longest, cycle, chain, repeat
 from math import log
 from bisect import bisect_right
+from array import array
+from contextlib import contextmanager, nullcontext
+from collections import deque
+from collections.abc import Mapping, Sequence
 import Crypto.Util.number as number
 from Crypto import Random
 from billiard import Pool
 import json
 from json import load as json_load
+from json.encoder import encode_basestring_ascii
 from time import time
 
-from gmpy2 import mpz
 _pow = pow
-inverse = number.inverse
+
+# Arithmetic backend: gmpy2 unless it is missing or ZEUS_ARITHMETIC is
+# set to 'python'. Hot loops keep their values as mpz, which is a plain
+# int in the pure Python backend, and convert them with int() only when
+# they are returned, to be stored or serialised.
+ARITHMETIC = os.environ.get('ZEUS_ARITHMETIC', 'gmpy2')
+if ARITHMETIC != 'python':
+    try:
+        import gmpy2
+    except ImportError:
+        ARITHMETIC = 'python'
+    else:
+        ARITHMETIC = 'gmpy2'
+
+PRIMALITY_TEST_ROUNDS = 64
+
+
+def _python_invert(u, v):
+    try:
+        u_inverse = number.inverse(u, v)
+    except ValueError:
+        u_inverse = 0
+    if (u * u_inverse) % v != 1:
+        raise ZeroDivisionError("not invertible")
+    return u_inverse
+
+
+def _python_jacobi(a, n):
+    a %= n
+    result = 1
+    while a:
+        while not a & 1:
+            a >>= 1
+            if n & 7 in (3, 5):
+                result = -result
+        a, n = n, a
+        if a & 3 == 3 and n & 3 == 3:
+            result = -result
+        a %= n
+    return result if n == 1 else 0
+
+
+if ARITHMETIC == 'gmpy2':
+    from gmpy2 import mpz, jacobi, invert, powmod
+
+    def inverse(u, v):
+        try:
+            return int(invert(u, v))
+        except ZeroDivisionError:
+            return number.inverse(u, v)
+
+    def is_prime(n):
+        return gmpy2.is_prime(n, PRIMALITY_TEST_ROUNDS)
+
+else:
+    mpz = int
+    powmod = _pow
+    inverse = number.inverse
+    invert = _python_invert
+    jacobi = _python_jacobi
+
+    def is_prime(n):
+        return number.isPrime(n)
 
 
 def pow(b, e, m):
-    return int(_pow(mpz(b), e, m))
+    return int(powmod(b, e, m))
 
 
 bit_length = lambda num: num.bit_length()
 
-inverse = number.inverse
+
+FIXED_BASE_WINDOW = 6
+FIXED_BASE_CACHE_SIZE = 8
+
+_fixed_base_tables = {}
+
+
+def get_fixed_base_table(base, modulus, window=FIXED_BASE_WINDOW):
+    """Return the precomputed powers table for (base, modulus).
+
+    Row i of the table holds base^(d * 2^(window*i)) for every window
+    digit d, covering exponents up to the bit length of the modulus.
+    Tables are cached per (base, modulus) so they are built once per
+    process and are inherited by forked pool workers.
+    """
+    key = (base, modulus)
+    if key in _fixed_base_tables:
+        return _fixed_base_tables[key]
+
+    while len(_fixed_base_tables) >= FIXED_BASE_CACHE_SIZE:
+        del _fixed_base_tables[next(iter(_fixed_base_tables))]
+
+    nr_rows = (bit_length(modulus) - 1) // window + 1
+    nr_digits = 1 << window
+    m = mpz(modulus)
+    b = mpz(base) % m
+    rows = []
+    append = rows.append
+    for _ in range(nr_rows):
+        row = [mpz(1)] * nr_digits
+        r = row[0]
+        for d in range(1, nr_digits):
+            r = (r * b) % m
+            row[d] = r
+        append(row)
+        b = (r * b) % m
+
+    table = (window, bit_length(modulus), m, rows)
+    _fixed_base_tables[key] = table
+    return table
+
+
+def precompute_fixed_base(modulus, *bases):
+    for base in bases:
+        get_fixed_base_table(base, modulus)
+
+
+def fixed_base_pow_mpz(base, exponent, modulus):
+    """fixed_base_pow, returning an mpz to be used in further
+    arithmetic."""
+    window, nr_bits, m, rows = get_fixed_base_table(base, modulus)
+    if exponent < 0 or bit_length(exponent) > nr_bits:
+        return powmod(base, exponent, m)
+
+    mask = (1 << window) - 1
+    acc = mpz(1)
+    for row in rows:
+        if not exponent:
+            break
+        digit = exponent & mask
+        if digit:
+            acc = (acc * row[digit]) % m
+        exponent >>= window
+
+    return acc
+
+
+def fixed_base_pow(base, exponent, modulus):
+    """Compute base^exponent % modulus for a base that is reused a lot.
+
+    Uses the windowed precomputed table for (base, modulus), building it
+    on first use, so that each exponentiation costs about
+    bits/window modular multiplications instead of a full square-and-multiply.
+    """
+    return int(fixed_base_pow_mpz(base, exponent, modulus))
+
+
+MULTI_POW_WINDOW = 5
+
+
+def _sliding_window_digits(exponent, window):
+    # Right-to-left sliding window recoding:
+    # exponent == sum(digit << position) with odd digits < 2^window
+    digits = []
+    append = digits.append
+    mask = (1 << window) - 1
+    position = 0
+    while exponent:
+        if exponent & 1:
+            append((position, exponent & mask))
+            exponent >>= window
+            position += window
+        else:
+            zeros = bit_length(exponent & -exponent) - 1
+            exponent >>= zeros
+            position += zeros
+    return digits
+
+
+def _straus_pow(bases, exponents, modulus, window=MULTI_POW_WINDOW):
+    m = mpz(modulus)
+    multipliers = {}
+    top = -1
+    nr_odd = 1 << (window - 1)
+    for base, exponent in zip(bases, exponents):
+        b = mpz(base) % m
+        b2 = (b * b) % m
+        odd_powers = [b] * nr_odd
+        for k in range(1, nr_odd):
+            odd_powers[k] = (odd_powers[k - 1] * b2) % m
+        for position, digit in _sliding_window_digits(exponent, window):
+            if position in multipliers:
+                multipliers[position].append(odd_powers[digit >> 1])
+            else:
+                multipliers[position] = [odd_powers[digit >> 1]]
+            if position > top:
+                top = position
+
+    acc = mpz(1)
+    for position in range(top, -1, -1):
+        acc = (acc * acc) % m
+        if position in multipliers:
+            for multiplier in multipliers[position]:
+                acc = (acc * multiplier) % m
+    return acc
+
+
+def multi_pow(bases, exponents, modulus):
+    """Compute the product of all base^exponent % modulus.
+
+    Bases with a cached fixed-base table are exponentiated through it,
+    the rest share their squarings using interleaved (Straus/Shamir)
+    exponentiation with sliding windows.
+    """
+    product = mpz(1)
+    m = mpz(modulus)
+    variable = []
+    for base, exponent in zip(bases, exponents):
+        if exponent < 0:
+            product = (product * powmod(base, exponent, m)) % m
+        elif (base, modulus) in _fixed_base_tables:
+            product = (product *
+                       fixed_base_pow_mpz(base, exponent, modulus)) % m
+        elif exponent:
+            variable.append((bit_length(exponent), base, exponent))
+
+    # The shared squarings are as many as the bits of the largest exponent,
+    # so exponents much larger than all others are better off on their own.
+    variable.sort(reverse=True)
+    while len(variable) > 1 and variable[1][0] * 2 < variable[0][0]:
+        nr_bits, base, exponent = variable.pop(0)
+        product = (product * powmod(base, exponent, m)) % m
+
+    if len(variable) == 1:
+        nr_bits, base, exponent = variable[0]
+        product = (product * powmod(base, exponent, m)) % m
+    elif variable:
+        bases = [v[1] for v in variable]
+        exponents = [v[2] for v in variable]
+        product = (product * _straus_pow(bases, exponents, modulus)) % m
+    return int(product)
+
+
+CRYPTO_POOL_CHUNK_SIZE = 128
+CRYPTO_POOL_CACHE_SIZE = 4
+
+_crypto_pool = None
+_shared_ciphers = {}
+
+
+def ciphers_hash(ciphers):
+    hasher = sha256()
+    update = hasher.update
+    for cipher in ciphers:
+        update(("%x:%x;" % (cipher[0], cipher[1])).encode())
+    return hasher.hexdigest()
+
+
+def get_shared_ciphers(ref):
+    """Return the cipher list behind a reference made by CryptoPool.share.
+
+    Runs in pool workers; each list is loaded once per worker process
+    and kept for the tasks that follow, across mixing, verification
+    and decryption.
+    """
+    key, path = ref
+    if key in _shared_ciphers:
+        return _shared_ciphers[key]
+
+    while len(_shared_ciphers) >= CRYPTO_POOL_CACHE_SIZE:
+        del _shared_ciphers[next(iter(_shared_ciphers))]
+
+    with open(path, 'rb') as f:
+        ciphers = marshal.load(f)
+    _shared_ciphers[key] = ciphers
+    return ciphers
+
+
+class CryptoPool(object):
+    """Worker processes kept alive for the whole lifetime of the
+    owning process (or Celery worker), so that successive mixing,
+    verification and decryption phases do not pay for a fork each."""
+
+    def __init__(self, nr_parallel):
+        self.nr_parallel = nr_parallel
+        self.pid = os.getpid()
+        self.shared_dir = tempfile.mkdtemp(prefix='zeus-pool-')
+        self.shared = {}
+        self.pool = Pool(nr_parallel, Random.atfork)
+
+    def share(self, ciphers):
+        """Make ciphers available to the workers and return a reference
+        to pass in task arguments instead of the list itself."""
+        key = ciphers_hash(ciphers)
+        shared = self.shared
+        if key in shared:
+            return shared[key]
+
+        while len(shared) >= CRYPTO_POOL_CACHE_SIZE:
+            old_key = next(iter(shared))
+            os.unlink(shared.pop(old_key)[1])
+
+        path = os.path.join(self.shared_dir, key)
+        with open(path + '.tmp', 'wb') as f:
+            marshal.dump([[int(c[0]), int(c[1])] for c in ciphers], f)
+        os.rename(path + '.tmp', path)
+        ref = (key, path)
+        shared[key] = ref
+        return ref
+
+    def imap(self, func, iterable, chunksize=1):
+        return self.pool.imap(func, iterable, chunksize)
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        return self.pool.imap_unordered(func, iterable, chunksize)
+
+    def close(self):
+        if self.pid != os.getpid():
+            return
+        # Exiting billiard workers wait up to 30s for the pool to count
+        # their results as consumed, which it never does for imap jobs.
+        # The counters are private, hence billiard is pinned to 3.6.x.
+        counters = getattr(self.pool, '_on_ready_counters', None) or {}
+        for counter in counters.values():
+            counter.value = 2**31 - 1
+        self.pool.terminate()
+        self.pool.join()
+        for key, path in self.shared.values():
+            os.unlink(path)
+        self.shared.clear()
+        os.rmdir(self.shared_dir)
+
+
+def get_crypto_pool(nr_parallel):
+    """Return the process-wide CryptoPool, creating it on first use or
+    when a different number of workers is requested."""
+    global _crypto_pool
+    pool = _crypto_pool
+    if pool is not None and pool.pid == os.getpid():
+        if pool.nr_parallel == nr_parallel:
+            return pool
+        pool.close()
+    _crypto_pool = CryptoPool(nr_parallel)
+    return _crypto_pool
+
+
+def discard_crypto_pool(pool):
+    """Terminate pool, cancelling the tasks still queued on it, so that
+    the next phase gets a fresh one instead of waiting behind them."""
+    global _crypto_pool
+    if _crypto_pool is pool:
+        _crypto_pool = None
+    pool.close()
+
+
+@contextmanager
+def crypto_pool(nr_parallel):
+    """Yield the process-wide CryptoPool, discarding it if the block
+    fails with work still outstanding."""
+    pool = get_crypto_pool(nr_parallel)
+    try:
+        yield pool
+    except BaseException:
+        discard_crypto_pool(pool)
+        raise
+
+
+def close_crypto_pool():
+    """Shut the process-wide CryptoPool down."""
+    global _crypto_pool
+    pool = _crypto_pool
+    _crypto_pool = None
+    if pool is not None:
+        pool.close()
+
+
+atexit.register(close_crypto_pool)
 
 
 class ZeusError(Exception):
@@ -38,10 +405,19 @@ ALPHA = 0
 BETA = 1
 PROOF = 2
 
+DDH_BATCH_SIZE = 128
+DECRYPT_BATCH_SIZE = 4096
+DDH_BATCH_EXPONENT_BITS = 64
+VOTE_SIGNATURE_BATCH_SIZE = 64
+
 VOTER_KEY_CEIL = 2**256
 VOTER_SLOT_CEIL = 2**48
 MIN_MIX_ROUNDS = 3
 
+ELECTION_CONSTANTS = ('cryptosystem', 'election_public',
+                      'zeus_public', 'zeus_secret',
+                      'trustees', 'candidates')
+
 V_CAST_VOTE = 'CAST VOTE'
 V_PUBLIC_AUDIT = 'PUBLIC AUDIT'
 V_PUBLIC_AUDIT_FAILED = 'PUBLIC AUDIT FAILED'
@@ -162,11 +538,132 @@ def get_timestamp():
     return datetime.strftime(datetime.utcnow(), "%Y-%m-%dT%H:%M:%S.%fZ")
 
 
-def to_canonical(obj, out=None):
-    if out:
-        json.dump(obj, out, sort_keys=True)
+CANONICAL_CHUNK_SIZE = 1024
+CANONICAL_WRITE_SIZE = 1 << 16
+_canonical_scalars = (str, int, float, bool, type(None))
+
+
+def _canonical_default(obj):
+    # Lazy containers, such as mix file views, are written out in full
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, Sequence):
+        return list(obj)
+    m = "Object of type %s is not JSON serializable" % type(obj).__name__
+    raise TypeError(m)
+
+
+def _canonical_dumps(obj):
+    return json.dumps(obj, sort_keys=True, default=_canonical_default)
+
+
+def _canonical_flat(obj):
+    # scalars, and lists or dicts of scalars such as ciphers and ballots
+    if isinstance(obj, _canonical_scalars):
+        return 1
+    if isinstance(obj, (list, tuple)):
+        values = obj
+    elif isinstance(obj, dict):
+        values = obj.values()
     else:
-        return json.dumps(obj, sort_keys=True)
+        return 0
+    for value in values:
+        if not isinstance(value, _canonical_scalars):
+            return 0
+    return 1
+
+
+def _canonical_key(key):
+    if not isinstance(key, str):
+        key = _canonical_dumps(key)
+    return encode_basestring_ascii(key)
+
+
+def iter_canonical(obj):
+    """Yield the canonical JSON of obj in pieces that join up to
+    to_canonical(obj), encoding at most CANONICAL_CHUNK_SIZE flat
+    values at a time."""
+    if _canonical_flat(obj):
+        yield _canonical_dumps(obj)
+        return
+
+    if isinstance(obj, Mapping):
+        yield '{'
+        sep = ''
+        for key, value in sorted(obj.items()):
+            yield sep + _canonical_key(key) + ': '
+            sep = ', '
+            yield from iter_canonical(value)
+        yield '}'
+        return
+
+    if not isinstance(obj, Sequence):
+        _canonical_default(obj)
+
+    yield '['
+    sep = ''
+    batch = []
+    for value in obj:
+        if _canonical_flat(value):
+            batch.append(value)
+            if len(batch) >= CANONICAL_CHUNK_SIZE:
+                yield sep + _canonical_dumps(batch)[1:-1]
+                sep = ', '
+                batch = []
+            continue
+        if batch:
+            yield sep + _canonical_dumps(batch)[1:-1]
+            sep = ', '
+            batch = []
+        yield sep
+        sep = ', '
+        yield from iter_canonical(value)
+    if batch:
+        yield sep + _canonical_dumps(batch)[1:-1]
+    yield ']'
+
+
+def to_canonical(obj, out=None):
+    if not out:
+        return _canonical_dumps(obj)
+
+    write = out.write
+    pieces = []
+    size = 0
+    for piece in iter_canonical(obj):
+        pieces.append(piece)
+        size += len(piece)
+        if size >= CANONICAL_WRITE_SIZE:
+            write(''.join(pieces))
+            pieces = []
+            size = 0
+    if pieces:
+        write(''.join(pieces))
+
+
+class HashingSink(object):
+    """Write-only stream that hashes what is written to it and passes
+    it on, encoded, to an optional binary stream."""
+
+    def __init__(self, out=None):
+        self.hasher = sha256()
+        self.out = out
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.hasher.update(data)
+        if self.out is not None:
+            self.out.write(data)
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+
+def canonical_hash(obj):
+    sink = HashingSink()
+    to_canonical(obj, out=sink)
+    return sink.hexdigest()
 
 
 def from_canonical(inp):
@@ -565,12 +1062,12 @@ def validate_cryptosystem(modulus, generator, order, teller=_teller):
             raise AssertionError(m)
 
     with task("is the modulus prime?"):
-        if not number.isPrime(p):
+        if not is_prime(p):
             m = "MODULUS NOT PRIME"
             raise AssertionError(m)
 
     with task("is the ElGamal group order prime?"):
-        if not number.isPrime(q):
+        if not is_prime(q):
             m = "ELGAMAL GROUP ORDER NOT PRIME"
             raise AssertionError(m)
 
@@ -936,6 +1433,81 @@ def gamma_decode(sumus, nr_candidates=None, max_choices=None):
     return choices
 
 
+def gamma_decode_many(encoded_list, nr_candidates=None, max_choices=None,
+                      absolute=False):
+    """Decode a list of encoded ballots, converting them with
+    to_absolute_answers_many if absolute is true.
+
+    The encoded values are sorted and deduplicated first, so that
+    identical ballots are decoded only once. Each ballot still gets a
+    list of its own.
+    """
+    distinct = sorted(set(encoded_list))
+    selections = [gamma_decode(encoded, nr_candidates, max_choices)
+                  for encoded in distinct]
+    if absolute:
+        selections = to_absolute_answers_many(selections, nr_candidates)
+    decoded = dict(zip(distinct, selections))
+    return [list(decoded[encoded]) for encoded in encoded_list]
+
+
+def pack_selections(selections, nr_candidates):
+    """Pack ballot selections into little-endian 16-bit integers: the
+    number of candidates and of selections, then the length and the
+    choices of each selection."""
+    if not 0 <= nr_candidates <= 0xffff:
+        m = "Too many candidates to pack: %d" % (nr_candidates,)
+        raise ZeusError(m)
+    packed = array('H', [nr_candidates, len(selections) & 0xffff,
+                         len(selections) >> 16])
+    append = packed.append
+    extend = packed.extend
+    for selection in selections:
+        append(len(selection))
+        extend(selection)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def pack_decoded_ballots(encoded_list, nr_candidates):
+    """Decode the ballots in encoded_list to absolute answers and pack
+    them with pack_selections. Returns None if any of them is not a
+    valid encoding for nr_candidates, leaving them to the count."""
+    if nr_candidates > 0xffff:
+        return None
+    max_encoded = gamma_encoding_max(nr_candidates)
+    if any(encoded > max_encoded for encoded in encoded_list):
+        return None
+    selections = gamma_decode_many(encoded_list, nr_candidates,
+                                   nr_candidates, absolute=True)
+    return pack_selections(selections, nr_candidates)
+
+
+def unpack_selections(data):
+    """Inverts pack_selections, returning the number of candidates and
+    the list of selections."""
+    packed = array('H')
+    packed.frombytes(bytes(data))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    nr_candidates = packed[0]
+    nr_selections = packed[1] | (packed[2] << 16)
+    selections = []
+    append = selections.append
+    pos = 3
+    for _ in range(nr_selections):
+        if pos >= len(packed):
+            break
+        end = pos + 1 + packed[pos]
+        append(packed[pos + 1:end].tolist())
+        pos = end
+    if pos != len(packed) or len(selections) != nr_selections:
+        m = "Invalid packed selections"
+        raise ZeusError(m)
+    return nr_candidates, selections
+
+
 def verify_gamma_encoding(n, completeness=1):
     choice_sets = {}
     encode_limit = get_offsets(n)[-1]
@@ -1193,11 +1765,13 @@ def range_split_candidates(candidates_and_points):
     return candidates, pointlist
 
 
-def gamma_decode_to_range_ballot(encoded, candidates_and_points):
+def gamma_decode_to_range_ballot(encoded, candidates_and_points,
+                                 permutation=None):
     nr_candidates = len(candidates_and_points)
-    selection = gamma_decode(encoded, nr_candidates=nr_candidates,
-                             max_choices=nr_candidates)
-    permutation = to_absolute_answers(selection, nr_candidates)
+    if permutation is None:
+        selection = gamma_decode(encoded, nr_candidates=nr_candidates,
+                                 max_choices=nr_candidates)
+        permutation = to_absolute_answers(selection, nr_candidates)
     ballot = {}
     counts = {}
     valid = False
@@ -1266,12 +1840,18 @@ def gamma_count_range(encoded_list, candidates_and_points, params):
         detailed[c] = candidate_stats
         totals[c] = 0
 
+    nr_candidates = len(candidates_and_points)
+    decodable = [e for e in set(encoded_list) if e <= max_encoded]
+    permutations = dict(zip(decodable,
+                            gamma_decode_many(decodable, nr_candidates,
+                                              nr_candidates, absolute=True)))
     for e in encoded_list:
         assert isinstance(e, int)
         if e > max_encoded:
             ballot = {'valid': False}
         else:
-            ballot = gamma_decode_to_range_ballot(e, candidates_and_points)
+            ballot = gamma_decode_to_range_ballot(e, candidates_and_points,
+                                                  permutations[e])
         ballots.append(ballot)
         if not ballot['valid']:
             continue
@@ -1384,11 +1964,12 @@ def parties_from_candidates(candidates, separator=PARTY_SEPARATOR):
 
 
 def gamma_decode_to_party_ballot(encoded, candidates, parties, nr_groups,
-                                 separator=PARTY_SEPARATOR):
+                                 separator=PARTY_SEPARATOR, choices=None):
 
     nr_candidates = len(candidates)
-    selection = gamma_decode(encoded, nr_candidates)
-    choices = to_absolute_answers(selection, nr_candidates)
+    if choices is None:
+        selection = gamma_decode(encoded, nr_candidates)
+        choices = to_absolute_answers(selection, nr_candidates)
     voted_candidates = []
     voted_parties = []
     voted_parties_counts = {}
@@ -1486,7 +2067,10 @@ def gamma_decode_to_party_ballot(encoded, candidates, parties, nr_groups,
     return ballot
 
 
-def gamma_count_parties(encoded_list, candidates, separator=PARTY_SEPARATOR):
+def gamma_count_parties(encoded_list, candidates, separator=PARTY_SEPARATOR,
+                        decoded=None):
+    """Count the party list ballots in encoded_list. decoded, if given,
+    holds their selections already converted to absolute answers."""
     invalid_count = 0
     blank_count = 0
     candidate_counters = {}
@@ -1502,9 +2086,14 @@ def gamma_count_parties(encoded_list, candidates, separator=PARTY_SEPARATOR):
                 continue
             candidate_counters[(party, candidate)] = 0
 
-    for encoded in encoded_list:
+    if decoded is None:
+        nr_candidates = len(candidates)
+        decoded = gamma_decode_many(encoded_list, nr_candidates,
+                                    absolute=True)
+    for encoded, choices in zip(encoded_list, decoded):
         ballot = gamma_decode_to_party_ballot(encoded, candidates, parties,
-                                              nr_groups, separator=separator)
+                                              nr_groups, separator=separator,
+                                              choices=choices)
         if not ballot['valid']:
             invalid_count += 1
             continue
@@ -1620,7 +2209,7 @@ def get_random_int(minimum, ceiling):
 
 def get_random_element(modulus, generator, order):
     exponent = get_random_int(2, order)
-    element = pow(generator, exponent, modulus)
+    element = fixed_base_pow(generator, exponent, modulus)
     return element
 
 
@@ -1629,6 +2218,11 @@ def validate_element(modulus, generator, order, element):
     return legendre == 1
 
 
+def _is_group_element(modulus, element):
+    # Quadratic residues mod the safe prime modulus form the ElGamal group
+    return 0 < element < modulus and jacobi(element, modulus) == 1
+
+
 def encrypt(message, modulus, generator, order, public, randomness=None):
     if randomness is None:
         randomness = get_random_int(1, order)
@@ -1640,8 +2234,8 @@ def encrypt(message, modulus, generator, order, public, randomness=None):
     legendre = pow(message, order, modulus)
     if legendre != 1:
         message = -message % modulus
-    alpha = pow(generator, randomness, modulus)
-    beta = (message * pow(public, randomness, modulus)) % modulus
+    alpha = fixed_base_pow(generator, randomness, modulus)
+    beta = (message * fixed_base_pow(public, randomness, modulus)) % modulus
     return [alpha, beta, randomness]
 
 
@@ -1658,8 +2252,8 @@ def decrypt_with_randomness(modulus, generator, order, public,
 def decrypt_with_decryptor(modulus, generator, order, beta, decryptor):
     decryptor = inverse(decryptor, modulus)
     message = (decryptor * beta) % modulus
-    legendre = pow(message, order, modulus)
-    if legendre not in (0, 1, -1 % modulus):
+    legendre = jacobi(message, modulus)
+    if legendre not in (0, 1, -1):
         m = "This should be impossible. Invalid encryption."
         raise AssertionError(m)
     if message >= order:
@@ -1667,6 +2261,82 @@ def decrypt_with_decryptor(modulus, generator, order, beta, decryptor):
     return message - 1
 
 
+def batch_inverse(elements, modulus):
+    """Return the inverses of elements mod modulus, computed with a
+    single modular inversion and three multiplications per element
+    (Montgomery's simultaneous inversion)."""
+    m = mpz(modulus)
+    products = []
+    append = products.append
+    product = mpz(1)
+    for element in elements:
+        product = product * element % m
+        append(product)
+    if not products:
+        return []
+    if not product:
+        # some element is not invertible, leave it to inverse()
+        return [inverse(element, modulus) for element in elements]
+
+    product_inverse = invert(product, m)
+    inverses = [None] * len(products)
+    for i in range(len(products) - 1, 0, -1):
+        inverses[i] = int(product_inverse * products[i - 1] % m)
+        product_inverse = product_inverse * elements[i] % m
+    inverses[0] = int(product_inverse)
+    return inverses
+
+
+def _decrypt_with_decryptors(data):
+    modulus, generator, order, betas, decryptors = data
+    p = mpz(modulus)
+    plaintexts = []
+    append = plaintexts.append
+    for beta, decryptor in zip(betas, batch_inverse(decryptors, modulus)):
+        message = decryptor * beta % p
+        legendre = jacobi(message, p)
+        if legendre not in (0, 1, -1):
+            m = "This should be impossible. Invalid encryption."
+            raise AssertionError(m)
+        if message >= order:
+            message = -message % p
+        append(int(message) - 1)
+    return plaintexts
+
+
+def decrypt_with_decryptors(modulus, generator, order, betas, decryptors,
+                            teller=_teller, nr_parallel=0,
+                            batch_size=DECRYPT_BATCH_SIZE):
+    """Decrypt many ciphers as decrypt_with_decryptor does, inverting
+    the decryptors of each batch at once. The batches are spread over
+    the crypto pool when nr_parallel is set."""
+    nr_ciphers = len(betas)
+    if nr_ciphers != len(decryptors):
+        m = "Ciphers and decryptors not of the same size"
+        raise ZeusError(m)
+
+    batch_size = max(batch_size, 1)
+    tasks = [(modulus, generator, order,
+              betas[i:i + batch_size], decryptors[i:i + batch_size])
+             for i in range(0, nr_ciphers, batch_size)]
+    if nr_parallel and nr_parallel > 0 and len(tasks) > 1:
+        pool_context = crypto_pool(nr_parallel)
+    else:
+        pool_context = nullcontext(None)
+
+    plaintexts = []
+    with pool_context as pool, \
+            teller.task("Decrypting ballots", total=nr_ciphers):
+        if pool is None:
+            results = map(_decrypt_with_decryptors, tasks)
+        else:
+            results = pool.imap(_decrypt_with_decryptors, tasks)
+        for batch in results:
+            plaintexts.extend(batch)
+            teller.advance(len(batch))
+    return plaintexts
+
+
 def decrypt(modulus, generator, order, secret, alpha, beta):
     decryptor = pow(alpha, secret, modulus)
     return decrypt_with_decryptor(modulus, generator, order, beta, decryptor)
@@ -1700,25 +2370,175 @@ def number_from_numbers_hash(modulus, *numbers):
     return number
 
 
+_cryptosystem_hashes = {}
+
+
+def cryptosystem_hash(modulus, generator, order):
+    """Return numbers_hash of the cryptosystem, computed once per
+    cryptosystem, since every signed text message is prefixed by it."""
+    key = (modulus, generator, order)
+    num_hash = _cryptosystem_hashes.get(key)
+    if num_hash is None:
+        num_hash = numbers_hash(key)
+        _cryptosystem_hashes[key] = num_hash
+    return num_hash
+
+
 def element_from_texts_hash(modulus, generator, order, *texts):
-    num_hash = numbers_hash((modulus, generator, order))
+    num_hash = cryptosystem_hash(modulus, generator, order)
     digest = texts_hash((num_hash,) + texts)
     number = strbin_to_int(digest) % order
-    element = pow(generator, number, modulus)
+    element = fixed_base_pow(generator, number, modulus)
     return element
 
 
 def element_from_elements_hash(modulus, generator, order, *elements):
     hexdigest = numbers_hash((modulus, generator, order) + elements)
     number = strbin_to_int(hexdigest.encode()) % order
-    element = pow(generator, number, modulus)
+    element = fixed_base_pow(generator, number, modulus)
     return element
 
 
+def verify_power_equation(modulus, base, exponent,
+                          power, challenge, commitment):
+    """Check that base^exponent == commitment * power^challenge"""
+    if power % modulus == 0:
+        return (pow(base, exponent, modulus) ==
+                (commitment * pow(power, challenge, modulus)) % modulus)
+    power_inverse = int(invert(power, modulus))
+    return (multi_pow((base, power_inverse), (exponent, challenge), modulus)
+            == commitment % modulus)
+
+
+RANDOMNESS_POOL_SIZE = 256
+
+_randomness_pools = {}
+
+
+def mk_signing_randomness(modulus, generator, order):
+    """Return (g^w, w^-1 mod modulus-1) for a fresh odd random w,
+    the secret values that ElGamal signing needs."""
+    w = 2 * get_random_int(3, order) - 1
+    r = fixed_base_pow(generator, w, modulus)
+    return r, inverse(w, modulus - 1)
+
+
+def mk_proof_randomness(modulus, generator, order):
+    """Return (w, g^w) for a fresh random w, the secret randomness and
+    commitment of a discrete logarithm proof."""
+    w = get_random_int(2, order)
+    return w, fixed_base_pow(generator, w, modulus)
+
+
+class RandomnessPool(object):
+    """Bounded queues of precomputed signing and proof randomness for
+    one cryptosystem.
+
+    Every entry is secret and must be used only once, so the queues are
+    kept in process memory only, entries are removed as they are taken,
+    and they are dropped in forked children. When a queue is empty the
+    randomness is computed on the spot.
+    """
+
+    def __init__(self, modulus, generator, order, size=RANDOMNESS_POOL_SIZE):
+        self.crypto = (modulus, generator, order)
+        self.size = size
+        self.signing = deque(maxlen=size)
+        self.proving = deque(maxlen=size)
+        self.needed = threading.Event()
+        self.filler = None
+
+    def clear(self):
+        self.signing.clear()
+        self.proving.clear()
+        self.needed = threading.Event()
+        self.filler = None
+
+    def fill(self, count=None):
+        """Compute entries until both queues are full, or count entries
+        have been added. Returns the number of entries added."""
+        crypto = self.crypto
+        size = self.size
+        signing = self.signing
+        proving = self.proving
+        added = 0
+        while count is None or added < count:
+            if len(signing) < size:
+                signing.append(mk_signing_randomness(*crypto))
+            elif len(proving) < size:
+                proving.append(mk_proof_randomness(*crypto))
+            else:
+                break
+            added += 1
+        return added
+
+    def _take(self, queue, mk_randomness):
+        try:
+            randomness = queue.popleft()
+        except IndexError:
+            randomness = mk_randomness(*self.crypto)
+        if len(queue) <= self.size // 2:
+            self.needed.set()
+        return randomness
+
+    def signing_randomness(self):
+        return self._take(self.signing, mk_signing_randomness)
+
+    def proof_randomness(self):
+        return self._take(self.proving, mk_proof_randomness)
+
+    def _run_filler(self):
+        needed = self.needed
+        while self.filler is threading.current_thread():
+            needed.clear()
+            self.fill()
+            needed.wait()
+
+    def start_filler(self):
+        """Keep the queues full from a daemon thread of this process."""
+        filler = self.filler
+        if filler is not None and filler.is_alive():
+            return
+        filler = threading.Thread(target=self._run_filler,
+                                  name='zeus-randomness-pool')
+        filler.daemon = True
+        self.filler = filler
+        filler.start()
+
+
+def get_randomness_pool(modulus, generator, order,
+                        size=RANDOMNESS_POOL_SIZE):
+    """Return the RandomnessPool of the cryptosystem, creating it with
+    room for size entries per queue on first use."""
+    key = (modulus, generator, order)
+    pool = _randomness_pools.get(key)
+    if pool is None:
+        pool = _randomness_pools[key] = RandomnessPool(*key, size=size)
+    return pool
+
+
+def start_randomness_pool(modulus, generator, order,
+                          size=RANDOMNESS_POOL_SIZE):
+    """Precompute signing and proof randomness for the cryptosystem in
+    the background of the current process."""
+    pool = get_randomness_pool(modulus, generator, order, size=size)
+    pool.start_filler()
+    return pool
+
+
+def _clear_randomness_pools():
+    # A forked child must never use the randomness its parent also uses
+    for pool in _randomness_pools.values():
+        pool.clear()
+
+
+os.register_at_fork(after_in_child=_clear_randomness_pools)
+
+
 def prove_dlog_zeus(modulus, generator, order, power, dlog,
                     *extra_challenge_input):
-    randomness = get_random_int(2, order)
-    commitment = pow(generator, randomness, modulus)
+    pool = get_randomness_pool(modulus, generator, order)
+    randomness, commitment = pool.proof_randomness()
     challenge = element_from_elements_hash(modulus, generator, order,
                                            power, commitment,
                                            *extra_challenge_input)
@@ -1734,8 +2554,8 @@ def verify_dlog_power_zeus(modulus, generator, order, power,
                                             *extra_challenge_input)
     if _challenge != challenge:
         return 0
-    return (pow(generator, response, modulus)
-            == ((commitment * pow(power, challenge, modulus)) % modulus))
+    return verify_power_equation(modulus, generator, response,
+                                 power, challenge, commitment)
 
 
 prove_dlog = prove_dlog_zeus
@@ -1766,9 +2586,8 @@ def validate_public_key(modulus, generator, order, public_key,
 
 def prove_ddh_tuple_zeus(modulus, generator, order,
                     message, base_power, message_power, exponent):
-    randomness = get_random_int(2, order)
-
-    base_commitment = pow(generator, randomness, modulus)
+    pool = get_randomness_pool(modulus, generator, order)
+    randomness, base_commitment = pool.proof_randomness()
     message_commitment = pow(message, randomness, modulus)
 
     args = (modulus, generator, order, base_power, base_commitment,
@@ -1788,12 +2607,12 @@ def verify_ddh_tuple_zeus(modulus, generator, order,
     if _challenge != challenge:
         return 0
 
-    b = (base_commitment * pow(base_power, challenge, modulus)) % modulus
-    if b != pow(generator, response, modulus):
+    if not verify_power_equation(modulus, generator, response,
+                                 base_power, challenge, base_commitment):
         return 0
 
-    m = (message_commitment * pow(message_power, challenge, modulus)) % modulus
-    if m != pow(message, response, modulus):
+    if not verify_power_equation(modulus, message, response,
+                                 message_power, challenge, message_commitment):
         return 0
 
     return 1
@@ -1803,6 +2622,75 @@ prove_ddh_tuple = prove_ddh_tuple_zeus
 verify_ddh_tuple = verify_ddh_tuple_zeus
 
 
+def verify_ddh_tuple_batch(modulus, generator, order, base_power, tuples):
+    """Verify many DDH tuple proofs that share the same base power at once.
+
+    Each tuple is (message, message_power, base_commitment,
+    message_commitment, challenge, response). Instead of checking the two
+    Chaum-Pedersen equations of every proof separately, they are raised to
+    random small exponents and multiplied together, so that only a few
+    full-size exponentiations remain per tuple.
+
+    A passing batch means that all proofs are valid, except with
+    probability 2^-DDH_BATCH_EXPONENT_BITS. A failing batch only means
+    that the proofs could not be confirmed together; the caller should
+    then check them one by one with verify_ddh_tuple.
+    """
+    p = modulus
+    if not _is_group_element(p, base_power):
+        return 0
+
+    rand_ceil = 2 ** DDH_BATCH_EXPONENT_BITS
+    generator_exponent = 0
+    base_power_exponent = 0
+    base_commitments = []
+    randoms = []
+    messages = []
+    message_exponents = []
+    message_powers = []
+    message_power_exponents = []
+    message_commitments = []
+
+    for t in tuples:
+        (message, message_power, base_commitment, message_commitment,
+         challenge, response) = t
+        for element in (message, message_power,
+                        base_commitment, message_commitment):
+            if not _is_group_element(p, element):
+                return 0
+
+        args = (modulus, generator, order, base_power, base_commitment,
+                message, message_power, message_commitment)
+        if element_from_elements_hash(*args) != challenge:
+            return 0
+
+        r = get_random_int(1, rand_ceil)
+        generator_exponent += r * response
+        base_power_exponent += r * challenge
+        base_commitments.append(base_commitment)
+        randoms.append(r)
+
+        messages.append(message)
+        message_exponents.append((r * response) % order)
+        message_powers.append(message_power)
+        message_power_exponents.append((r * challenge) % order)
+        message_commitments.append(message_commitment)
+
+    b = fixed_base_pow(generator, generator_exponent % order, p)
+    _b = multi_pow(base_commitments + [base_power],
+                   randoms + [base_power_exponent % order], p)
+    if b != _b:
+        return 0
+
+    m = multi_pow(messages, message_exponents, p)
+    _m = multi_pow(message_commitments + message_powers,
+                   randoms + message_power_exponents, p)
+    if m != _m:
+        return 0
+
+    return 1
+
+
 def prove_encryption(modulus, generator, order, alpha, beta, secret):
     """Prove ElGamal encryption"""
     ret = prove_dlog(modulus, generator, order, alpha, secret, beta)
@@ -1820,11 +2708,10 @@ def verify_encryption(modulus, generator, order, alpha, beta,
 
 def sign_element(element, modulus, generator, order, key):
     """Compute ElGamal signature"""
+    pool = get_randomness_pool(modulus, generator, order)
+    modulus1 = modulus - 1
     while 1:
-        w = 2 * get_random_int(3, order) - 1
-        r = pow(generator, w, modulus)
-        modulus1 = modulus - 1
-        w = inverse(w, modulus1)
+        r, w = pool.signing_randomness()
         s = (w * ((element - (r*key) % modulus1))) % modulus1
         if s != 0:
             break
@@ -1849,8 +2736,63 @@ def verify_element_signature(signature, modulus, generator, order, public):
     if r <= 0 or r >= modulus:
         return 0
 
-    x0 = (pow(public, r, modulus) * pow(r, s, modulus)) % modulus
-    x1 = pow(generator, e, modulus)
+    x0 = multi_pow((public, r), (r, s), modulus)
+    x1 = fixed_base_pow(generator, e, modulus)
+    if x0 != x1:
+        return 0
+
+    return 1
+
+
+def verify_element_signatures_batch(signatures, modulus, generator, order,
+                                    public):
+    """Verify many ElGamal signatures by the same public key at once.
+
+    The equations public^r * r^s == generator^e of the signatures are
+    raised to random small exponents and multiplied together, so that
+    public and generator are only raised once for the whole batch.
+    Every r^s is first checked to be a quadratic residue, so that the
+    failing equation of one signature cannot be cancelled by another.
+
+    As with verify_ddh_tuple_batch, a failing batch only means that the
+    signatures could not be confirmed together.
+    """
+    p = modulus
+    modulus1 = modulus - 1
+    if not _is_group_element(p, public):
+        return 0
+
+    rand_ceil = 2 ** DDH_BATCH_EXPONENT_BITS
+    public_exponent = 0
+    generator_exponent = 0
+    bases = []
+    exponents = []
+    for signature in signatures:
+        r = signature['r']
+        s = signature['s']
+        e = signature['e']
+        if 'crypto' in signature:
+            crypto = signature['crypto']
+            if (crypto['modulus'] != modulus or
+                crypto['generator'] != generator or
+                crypto['order'] != order):
+                return 0
+
+        if r <= 0 or r >= p:
+            return 0
+        if s & 1 and jacobi(r, p) != 1:
+            return 0
+
+        c = get_random_int(1, rand_ceil)
+        public_exponent += c * r
+        generator_exponent += c * e
+        bases.append(r)
+        exponents.append((c * s) % modulus1)
+
+    bases.append(public)
+    exponents.append(public_exponent % modulus1)
+    x0 = multi_pow(bases, exponents, p)
+    x1 = fixed_base_pow(generator, generator_exponent % modulus1, p)
     if x0 != x1:
         return 0
 
@@ -1946,7 +2888,7 @@ def sign_vote(vote, trustees, candidates, comments,
     return text
 
 
-def verify_vote_signature(vote_signature):
+def _parse_vote_signature(vote_signature):
     message, sep, e, r, s, null = vote_signature.rsplit('\n', 5)
     e = int(e, 16)
     r = int(r, 16)
@@ -2005,17 +2947,6 @@ def verify_vote_signature(vote_signature):
     comments = m16[len(V_COMMENTS):]
 
     signature = {'m': message, 'r': r, 's': s, 'e': e}
-    if not verify_text_signature(signature, modulus, generator, order,
-                                 zeus_public):
-        m = "Invalid vote signature!"
-        raise ZeusError(m)
-
-    if (index is not None and
-        not verify_encryption(modulus, generator, order, alpha, beta,
-                              commitment, challenge, response)):
-        m = "Invalid vote encryption proof in valid signature!"
-        raise AssertionError(m)
-
     crypto = [modulus, generator, order]
 
     eb = {'alpha': alpha, 'beta': beta,
@@ -2031,7 +2962,69 @@ def verify_vote_signature(vote_signature):
             'public': public,
             'encrypted_ballot': eb}
 
-    return vote, crypto, trustees, candidates, comments
+    vote_info = (vote, crypto, trustees, candidates, comments)
+    return signature, zeus_public, vote_info
+
+
+def _verify_vote_encryption(vote_info):
+    vote, crypto = vote_info[:2]
+    eb = vote['encrypted_ballot']
+    if (vote['index'] is not None and
+        not verify_encryption(crypto[0], crypto[1], crypto[2],
+                              eb['alpha'], eb['beta'], eb['commitment'],
+                              eb['challenge'], eb['response'])):
+        m = "Invalid vote encryption proof in valid signature!"
+        raise AssertionError(m)
+
+
+def verify_vote_signature(vote_signature):
+    signature, zeus_public, vote_info = _parse_vote_signature(vote_signature)
+    modulus, generator, order = vote_info[1]
+    if not verify_text_signature(signature, modulus, generator, order,
+                                 zeus_public):
+        m = "Invalid vote signature!"
+        raise ZeusError(m)
+
+    _verify_vote_encryption(vote_info)
+    return vote_info
+
+
+def verify_vote_signatures(vote_signatures,
+                           batch_size=VOTE_SIGNATURE_BATCH_SIZE):
+    """Verify vote signatures as verify_vote_signature does, returning
+    the vote info of each, in order.
+
+    The ElGamal signatures by the same key are verified together in
+    batches of batch_size; a batch_size of 1 verifies them one by one.
+    """
+    parsed = [_parse_vote_signature(s) for s in vote_signatures]
+    batches = {}
+    for signature, zeus_public, vote_info in parsed:
+        modulus, generator, order = vote_info[1]
+        element = element_from_texts_hash(modulus, generator, order,
+                                          signature['m'])
+        if element != signature['e']:
+            m = "Invalid vote signature!"
+            raise ZeusError(m)
+        key = (modulus, generator, order, zeus_public)
+        batches.setdefault(key, []).append(signature)
+
+    batch_size = max(batch_size, 1)
+    for key, signatures in batches.items():
+        for offset in range(0, len(signatures), batch_size):
+            batch = signatures[offset:offset + batch_size]
+            if (len(batch) > 1 and
+                verify_element_signatures_batch(batch, *key)):
+                continue
+            for signature in batch:
+                if not verify_element_signature(signature, *key):
+                    m = "Invalid vote signature!"
+                    raise ZeusError(m)
+
+    vote_infos = [vote_info for signature, zeus_public, vote_info in parsed]
+    for vote_info in vote_infos:
+        _verify_vote_encryption(vote_info)
+    return vote_infos
 
 
 def to_relative_answers(choices, nr_candidates):
@@ -2041,13 +3034,20 @@ def to_relative_answers(choices, nr_candidates):
     e.g. for candidates [A, B, C] absolute choices [1, 2, 0] will be converted
     to [1, 1, 0].
     """
+    # each relative answer is the choice minus the number of smaller
+    # choices before it, found by bisecting the sorted earlier choices
     relative = []
-    candidates = list(range(nr_candidates))
-    choices = [candidates.index(c) for c in choices]
+    append = relative.append
+    chosen = []
+    insert = chosen.insert
     for choice in choices:
-        index = candidates.index(choice)
-        relative.append(index)
-        candidates.remove(choice)
+        index = bisect_right(chosen, choice)
+        if (not 0 <= choice < nr_candidates or
+            (index and chosen[index - 1] == choice)):
+            m = "%r is not a valid choice" % (choice,)
+            raise ValueError(m)
+        insert(index, choice)
+        append(choice - index)
 
     return relative
 
@@ -2056,14 +3056,21 @@ def to_absolute_answers(choices, nr_candidates):
     """
     Inverts `to_relative_answers` result.
     """
-    absolute_choices = []
     candidates = list(range(nr_candidates))
-    tmp_cands = candidates[:]
-    for choice in choices:
-        choice = tmp_cands[choice]
-        absolute_choices.append(candidates.index(choice))
-        tmp_cands.remove(choice)
-    return absolute_choices
+    pop = candidates.pop
+    return [pop(choice) for choice in choices]
+
+
+def to_relative_answers_many(choices_list, nr_candidates):
+    """Convert a list of absolute answer choices to relative ones."""
+    return [to_relative_answers(choices, nr_candidates)
+            for choices in choices_list]
+
+
+def to_absolute_answers_many(choices_list, nr_candidates):
+    """Convert a list of relative answer choices to absolute ones."""
+    return [to_absolute_answers(choices, nr_candidates)
+            for choices in choices_list]
 
 
 def get_random_permutation_gamma(nr_elements):
@@ -2094,13 +3101,17 @@ def compute_decryption_factors1(modulus, generator, order, secret, ciphers,
     return factors
 
 
-def _compute_decryption_factor(data):
-    modulus, generator, order, secret, public, cipher = data
-    alpha, beta = cipher
-    factor = pow(alpha, secret, modulus)
-    proof = prove_ddh_tuple(modulus, generator, order,
-                            alpha, public, factor, secret)
-    return [factor, proof]
+def _compute_decryption_factor_batch(data):
+    modulus, generator, order, secret, public, ciphers_ref, start, end = data
+    ciphers = get_shared_ciphers(ciphers_ref)
+    factors = []
+    append = factors.append
+    for alpha, beta in ciphers[start:end]:
+        factor = pow(alpha, secret, modulus)
+        proof = prove_ddh_tuple(modulus, generator, order,
+                                alpha, public, factor, secret)
+        append([factor, proof])
+    return factors
 
 
 def compute_decryption_factors(modulus, generator, order, secret, ciphers,
@@ -2111,99 +3122,155 @@ def compute_decryption_factors(modulus, generator, order, secret, ciphers,
 
     public = pow(generator, secret, modulus)
     nr_ciphers = len(ciphers)
-    pool = Pool(nr_parallel, Random.atfork)
 
-    d, q = divmod(nr_ciphers, nr_parallel)
-    if not d:
-        d = nr_ciphers
+    d = CRYPTO_POOL_CHUNK_SIZE
     factors = []
-    with teller.task("Computing decryption factors", total=nr_ciphers):
+    with crypto_pool(nr_parallel) as pool, \
+            teller.task("Computing decryption factors", total=nr_ciphers):
+        ciphers_ref = pool.share(ciphers)
         args = [
-            (modulus, generator, order, secret, public, ciphers[i])
-            for i in range(nr_ciphers)
+            (modulus, generator, order, secret, public, ciphers_ref, i, i + d)
+            for i in range(0, nr_ciphers, d)
         ]
-        for r in pool.imap(_compute_decryption_factor, args, d):
-            teller.advance()
-            factors.append(r)
+        for r in pool.imap(_compute_decryption_factor_batch, args):
+            teller.advance(len(r))
+            factors.extend(r)
 
-    pool.close()
-    pool.join()
     return factors
 
 
+def _verify_decryption_factors_batch(modulus, generator, order, public,
+                                     ciphers, factors):
+    tuples = [(alpha, factor) + tuple(proof)
+              for (alpha, beta), (factor, proof) in zip(ciphers, factors)]
+    if verify_ddh_tuple_batch(modulus, generator, order, public, tuples):
+        return -1
+
+    # The batch could not be confirmed, find the offending factor
+    for i, (alpha, factor, *proof) in enumerate(tuples):
+        if not verify_ddh_tuple(modulus, generator, order, alpha, public,
+                                factor, *proof):
+            return i
+    return -1
+
+
 def verify_decryption_factors1(modulus, generator, order, public,
-                               ciphers, factors, teller=_teller):
+                               ciphers, factors, teller=_teller,
+                               batch_size=DDH_BATCH_SIZE):
     nr_ciphers = len(ciphers)
     if nr_ciphers != len(factors):
         return 0
 
+    batch_size = max(batch_size, 1)
     with teller.task("Verifying decryption factors", total=nr_ciphers):
-        for cipher, factor in zip(ciphers, factors):
-            alpha, beta = cipher
-            factor, proof = factor
-            if not verify_ddh_tuple(modulus, generator, order, alpha, public,
-                                    factor, *proof):
+        for offset in range(0, nr_ciphers, batch_size):
+            end = offset + batch_size
+            invalid = _verify_decryption_factors_batch(
+                            modulus, generator, order, public,
+                            ciphers[offset:end], factors[offset:end])
+            if invalid >= 0:
+                teller.notice("invalid decryption factor for cipher %d",
+                              offset + invalid)
                 teller.fail()
                 return 0
-            teller.advance()
+            teller.advance(min(end, nr_ciphers) - offset)
     return 1
 
 
-def _verify_decryption_factor(data):
-    modulus, generator, order, public, cipher, factor = data
-    alpha, beta = cipher
-    factor, proof = factor
-    return verify_ddh_tuple(modulus, generator, order, alpha, public,
-                            factor, *proof)
+def _verify_decryption_factor_batch(data):
+    modulus, generator, order, public, ciphers_ref, offset, factors = data
+    ciphers = get_shared_ciphers(ciphers_ref)
+    ciphers = ciphers[offset:offset + len(factors)]
+    invalid = _verify_decryption_factors_batch(modulus, generator, order,
+                                               public, ciphers, factors)
+    return offset, invalid, len(factors)
+
+
+def decryption_factor_tasks(modulus, generator, order, public,
+                            ciphers, factors, pool,
+                            batch_size=DDH_BATCH_SIZE):
+    """Return the _verify_decryption_factor_batch arguments that verify
+    factors on pool. The factors must be as many as the ciphers."""
+    nr_ciphers = len(ciphers)
+    ciphers_ref = pool.share(ciphers)
+    d, q = divmod(nr_ciphers, pool.nr_parallel)
+    batch_size = max(min(batch_size, d), 1)
+    return [(modulus, generator, order, public, ciphers_ref,
+             i, factors[i:i + batch_size])
+            for i in range(0, nr_ciphers, batch_size)]
 
 
 def verify_decryption_factors(modulus, generator, order, public,
                               ciphers, factors, teller=_teller,
-                              nr_parallel=1):
+                              nr_parallel=1, batch_size=DDH_BATCH_SIZE):
     if nr_parallel <= 0:
         return verify_decryption_factors1(modulus, generator, order, public,
-                                          ciphers, factors, teller=teller)
+                                          ciphers, factors, teller=teller,
+                                          batch_size=batch_size)
 
     nr_ciphers = len(ciphers)
     if nr_ciphers != len(factors):
         return 0
-    pool = Pool(nr_parallel, Random.atfork)
-
-    d, q = divmod(nr_ciphers, nr_parallel)
-    if not d:
-        d = nr_ciphers
-    with teller.task("Verifying decryption factors", total=nr_ciphers):
-        args = [
-            (modulus, generator, order, public, ciphers[i], factors[i])
-            for i in range(nr_ciphers)
-        ]
-        for r in pool.imap(_verify_decryption_factor, args, d):
-            if not r:
-                pool.terminate()
-                pool.join()
+    with crypto_pool(nr_parallel) as pool, \
+            teller.task("Verifying decryption factors", total=nr_ciphers):
+        args = decryption_factor_tasks(modulus, generator, order, public,
+                                       ciphers, factors, pool,
+                                       batch_size=batch_size)
+        for offset, invalid, count in pool.imap(
+                _verify_decryption_factor_batch, args):
+            if invalid >= 0:
+                teller.notice("invalid decryption factor for cipher %d",
+                              offset + invalid)
+                # cancel the batches still queued
+                discard_crypto_pool(pool)
                 return 0
-            teller.advance()
+            teller.advance(count)
 
-    pool.close()
-    pool.join()
     return 1
 
 
 def combine_decryption_factors(modulus, factor_collection):
     if not factor_collection:
         return
-    master_factors = []
-    append = master_factors.append
-    for decryption_factors in zip(*factor_collection):
-        master_factor = 1
-        for factor, proof in decryption_factors:
-            master_factor = (master_factor * factor) % modulus
-        append(master_factor)
-    return master_factors
+    m = mpz(modulus)
+    nr_factors = min(len(factors) for factors in factor_collection)
+    master_factors = [mpz(1)] * nr_factors
+    for factors in factor_collection:
+        master_factors = [master_factor * factor[0] % m
+                          for master_factor, factor
+                          in zip(master_factors, factors)]
+    return [int(master_factor) for master_factor in master_factors]
+
+
+def _verify_vote_signatures(signatures):
+    return verify_vote_signatures(signatures)
+
+
+def _prefetch_vote_signatures(signatures):
+    try:
+        return verify_vote_signatures(signatures)
+    except Exception:
+        # Left to be verified one by one, to fail at the offending vote
+        return None
+
+
+def _run_validation_task(task):
+    stage, func, data = task
+    try:
+        return stage, func(data), None
+    except (AssertionError, ZeusError) as e:
+        return stage, None, e
+
+
+def _stage_error(stage, e):
+    m = "Validating stage '%s' failed: %s" % (stage, e)
+    return e.__class__(m)
 
 
 class ZeusCoreElection(object):
     stage = 'UNINITIALIZED'
+    _constants = None
+    _constants_stage = None
 
     def __init__(self, cryptosystem=crypto_args(_default_crypto),
                         teller=_teller, shuffle_module=None,
@@ -2371,6 +3438,12 @@ class ZeusCoreElection(object):
             fingerprint = vote['fingerprint']
             self.votes[fingerprint] = vote
 
+    def do_lock_cast_votes(self, voter_key):
+        """Return the context in which a vote of voter_key is indexed,
+        chained to the voter's previous vote and stored. Backends that
+        cast votes concurrently must serialize it per election."""
+        return nullcontext()
+
     def do_get_vote(self, fingerprint):
         return self.votes.get(fingerprint, None)
 
@@ -2479,9 +3552,54 @@ class ZeusCoreElection(object):
     def get_option(self, name):
         return self.do_get_option(name)
 
+    def get_constant(self, name):
+        """Return the backend do_get_<name>() value of one of the
+        ELECTION_CONSTANTS, fetched once per stage. Methods that store
+        any of them invalidate it with invalidate_constants."""
+        if name not in ELECTION_CONSTANTS:
+            m = "Unknown election constant '%s'" % (name,)
+            raise ZeusError(m)
+        stage = self.do_get_stage()
+        constants = self._constants
+        if constants is None or self._constants_stage != stage:
+            constants = self._constants = {}
+            self._constants_stage = stage
+        if name not in constants:
+            constants[name] = getattr(self, 'do_get_' + name)()
+        return constants[name]
+
+    def invalidate_constants(self, *names):
+        """Forget the given cached constants, or all when none given."""
+        constants = self._constants
+        if not constants:
+            return
+        if not names:
+            constants.clear()
+        for name in names:
+            constants.pop(name, None)
+
+    def get_cryptosystem(self):
+        return self.get_constant('cryptosystem')
+
+    def get_election_public(self):
+        return self.get_constant('election_public')
+
+    def get_zeus_public(self):
+        return self.get_constant('zeus_public')
+
+    def get_zeus_secret(self):
+        return self.get_constant('zeus_secret')
+
+    def get_trustees(self):
+        return self.get_constant('trustees')
+
+    def get_candidates(self):
+        return self.get_constant('candidates')
+
     def init_creating(self, cryptosystem):
         modulus, generator, order = cryptosystem
         self.do_store_cryptosystem(modulus, generator, order)
+        self.invalidate_constants('cryptosystem')
         self.do_set_stage('CREATING')
 
     @classmethod
@@ -2502,10 +3620,12 @@ class ZeusCoreElection(object):
         secret, public, commitment, challenge, response = key_info
 
         self.do_store_zeus_key(secret, public, commitment, challenge, response)
+        self.invalidate_constants('zeus_secret', 'zeus_public')
         return key_info
 
     def invalidate_election_public(self):
         self.do_store_election_public(None)
+        self.invalidate_constants('election_public')
 
     def compute_election_public(self):
         trustees = self.do_get_trustees()
@@ -2514,6 +3634,7 @@ class ZeusCoreElection(object):
         for trustee in trustees:
             public = (public * trustee) % modulus
         self.do_store_election_public(public)
+        self.invalidate_constants('election_public')
 
     def add_trustee(self, trustee_public_key, trustee_key_proof):
         self.do_assert_stage('CREATING')
@@ -2529,6 +3650,7 @@ class ZeusCoreElection(object):
         modulus, generator, order = self.do_get_cryptosystem()
         self.invalidate_election_public()
         self.do_store_trustee(trustee_public_key, *trustee_key_proof)
+        self.invalidate_constants('trustees')
         self.compute_election_public()
 
     def reprove_trustee(self, trustee_public_key, trustee_key_proof):
@@ -2553,6 +3675,7 @@ class ZeusCoreElection(object):
                 raise ZeusError(m)
 
         self.do_store_candidates(names)
+        self.invalidate_constants('candidates')
 
     def add_voters(self, *voters):
         name_set = set(v[0] for v in self.do_get_voters().values())
@@ -2751,7 +3874,7 @@ class ZeusCoreElection(object):
         vote = dict(vote)
         vote['encrypted_ballot'] = eb
 
-        crypto = self.do_get_cryptosystem()
+        crypto = self.get_cryptosystem()
         eb_crypto = [eb.pop('modulus'), eb.pop('generator'), eb.pop('order')]
         if crypto != eb_crypto:
             m = "Invalid encrypted ballot cryptosystem"
@@ -2782,25 +3905,49 @@ class ZeusCoreElection(object):
 
         return vote
 
-    def sign_vote(self, vote, comments):
-        modulus, generator, order = self.do_get_cryptosystem()
-        candidates = self.do_get_candidates()
-        public = self.do_get_zeus_public()
-        secret = self.do_get_zeus_secret()
-        trustees = list(self.do_get_trustees())
+    def sign_vote(self, vote, comments, verified=False):
+        """Sign vote and check the signature before it is given out.
+        When verified, the encryption proof of vote has already been
+        verified and is not checked again."""
+        modulus, generator, order = self.get_cryptosystem()
+        candidates = self.get_candidates()
+        public = self.get_zeus_public()
+        secret = self.get_zeus_secret()
+        trustees = list(self.get_trustees())
         trustees.sort()
         signature = sign_vote(vote, trustees, candidates, comments,
                               modulus, generator, order, public, secret)
-        self.verify_vote_signature(signature)
+        if not verified:
+            self.verify_vote_signature(signature)
+            return signature
+
+        text_signature, zeus_public, vote_info = \
+            _parse_vote_signature(signature)
+        if not verify_text_signature(text_signature, modulus, generator,
+                                     order, zeus_public):
+            m = "Invalid vote signature!"
+            raise ZeusError(m)
+        self.check_vote_signature(vote_info)
         return signature
 
     def verify_vote_signature(self, vote_signature):
         vote_info = verify_vote_signature(vote_signature)
+        return self.check_vote_signature(vote_info)
+
+    def get_vote_signature_constants(self):
+        """Return what check_vote_signature compares every vote to,
+        so that it can be fetched once for many votes."""
+        crypto = self.get_cryptosystem()
+        public = self.get_election_public()
+        trustees = set(self.get_trustees())
+        candidates = self.get_candidates()
+        return crypto, public, trustees, candidates
+
+    def check_vote_signature(self, vote_info, constants=None):
         vote, vote_crypto, vote_trustees, vote_candidates, comments = vote_info
-        trustees = list(self.do_get_trustees())
-        trustees.sort()
-        crypto = self.do_get_cryptosystem()
-        public = self.do_get_election_public()
+        if constants is None:
+            constants = self.get_vote_signature_constants()
+        crypto, public, trustees, candidates = constants
         eb = vote['encrypted_ballot']
         if crypto != vote_crypto:
             m = "Cannot verify vote signature: Cryptosystem mismatch!"
@@ -2808,10 +3955,9 @@ class ZeusCoreElection(object):
         if public != eb['public']:
             m = "Cannot verify vote signature: Election public mismatch!"
             raise ZeusError(m)
-        if set(trustees) != set(vote_trustees):
+        if trustees != set(vote_trustees):
             m = "Vote signature: trustees mismatch!"
             raise AssertionError(m)
-        candidates = self.do_get_candidates()
         if candidates != vote_candidates:
             m = "Vote signature: candidates mismatch!"
             raise AssertionError(m)
@@ -2823,7 +3969,7 @@ class ZeusCoreElection(object):
         index = signed_vote['index']
         previous = signed_vote['previous']
 
-        if election != self.do_get_election_public():
+        if election != self.get_election_public():
             m = "Election mismatch in vote!"
             raise ZeusError(m)
 
@@ -2845,14 +3991,47 @@ class ZeusCoreElection(object):
             m = "Cannot find valid previous vote [%s] in store!" % (previous,)
             raise AssertionError(m)
 
-    def verify_vote(self, vote):
+    def verify_vote(self, vote, verified=None, constants=None):
         if 'signature' not in vote:
             m = "No signature found in vote!"
             raise ZeusError(m)
         signature = vote['signature']
-        signed_vote = self.verify_vote_signature(signature)
+        vote_info = verified.pop(signature, None) if verified else None
+        if vote_info is None:
+            signed_vote = self.verify_vote_signature(signature)
+        else:
+            signed_vote = self.check_vote_signature(vote_info, constants)
         return self.validate_vote(signed_vote)
 
+    def verify_vote_signatures(self, votes):
+        """Verify the signatures of votes in bulk, in chunks spread over
+        the crypto pool when nr_parallel is set.
+
+        Returns the vote info of every verified signature by signature.
+        The signatures of a chunk that fails are left out, so that
+        verify_vote checks them again one by one.
+        """
+        teller = self.teller
+        signatures = [vote['signature'] for vote in votes
+                      if 'signature' in vote]
+        nr_signatures = len(signatures)
+        chunks = [signatures[i:i + VOTE_SIGNATURE_BATCH_SIZE]
+                  for i in range(0, nr_signatures, VOTE_SIGNATURE_BATCH_SIZE)]
+        nr_parallel = self.get_option('nr_parallel')
+        if nr_parallel and len(chunks) > 1:
+            pool = get_crypto_pool(nr_parallel)
+            results = pool.imap(_prefetch_vote_signatures, chunks)
+        else:
+            results = map(_prefetch_vote_signatures, chunks)
+
+        verified = {}
+        with teller.task("Verifying vote signatures", total=nr_signatures):
+            for chunk, vote_infos in zip(chunks, results):
+                if vote_infos is not None:
+                    verified.update(zip(chunk, vote_infos))
+                teller.advance(len(chunk))
+        return verified
+
     def cast_vote(self, vote):
         self.do_assert_stage('VOTING')
         fingerprint = vote['fingerprint']
@@ -2867,7 +4046,6 @@ class ZeusCoreElection(object):
             m = "Voter audit_code inconsistency! Invalid Election."
             raise AssertionError(m)
 
-        audit_request = self.do_get_audit_request(fingerprint)
         voter_secret = vote['voter_secret'] if 'voter_secret' in vote else None
         voter_audit_code = vote['audit_code'] if 'audit_code' in vote else None
 
@@ -2879,24 +4057,26 @@ class ZeusCoreElection(object):
             if voter_audit_code in audit_codes:
                 m = "Invalid audit vote publication! Invalid audit_code given."
                 raise ZeusError(m)
-            if voter_key != audit_request:
-                m = "Cannot find prior audit request for publish request!"
-                raise ZeusError(m)
-            vote['previous'] = ''
-            vote['index'] = None
-            vote['status'] = V_PUBLIC_AUDIT
-            missing, failed = self.verify_audit_votes(votes=[vote])
-            if missing:
-                m = "This should have been impossible"
-                raise AssertionError(m)
-            if failed:
-                vote['status'] = V_PUBLIC_AUDIT_FAILED
-            comments = self.custom_audit_publication_message(vote)
-            signature = self.sign_vote(vote, comments)
-            vote['signature'] = signature
-            self.do_store_audit_publication(fingerprint)
-            self.do_store_votes((vote,))
-            return signature
+            with self.do_lock_cast_votes(voter_key):
+                audit_request = self.do_get_audit_request(fingerprint)
+                if voter_key != audit_request:
+                    m = "Cannot find prior audit request for publish request!"
+                    raise ZeusError(m)
+                vote['previous'] = ''
+                vote['index'] = None
+                vote['status'] = V_PUBLIC_AUDIT
+                missing, failed = self.verify_audit_votes(votes=[vote])
+                if missing:
+                    m = "This should have been impossible"
+                    raise AssertionError(m)
+                if failed:
+                    vote['status'] = V_PUBLIC_AUDIT_FAILED
+                comments = self.custom_audit_publication_message(vote)
+                signature = self.sign_vote(vote, comments)
+                vote['signature'] = signature
+                self.do_store_audit_publication(fingerprint)
+                self.do_store_votes((vote,))
+                return signature
 
         if not voter_audit_code:
             skip_audit = self.do_get_option('skip_audit')
@@ -2910,50 +4090,55 @@ class ZeusCoreElection(object):
 
         if voter_audit_code not in audit_codes:
             # This is an audit request submission
-            if audit_request:
-                m = ("Audit request for vote [%s] already exists!"
-                    % (fingerprint,))
-                raise ZeusError(m)
+            with self.do_lock_cast_votes(voter_key):
+                audit_request = self.do_get_audit_request(fingerprint)
+                if audit_request:
+                    m = ("Audit request for vote [%s] already exists!"
+                        % (fingerprint,))
+                    raise ZeusError(m)
 
-            vote['previous'] = ''
-            vote['index'] = None
-            vote['status'] = V_AUDIT_REQUEST
-            comments = self.custom_audit_request_message(vote)
-            signature = self.sign_vote(vote, comments)
-            vote['signature'] = signature
-            self.do_store_audit_request(fingerprint, voter_key)
-            self.do_store_votes((vote,))
-            return signature
+                vote['previous'] = ''
+                vote['index'] = None
+                vote['status'] = V_AUDIT_REQUEST
+                comments = self.custom_audit_request_message(vote)
+                signature = self.sign_vote(vote, comments)
+                vote['signature'] = signature
+                self.do_store_audit_request(fingerprint, voter_key)
+                self.do_store_votes((vote,))
+                return signature
 
         # This is a genuine vote submission
-        if self.do_get_vote(fingerprint):
-            m = "Vote [%s] already cast!" % (fingerprint,)
-            raise ZeusError(m)
-
-        cast_votes = self.do_get_cast_votes(voter_key)
-        vote_limit = self.get_option('vote_limit')
-        if vote_limit and len(cast_votes) >= vote_limit:
-            m = "Maximum allowed number of votes reached: %d" % vote_limit
-            raise ZeusError(m)
+        # The proof is verified before taking the cast lock,
+        # which only covers the vote index and the voter's vote chain
+        vote = self.validate_submitted_vote(vote)
 
-        if not cast_votes:
-            previous_fingerprint = ''
-        else:
-            previous_fingerprint = cast_votes[-1]
+        with self.do_lock_cast_votes(voter_key):
+            if self.do_get_vote(fingerprint):
+                m = "Vote [%s] already cast!" % (fingerprint,)
+                raise ZeusError(m)
 
-        vote = self.validate_submitted_vote(vote)
+            cast_votes = self.do_get_cast_votes(voter_key)
+            vote_limit = self.get_option('vote_limit')
+            if vote_limit and len(cast_votes) >= vote_limit:
+                m = "Maximum allowed number of votes reached: %d" % vote_limit
+                raise ZeusError(m)
 
-        vote['previous'] = previous_fingerprint
-        vote['status'] = V_CAST_VOTE
-        index = self.do_index_vote(fingerprint)
-        vote['index'] = index
-        comments = self.custom_cast_vote_message(vote)
-        signature = self.sign_vote(vote, comments)
-        vote['signature'] = signature
-        self.do_append_vote(voter_key, fingerprint)
-        self.do_store_votes((vote,))
-        # DANGER: commit all data to disk before giving a signature out!
-        return signature
+            if not cast_votes:
+                previous_fingerprint = ''
+            else:
+                previous_fingerprint = cast_votes[-1]
+
+            vote['previous'] = previous_fingerprint
+            vote['status'] = V_CAST_VOTE
+            index = self.do_index_vote(fingerprint)
+            vote['index'] = index
+            comments = self.custom_cast_vote_message(vote)
+            signature = self.sign_vote(vote, comments, verified=True)
+            vote['signature'] = signature
+            self.do_append_vote(voter_key, fingerprint)
+            self.do_store_votes((vote,))
+            # DANGER: commit all data to disk before giving a signature out!
+            return signature
 
     def verify_audit_votes(self, votes=None):
         teller = self.teller
@@ -2966,9 +4151,9 @@ class ZeusCoreElection(object):
             add_plaintext = 1
         failed = []
         missing = []
-        modulus, generator, order = self.do_get_cryptosystem()
-        public = self.do_get_election_public()
-        nr_candidates = len(self.do_get_candidates())
+        modulus, generator, order = self.get_cryptosystem()
+        public = self.get_election_public()
+        nr_candidates = len(self.get_candidates())
         max_encoded = gamma_encoding_max(nr_candidates)
 
         with teller.task("Verifying audit votes", total=len(votes)):
@@ -3022,12 +4207,19 @@ class ZeusCoreElection(object):
             raise ZeusError(m)
         self.do_store_excluded_voter(voter_key, reason)
 
-    def validate_voting(self):
+    def validate_voting(self, verify=None):
         teller = self.teller
         teller.task("Validating state: 'VOTING'")
 
         all_cast_votes = self.do_get_all_cast_votes()
         all_votes = self.do_get_votes()
+        if verify is None:
+            verified = self.verify_vote_signatures(all_votes.values())
+            constants = self.get_vote_signature_constants()
+
+            def verify(vote):
+                return self.verify_vote(vote, verified, constants)
+
         nr_votes = len(all_votes)
         with teller.task("Validating cast votes", total=nr_votes):
             for voter_key, cast_votes in all_cast_votes.items():
@@ -3043,7 +4235,7 @@ class ZeusCoreElection(object):
                         m = ("Vote %s/[%s] previous '%s' != '%s'"
                             % (voter_key, cast_vote, vote_previous, previous))
                         raise AssertionError(m)
-                    self.verify_vote(vote)
+                    verify(vote)
                     del all_votes[cast_vote]
                     teller.advance()
                     previous = cast_vote
@@ -3057,7 +4249,7 @@ class ZeusCoreElection(object):
                     m = "Audit vote [%s] not found in vote archive!" % (audit_vote,)
                     raise AssertionError(m)
                 vote = all_votes[audit_vote]
-                self.verify_vote(vote)
+                verify(vote)
                 msg = vote['signature']
                 if msg.startswith(V_PUBLIC_AUDIT):
                     if vote['fingerprint'] not in all_audit_requests:
@@ -3078,7 +4270,7 @@ class ZeusCoreElection(object):
                         % (voter_key, audit_request))
                     raise AssertionError(m)
                 vote = all_votes[audit_request]
-                self.verify_vote(vote)
+                verify(vote)
                 del all_votes[audit_request]
                 teller.advance()
 
@@ -3181,9 +4373,9 @@ class ZeusCoreElection(object):
                 % (counted_votes, vote_count))
             raise AssertionError(m)
 
-        crypto = self.do_get_cryptosystem()
+        crypto = self.get_cryptosystem()
         modulus, generator, order = crypto
-        public = self.do_get_election_public()
+        public = self.get_election_public()
         mix = {'modulus': modulus,
                'generator': generator,
                'order': order,
@@ -3253,7 +4445,7 @@ class ZeusCoreElection(object):
                 % (nr_rounds, min_rounds))
             raise ZeusError(m)
 
-        crypto = self.do_get_cryptosystem()
+        crypto = self.get_cryptosystem()
         if [modulus, generator, order] != crypto:
             m = "Invalid mix: cryptosystem mismatch!"
             raise ZeusError(m)
@@ -3274,14 +4466,18 @@ class ZeusCoreElection(object):
         self.validate_mix(mix)
         self.do_store_mix(mix)
 
-    def validate_mixing(self):
+    def validate_mixing(self, verify_mix=None):
         teller = self.teller
         nr_parallel = self.get_option('nr_parallel')
         if nr_parallel is None:
             nr_parallel = 2
+        if verify_mix is None:
+            def verify_mix(mix):
+                return self.shuffle_module.verify_cipher_mix(
+                    mix, teller=teller, nr_parallel=nr_parallel)
         teller.task("Validating state: 'MIXING'")
 
-        crypto = self.do_get_cryptosystem()
+        crypto = self.get_cryptosystem()
         previous = None
         mixes = self.do_get_all_mixes()
         min_mixes = self.get_option('min_mixes') or 1
@@ -3304,8 +4500,7 @@ class ZeusCoreElection(object):
                             % (i+1, nr_mixes))
                         raise AssertionError(m)
 
-                    if not self.shuffle_module.verify_cipher_mix(
-                            mix, teller=teller, nr_parallel=nr_parallel):
+                    if not verify_mix(mix):
                         m = "Invalid mix proof"
                         raise AssertionError(m)
 
@@ -3410,12 +4605,12 @@ class ZeusCoreElection(object):
             raise ZeusError(m)
 
         trustee_public = trustee_factors['trustee_public']
-        trustees = self.do_get_trustees()
+        trustees = self.get_trustees()
         if trustee_public not in trustees:
             m = "Invalid trustee factors: No such trustee!"
             raise ZeusError(m)
 
-        crypto = self.do_get_cryptosystem()
+        crypto = self.get_cryptosystem()
         modulus = trustee_factors['modulus']
         generator = trustee_factors['generator']
         order = trustee_factors['order']
@@ -3450,13 +4645,13 @@ class ZeusCoreElection(object):
 
         self.do_store_trustee_factors(trustee_factors)
 
-    def validate_decrypting(self):
+    def validate_decrypting(self, verify_factors=verify_decryption_factors):
         teller = self.teller
         teller.task("Validating stage: 'DECRYPTING'")
 
-        crypto = self.do_get_cryptosystem()
+        crypto = self.get_cryptosystem()
         modulus, generator, order = crypto
-        trustees = self.do_get_trustees()
+        trustees = self.get_trustees()
         all_factors = self.do_get_all_trustee_factors()
         nr_trustees = len(trustees)
         nr_factors = len(all_factors)
@@ -3474,18 +4669,17 @@ class ZeusCoreElection(object):
 
             nr_parallel = self.get_option('nr_parallel')
             factors = all_factors[trustee]
-            if not verify_decryption_factors(modulus, generator, order,
-                                             trustee, mixed_ballots, factors,
-                                             teller=teller,
-                                             nr_parallel=nr_parallel):
+            if not verify_factors(modulus, generator, order,
+                                  trustee, mixed_ballots, factors,
+                                  teller=teller, nr_parallel=nr_parallel):
                 m = "Invalid trustee factors proof!"
                 raise ZeusError(m)
 
         zeus_factors = self.do_get_zeus_factors()
-        zeus_public = self.do_get_zeus_public()
-        if not verify_decryption_factors(modulus, generator, order,
-                                         zeus_public, mixed_ballots,
-                                         zeus_factors, teller=teller):
+        zeus_public = self.get_zeus_public()
+        if not verify_factors(modulus, generator, order,
+                              zeus_public, mixed_ballots,
+                              zeus_factors, teller=teller):
             m = "Invalid zeus factors proof!"
             raise ZeusError(m)
 
@@ -3495,8 +4689,8 @@ class ZeusCoreElection(object):
         Random.atfork()
         teller = self.teller
         mixed_ballots = self.get_mixed_ballots()
-        modulus, generator, order = self.do_get_cryptosystem()
-        secret = self.do_get_zeus_secret()
+        modulus, generator, order = self.get_cryptosystem()
+        secret = self.get_zeus_secret()
         nr_parallel = self.get_option('nr_parallel')
         with teller.task("Computing Zeus factors"):
             zeus_factors = compute_decryption_factors(modulus, generator,
@@ -3509,21 +4703,17 @@ class ZeusCoreElection(object):
     def decrypt_ballots(self):
         teller = self.teller
         mixed_ballots = self.get_mixed_ballots()
-        modulus, generator, order = self.do_get_cryptosystem()
+        modulus, generator, order = self.get_cryptosystem()
         zeus_factors = self.do_get_zeus_factors()
         all_factors = list(self.do_get_all_trustee_factors().values())
         all_factors.append(zeus_factors)
         decryption_factors = combine_decryption_factors(modulus, all_factors)
-        plaintexts = []
-        append = plaintexts.append
-
-        with teller.task("Decrypting ballots", total=len(mixed_ballots)):
-            for ballot, factor in zip(mixed_ballots, decryption_factors):
-                plaintext = decrypt_with_decryptor(modulus, generator, order,
-                                                   ballot[BETA], factor)
-                append(plaintext)
-                teller.advance()
-
+        betas = [ballot[BETA] for ballot in mixed_ballots]
+        nr_parallel = self.get_option('nr_parallel')
+        plaintexts = decrypt_with_decryptors(modulus, generator, order,
+                                             betas, decryption_factors,
+                                             teller=teller,
+                                             nr_parallel=nr_parallel)
         self.do_store_results(plaintexts)
         return plaintexts
 
@@ -3560,7 +4750,7 @@ class ZeusCoreElection(object):
 
         finished = self.export_decrypting()
         finished['results'] = self.do_get_results()
-        fingerprint = sha256(to_canonical(finished).encode()).hexdigest()
+        fingerprint = canonical_hash(finished)
         finished['election_fingerprint'] = fingerprint
 
         report = ''
@@ -3593,7 +4783,7 @@ class ZeusCoreElection(object):
         self.do_store_results(finished['results'])
         finished.pop('election_report', None)
         fingerprint = finished.pop('election_fingerprint', None)
-        _fingerprint = sha256(to_canonical(finished).encode()).hexdigest()
+        _fingerprint = canonical_hash(finished)
         if fingerprint is not None:
             if fingerprint != _fingerprint:
                 m = "Election fingerprint mismatch!"
@@ -3633,6 +4823,123 @@ class ZeusCoreElection(object):
         self.validate_finished()
         return 1
 
+    def validate_pipeline(self):
+        """Validate like validate(), but verify the vote signatures, the
+        mix proofs and the decryption factor proofs all at once on the
+        crypto pool, stopping at the first invalid one.
+
+        The checks of each stage that need no proofs run first, in
+        order, collecting the proofs to verify. Returns the seconds
+        each stage took until its last proof was verified.
+        """
+        teller = self.teller
+        nr_parallel = self.get_option('nr_parallel') or 2
+        pool = get_crypto_pool(nr_parallel)
+        timings = {}
+        tasks = {}
+        checks = {}
+
+        def run_stage(stage, method, **kw):
+            t = time()
+            try:
+                method(**kw)
+            except (AssertionError, ZeusError) as e:
+                raise _stage_error(stage, e)
+            timings[stage] = time() - t
+
+        run_stage('CREATING', self.validate_creating)
+
+        signatures = []
+
+        def collect_vote(vote):
+            if 'signature' not in vote:
+                m = "No signature found in vote!"
+                raise ZeusError(m)
+            signatures.append(vote['signature'])
+
+        constants = self.get_vote_signature_constants()
+
+        def check_votes(vote_infos):
+            for vote_info in vote_infos:
+                signed_vote = self.check_vote_signature(vote_info, constants)
+                self.validate_vote(signed_vote)
+
+        run_stage('VOTING', self.validate_voting, verify=collect_vote)
+        tasks['VOTING'] = [
+            ('VOTING', _verify_vote_signatures,
+             signatures[i:i + VOTE_SIGNATURE_BATCH_SIZE])
+            for i in range(0, len(signatures), VOTE_SIGNATURE_BATCH_SIZE)]
+        checks['VOTING'] = check_votes
+        del signatures
+
+        mix_tasks = tasks['MIXING'] = []
+        shuffle_module = self.shuffle_module
+
+        def collect_mix(mix):
+            if not hasattr(shuffle_module, 'cipher_mix_tasks'):
+                return shuffle_module.verify_cipher_mix(
+                    mix, teller=teller, nr_parallel=nr_parallel)
+            func = shuffle_module._verify_mix_round
+            for data in shuffle_module.cipher_mix_tasks(mix, pool):
+                mix_tasks.append(('MIXING', func, data))
+            return 1
+
+        run_stage('MIXING', self.validate_mixing, verify_mix=collect_mix)
+
+        factor_tasks = tasks['DECRYPTING'] = []
+
+        def collect_factors(modulus, generator, order, public,
+                            ciphers, factors, **kw):
+            if len(ciphers) != len(factors):
+                return 0
+            for data in decryption_factor_tasks(modulus, generator, order,
+                                                public, ciphers, factors,
+                                                pool):
+                factor_tasks.append(('DECRYPTING',
+                                     _verify_decryption_factor_batch, data))
+            return 1
+
+        def check_factors(result):
+            offset, invalid, count = result
+            if invalid >= 0:
+                m = "Invalid decryption factor for cipher %d" % (
+                    offset + invalid,)
+                raise ZeusError(m)
+
+        run_stage('DECRYPTING', self.validate_decrypting,
+                  verify_factors=collect_factors)
+        checks['DECRYPTING'] = check_factors
+
+        pending = dict((stage, len(t)) for stage, t in tasks.items())
+        all_tasks = [task for stage_tasks in zip_longest(*tasks.values())
+                     for task in stage_tasks if task is not None]
+        tasks.clear()
+        started = time()
+        # on the first invalid proof the pool is discarded along with
+        # the tasks still queued on it
+        with crypto_pool(nr_parallel) as pool, \
+                teller.task("Verifying proofs", total=len(all_tasks)):
+            results = pool.imap_unordered(_run_validation_task, all_tasks)
+            del all_tasks
+            for stage, result, error in results:
+                if error is not None:
+                    raise _stage_error(stage, error)
+                if stage in checks:
+                    try:
+                        checks[stage](result)
+                    except (AssertionError, ZeusError) as e:
+                        raise _stage_error(stage, e)
+                pending[stage] -= 1
+                if not pending[stage]:
+                    timings[stage] += time() - started
+                teller.advance()
+
+        run_stage('FINISHED', self.validate_finished)
+        for stage in ('CREATING', 'VOTING', 'MIXING',
+                      'DECRYPTING', 'FINISHED'):
+            teller.notice("%s: %.3fs", stage, timings[stage])
+        return timings
+
     ### CLIENT REFERENCE ###
 
     def mk_random_trustee(self):
@@ -3670,9 +4977,9 @@ class ZeusCoreElection(object):
 
     def mk_random_vote(self, selection=None, voter=None,
                              audit_code=None, publish=None):
-        modulus, generator, order = self.do_get_cryptosystem()
-        public = self.do_get_election_public()
-        candidates = self.do_get_candidates()
+        modulus, generator, order = self.get_cryptosystem()
+        public = self.get_election_public()
+        candidates = self.get_candidates()
         nr_candidates = len(candidates)
         if selection is None:
             r = get_random_int(0, 4)
@@ -3919,6 +5226,39 @@ class ZeusCoreElection(object):
         return self
 
 
+def benchmark_arithmetic(nr_ciphers=1000, nr_rounds=MIN_MIX_ROUNDS,
+                         cryptosystem=_default_crypto,
+                         teller=_teller, nr_parallel=0):
+    """Time mixing, mix verification and decryption factors with the
+    current ARITHMETIC backend. Returns the seconds each one took."""
+    from . import zeus_sk
+    p, g, q = crypto_args(cryptosystem)
+    secret, public = generate_keypair(p, g, q)[:2]
+    ciphers = [encrypt(get_random_int(1, q - 1), p, g, q, public)[:2]
+               for _ in range(nr_ciphers)]
+    ciphers_for_mixing = {'modulus': p, 'generator': g, 'order': q,
+                          'public': public, 'mixed_ciphers': ciphers}
+    timings = {}
+
+    t = time()
+    cipher_mix = zeus_sk.mix_ciphers(ciphers_for_mixing, nr_rounds=nr_rounds,
+                                     teller=teller, nr_parallel=nr_parallel)
+    timings['mix_ciphers'] = time() - t
+
+    t = time()
+    if not zeus_sk.verify_cipher_mix(cipher_mix, teller=teller,
+                                     nr_parallel=nr_parallel):
+        m = "Benchmark mix failed to verify"
+        raise AssertionError(m)
+    timings['verify_cipher_mix'] = time() - t
+
+    t = time()
+    compute_decryption_factors(p, g, q, secret, cipher_mix['mixed_ciphers'],
+                               teller=teller, nr_parallel=nr_parallel)
+    timings['compute_decryption_factors'] = time() - t
+    return timings
+
+
 def main(cmd=None):
     import argparse
     description='Zeus Election Reference Implementation and Verifier.'
@@ -3928,6 +5268,14 @@ def main(cmd=None):
     parser.add_argument('--election', metavar='infile',
         help="Read a FINISHED election from a proofs file and verify it")
 
+    parser.add_argument('--low-memory', action='store_true', default=False,
+        help="Verify --election reading each section from the proofs file "
+             "when it is needed, instead of loading it whole")
+
+    parser.add_argument('--pipeline', action='store_true', default=False,
+        help="Verify --election proofs of all stages concurrently "
+             "and report the time each stage took")
+
     parser.add_argument('--verify-signatures', nargs='*',
         metavar=('election_file', 'signature_file'),
         help="Read an election and a signature from a JSON file "
@@ -3963,6 +5311,10 @@ def main(cmd=None):
     parser.add_argument('--generate', nargs='*', metavar='outfile',
         help="Generate a random election and write it out in JSON")
 
+    parser.add_argument('--benchmark', type=int, metavar='nr_ciphers',
+        help="Time mixing, mix verification and decryption factors "
+             "of this many ciphers with the arithmetic backend")
+
     parser.add_argument('--stage', type=str, default='FINISHED',
                         help="Generate: Stop when this stage is complete")
 
@@ -4114,16 +5466,24 @@ def main(cmd=None):
         no_verify = args.no_verify
         filename = args.election
         sys.stderr.write("loading election from '%s'\n" % (filename,))
-        with open(filename, "r") as f:
-            try:
-                finished = from_canonical(f)
-            except ValueError:
-                finished = json_load(f)
-
-        election = ZeusCoreElection.new_at_finished(finished, teller=teller,
-                                                    nr_parallel=nr_parallel)
+        if args.low_memory:
+            from zeus.proofsfile import load_proofs_election
+            election = load_proofs_election(filename, teller=teller,
+                                            nr_parallel=nr_parallel)
+        else:
+            with open(filename, "r") as f:
+                try:
+                    finished = from_canonical(f)
+                except ValueError:
+                    finished = json_load(f)
+
+            election = ZeusCoreElection.new_at_finished(
+                finished, teller=teller, nr_parallel=nr_parallel)
         if not no_verify:
-            election.validate()
+            if args.pipeline:
+                election.validate_pipeline()
+            else:
+                election.validate()
 
         if args.extract_signatures:
             do_extract_signatures(election, args.extract_signatures,
@@ -4202,7 +5562,16 @@ def main(cmd=None):
     if args.nr_procs > 0:
         nr_parallel = args.nr_procs
 
-    if args.generate is not None:
+    if args.benchmark:
+        timings = benchmark_arithmetic(args.benchmark,
+                                       nr_rounds=args.nr_rounds,
+                                       teller=teller,
+                                       nr_parallel=nr_parallel)
+        teller_stream.flush()
+        for name, seconds in sorted(timings.items()):
+            print("%s %s %d %.2f" % (ARITHMETIC, name, args.benchmark,
+                                     seconds))
+    elif args.generate is not None:
         return main_generate(args, teller=teller, nr_parallel=nr_parallel)
     elif args.verify_signatures:
         return main_verify_signature(args, teller=teller,
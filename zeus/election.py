@@ -7,16 +7,19 @@ import copy
 import re
 
 from collections import OrderedDict
+from contextlib import contextmanager
 
 from zeus.core import ZeusCoreElection, Teller, sk_from_args, \
-    gamma_count_parties, gamma_count_range
+    gamma_count_parties, gamma_count_range, pack_decoded_ballots
 from zeus.core import V_CAST_VOTE, V_PUBLIC_AUDIT, V_AUDIT_REQUEST, \
-    ZeusError
+    ZeusError, numbers_hash, start_randomness_pool
 
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F, TextField
+from django.db.models.functions import Cast
 
 from helios.crypto import electionalgs, elgamal
-from helios.crypto import utils
 from helios import models as helios_models
 from helios import datatypes
 
@@ -36,9 +39,16 @@ ELGAMAL_PARAMS.g = DEFAULT_CRYPTOSYSTEM_PARAMS['g']
 MIXNET_NR_PARALLEL = getattr(settings, 'ZEUS_MIXNET_NR_PARALLEL', 2)
 MIXNET_NR_ROUNDS = getattr(settings, 'ZEUS_MIXNET_NR_ROUNDS', 128)
 SHUFFLE_MODULE = getattr(settings, 'SHUFFLE_MODULE', 'zeus.zeus_sk')
+RANDOMNESS_POOL_SIZE = getattr(settings, 'ZEUS_RANDOMNESS_POOL_SIZE', 0)
 
 shuffle_module = importlib.import_module(SHUFFLE_MODULE)
 
+CAST_VOTE_FIELDS = ('raw_vote', 'fingerprint', 'signature', 'previous',
+                    'index', 'verified_at', 'voter__uuid',
+                    'voter__voter_weight')
+AUDITED_BALLOT_FIELDS = ('raw_vote', 'fingerprint', 'signature',
+                         'audit_code', 'is_request', 'voter__uuid')
+
 
 class NullStream(object):
     """
@@ -51,6 +61,27 @@ class NullStream(object):
         return
 
 
+def decode_vote_json(raw_vote):
+    """
+    Decode a stored helios vote straight from its JSON text, without
+    going through the LDObject datatypes.
+
+    Returns (alpha, beta, commitment, challenge, response, answer,
+    voter_secret); answer and voter_secret are None unless the vote
+    carries its randomness, as published audit votes do.
+    """
+    answer = json.loads(raw_vote)['answers'][0]
+    cipher = answer['choices'][0]
+    commitment, challenge, response = answer['encryption_proof']
+    plaintext = voter_secret = None
+    if 'randomness' in answer:
+        plaintext = answer['answer']
+        voter_secret = int(answer['randomness'][0])
+    return (int(cipher['alpha']), int(cipher['beta']),
+            int(commitment), int(challenge), int(response),
+            plaintext, voter_secret)
+
+
 def get_datatype(datatype, obj=None, **kwargs):
     if len(datatype.split("/")) == 1:
         datatype = 'legacy/%s' % datatype
@@ -64,6 +95,9 @@ class ZeusDjangoElection(ZeusCoreElection):
     Implement required core do_store/do_get methods.
     """
 
+    _snapshot = None
+    _open_mixes = None
+
     @classmethod
     def from_election(self, election):
         return ZeusDjangoElection(election=election, poll=None)
@@ -82,6 +116,9 @@ class ZeusDjangoElection(ZeusCoreElection):
 
         kwargs['cryptosystem'] = (ELGAMAL_PARAMS.p, ELGAMAL_PARAMS.g,
                                   ELGAMAL_PARAMS.q)
+        if RANDOMNESS_POOL_SIZE:
+            start_randomness_pool(*kwargs['cryptosystem'],
+                                  size=RANDOMNESS_POOL_SIZE)
         kwargs['teller'] = Teller(outstream=NullStream())
         super(ZeusDjangoElection, self).__init__(*args, **kwargs)
         self.set_option(parallel=MIXNET_NR_PARALLEL)
@@ -92,51 +129,203 @@ class ZeusDjangoElection(ZeusCoreElection):
         return self.poll._get_zeus_vote(enc_vote, voter=voter,
                                                   audit_password=audit_password)
 
-    def do_get_vote(self, fingerprint):
-        # try CastVote
-        try:
-            vote = self.poll.cast_votes.get(fingerprint=fingerprint)
-            zeus_vote = self._get_zeus_vote(vote.vote)
-            zeus_vote['fingerprint'] = vote.fingerprint
-            zeus_vote['signature'] = vote.signature['signature']
-            zeus_vote['previous'] = vote.previous
-            zeus_vote['voter'] = vote.voter.uuid
-            zeus_vote['index'] = vote.index
-            zeus_vote['weight'] = vote.voter.voter_weight
-            return zeus_vote
-        except helios_models.CastVote.DoesNotExist:
-            pass
-        # then AuditedBallot
+    def _decode_zeus_vote(self, raw_vote, audit_password=None):
+        (alpha, beta, commitment, challenge, response,
+         answer, voter_secret) = decode_vote_json(raw_vote)
+        modulus, generator, order = self.get_cryptosystem()
+        fingerprint = numbers_hash((modulus, generator, alpha, beta,
+                                    commitment, challenge, response))
+        zeus_vote = {
+            'fingerprint': fingerprint,
+            'encrypted_ballot': {
+                'beta': beta,
+                'alpha': alpha,
+                'commitment': commitment,
+                'challenge': challenge,
+                'response': response,
+                'modulus': modulus,
+                'generator': generator,
+                'order': order,
+                'public': self.get_election_public()
+            }
+        }
+        if answer:
+            zeus_vote['audit_code'] = audit_password
+            zeus_vote['voter_secret'] = voter_secret
+        if audit_password:
+            zeus_vote['audit_code'] = audit_password
+        return zeus_vote
+
+    def _cast_vote_rows(self, **filters):
+        votes = self.poll.cast_votes.filter(**filters)
+        votes = votes.annotate(raw_vote=Cast('vote', TextField()))
+        return votes.values_list(*CAST_VOTE_FIELDS)
+
+    def _audited_ballot_rows(self, **filters):
+        audited = self.poll.audited_ballots.filter(**filters)
+        return audited.values_list(*AUDITED_BALLOT_FIELDS)
+
+    def _get_cast_zeus_vote(self, row):
+        (raw_vote, fingerprint, signature, previous, index,
+         verified_at, voter, weight) = row
+        zeus_vote = self._decode_zeus_vote(raw_vote)
+        zeus_vote['fingerprint'] = fingerprint
+        zeus_vote['signature'] = signature['signature']
+        zeus_vote['previous'] = previous
+        zeus_vote['voter'] = voter
+        zeus_vote['index'] = index
+        return zeus_vote
+
+    def _get_audited_zeus_vote(self, row):
+        raw_vote, fingerprint, signature, audit_code, is_request, voter = row
+        zeus_vote = self._decode_zeus_vote(raw_vote,
+                                           audit_password=audit_code)
+        zeus_vote['fingerprint'] = fingerprint
+        zeus_vote['signature'] = signature['signature']
+        return zeus_vote
+
+    def load_snapshot(self):
+        """
+        Load the cast votes, audited ballots and voters of the poll
+        in three streamed queries and index them in memory.
+        """
+        cast_votes = {}
+        casted_votes = {}
+        weights = {}
+        verified = {}
+        vote_index = []
+        for row in self._cast_vote_rows().order_by('pk').iterator():
+            (raw_vote, fingerprint, signature, previous, index,
+             verified_at, voter, weight) = row
+            cast_votes[fingerprint] = self._get_cast_zeus_vote(row)
+            weights[fingerprint] = weight
+            if verified_at is not None:
+                casted_votes[fingerprint] = cast_votes[fingerprint]
+                verified.setdefault(voter, []).append(fingerprint)
+            if index is not None:
+                vote_index.append((index, fingerprint))
+        vote_index.sort()
+
+        audit_publications = []
+        audit_votes = {}
+        audit_requests = {}
+        request_rows = {}
+        for row in self._audited_ballot_rows().order_by('pk').iterator():
+            fingerprint, is_request, voter = row[1], row[4], row[5]
+            if is_request:
+                audit_requests[fingerprint] = voter
+                request_rows[fingerprint] = row
+            else:
+                audit_publications.append(fingerprint)
+                audit_votes[fingerprint] = self._get_audited_zeus_vote(row)
+        for fingerprint, row in request_rows.items():
+            if fingerprint not in audit_votes:
+                audit_votes[fingerprint] = self._get_audited_zeus_vote(row)
+
+        voters = {}
+        excluded_voters = {}
+        for v in self.poll.voters.all().iterator():
+            voters[v.uuid] = v.zeus_string, v.voter_weight
+            if v.excluded_at is not None:
+                excluded_voters[v.uuid] = v.exclude_reason
+
+        return {
+            'cast_votes': cast_votes,
+            'casted_votes': casted_votes,
+            'weights': weights,
+            'verified_cast_votes': verified,
+            'vote_index': [fingerprint for index, fingerprint in vote_index],
+            'audit_votes': audit_votes,
+            'audit_publications': audit_publications,
+            'audit_requests': audit_requests,
+            'voters': voters,
+            'excluded_voters': excluded_voters,
+        }
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Answer the vote and voter do_get methods from a bulk loaded
+        snapshot of the poll for the duration of the block.
+        """
+        if self._snapshot is not None:
+            yield self._snapshot
+            return
+        self._snapshot = self.load_snapshot()
         try:
-            audited = self.poll.audited_ballots.get(
-                fingerprint=fingerprint, is_request=False)
-            helios_vote = electionalgs.EncryptedVote.fromJSONDict(
-                utils.from_json(audited.raw_vote))
-            zeus_vote = self._get_zeus_vote(
-                helios_vote,
-                audit_password=audited.audit_code)
-            zeus_vote['fingerprint'] = audited.fingerprint
-            zeus_vote['signature'] = audited.signature['signature']
-            return zeus_vote
-        except helios_models.AuditedBallot.DoesNotExist:
-            pass
-        # then AuditedBallot requests
+            yield self._snapshot
+        finally:
+            self._snapshot = None
+
+    @contextmanager
+    def open_mixes(self):
+        """
+        Close the mix files loaded by do_get_last_mix and do_get_all_mixes
+        at the end of the block.
+        """
+        if self._open_mixes is not None:
+            yield
+            return
+        self._open_mixes = []
         try:
-            audited = self.poll.audited_ballots.get(
-                fingerprint=fingerprint, is_request=True)
-            helios_vote = electionalgs.EncryptedVote.fromJSONDict(
-                utils.from_json(audited.raw_vote))
-            zeus_vote = self._get_zeus_vote(
-                helios_vote,
-                audit_password=audited.audit_code)
-            zeus_vote['fingerprint'] = audited.fingerprint
-            zeus_vote['signature'] = audited.signature['signature']
-            return zeus_vote
-        except helios_models.AuditedBallot.DoesNotExist:
+            yield
+        finally:
+            mixes, self._open_mixes = self._open_mixes, None
+            for mix in mixes:
+                mix.close()
+
+    def _load_mix(self, mixnet):
+        mix = mixnet.zeus_mix()
+        if self._open_mixes is not None and hasattr(mix, 'close'):
+            self._open_mixes.append(mix)
+        return mix
+
+    def validate_voting(self, *args, **kw):
+        with self.snapshot():
+            return super(ZeusDjangoElection, self).validate_voting(*args,
+                                                                   **kw)
+
+    def validate_pipeline(self):
+        with self.snapshot():
+            return super(ZeusDjangoElection, self).validate_pipeline()
+
+    def export_voting(self):
+        with self.snapshot():
+            return super(ZeusDjangoElection, self).export_voting()
+
+    def extract_votes_for_mixing(self):
+        with self.snapshot():
+            return super(ZeusDjangoElection,
+                         self).extract_votes_for_mixing()
+
+    def do_get_vote(self, fingerprint):
+        snapshot = self._snapshot
+        if snapshot is not None:
+            if fingerprint in snapshot['cast_votes']:
+                zeus_vote = dict(snapshot['cast_votes'][fingerprint])
+                zeus_vote['weight'] = snapshot['weights'][fingerprint]
+                return zeus_vote
+            if fingerprint in snapshot['audit_votes']:
+                return dict(snapshot['audit_votes'][fingerprint])
             return None
+
+        # try CastVote
+        row = self._cast_vote_rows(fingerprint=fingerprint).first()
+        if row is not None:
+            zeus_vote = self._get_cast_zeus_vote(row)
+            zeus_vote['weight'] = row[-1]
+            return zeus_vote
+        # then AuditedBallot, then AuditedBallot requests
+        for is_request in (False, True):
+            row = self._audited_ballot_rows(fingerprint=fingerprint,
+                                            is_request=is_request).first()
+            if row is not None:
+                return self._get_audited_zeus_vote(row)
         return None
 
     def do_get_cast_votes(self, voter):
+        if self._snapshot is not None:
+            return list(self._snapshot['verified_cast_votes'].get(voter, ()))
         votes = []
         for vote in self.poll.cast_votes.filter(verified_at__isnull=False,
                                                            voter__uuid=voter).order_by('pk'):
@@ -144,6 +333,11 @@ class ZeusDjangoElection(ZeusCoreElection):
         return votes
 
     def do_get_all_cast_votes(self):
+        if self._snapshot is not None:
+            verified = self._snapshot['verified_cast_votes']
+            return dict((voter, list(verified[voter]))
+                        for voter in self._snapshot['voters']
+                        if voter in verified)
         votes = {}
         for voter in self.do_get_voters():
             voter_votes = [vote for vote in self.do_get_cast_votes(voter)]
@@ -151,15 +345,29 @@ class ZeusDjangoElection(ZeusCoreElection):
                 votes[voter] = voter_votes
         return votes
 
+    @contextmanager
+    def do_lock_cast_votes(self, voter_key):
+        # Lock the poll row rather than the whole installation, until
+        # the enclosing transaction commits the cast vote
+        with transaction.atomic():
+            helios_models.Poll.objects.select_for_update().only('pk').get(
+                pk=self.poll.pk)
+            yield
+
     def do_index_vote(self, fingerprint):
-        # TODO: READ FOR UPDATE
-        index = self.poll.cast_votes.filter(verified_at__isnull=False).count()
+        # Take the next index from the poll counter, which the cast
+        # transaction rolls back if the vote is not stored
+        polls = helios_models.Poll.objects.filter(pk=self.poll.pk)
+        polls.update(next_vote_index=F('next_vote_index') + 1)
+        index = polls.values_list('next_vote_index', flat=True)[0] - 1
         return index
 
     def do_get_index_vote(self, index):
         return self.poll.cast_votes.get(index=index).fingerprint
 
     def do_get_vote_index(self):
+        if self._snapshot is not None:
+            return list(self._snapshot['vote_index'])
         votes = []
         for vote in self.poll.cast_votes.filter(index__isnull=False).order_by('index'):
             votes.append(vote.fingerprint)
@@ -167,6 +375,11 @@ class ZeusDjangoElection(ZeusCoreElection):
 
     def do_get_votes(self):
         votes = {}
+        if self._snapshot is not None:
+            for source in ('casted_votes', 'audit_votes'):
+                for fingerprint, vote in self._snapshot[source].items():
+                    votes[fingerprint] = dict(vote)
+            return votes
         casted = self._casted_votes()
         audited = self._audit_votes()
         votes.update(casted)
@@ -175,41 +388,23 @@ class ZeusDjangoElection(ZeusCoreElection):
 
     def _audit_votes(self):
         votes = {}
-        for audited in self.poll.audited_ballots.filter(is_request=False):
-            helios_vote = electionalgs.EncryptedVote.fromJSONDict(
-                utils.from_json(audited.raw_vote))
-            zeus_vote = self._get_zeus_vote(
-                helios_vote,
-                audit_password=audited.audit_code)
-            zeus_vote['fingerprint'] = audited.fingerprint
-            zeus_vote['signature'] = audited.signature['signature']
-            votes[audited.fingerprint] = zeus_vote
-        for audited in self.poll.audited_ballots.filter(is_request=True):
-            try:
-                self.poll.audited_ballots.get(fingerprint=audited.fingerprint,
-                                                        is_request=False)
-            except helios_models.AuditedBallot.DoesNotExist:
-                helios_vote = electionalgs.EncryptedVote.fromJSONDict(
-                    utils.from_json(audited.raw_vote))
-                zeus_vote = self._get_zeus_vote(
-                    helios_vote,
-                    audit_password=audited.audit_code)
-                zeus_vote['fingerprint'] = audited.fingerprint
-                zeus_vote['signature'] = audited.signature['signature']
-                votes[audited.fingerprint] = zeus_vote
+        requests = []
+        for row in self._audited_ballot_rows().iterator():
+            if row[4]:
+                requests.append(row)
+            else:
+                votes[row[1]] = self._get_audited_zeus_vote(row)
+        for row in requests:
+            if row[1] not in votes:
+                votes[row[1]] = self._get_audited_zeus_vote(row)
 
         return votes
 
     def _casted_votes(self):
         votes = {}
-        for vote in self.poll.cast_votes.filter(verified_at__isnull=False):
-            zeus_vote = self._get_zeus_vote(vote.vote, voter=vote.voter)
-            zeus_vote['fingerprint'] = vote.fingerprint
-            zeus_vote['signature'] = vote.signature['signature']
-            zeus_vote['previous'] = vote.previous
-            zeus_vote['voter'] = vote.voter.uuid
-            zeus_vote['index'] = vote.index
-            votes[vote.fingerprint] = zeus_vote
+        rows = self._cast_vote_rows(verified_at__isnull=False)
+        for row in rows.iterator():
+            votes[row[1]] = self._get_cast_zeus_vote(row)
         return votes
 
     def do_store_audit_publication(self, fingerprint):
@@ -219,12 +414,16 @@ class ZeusDjangoElection(ZeusCoreElection):
         pass
 
     def do_get_audit_requests(self):
+        if self._snapshot is not None:
+            return dict(self._snapshot['audit_requests'])
         reqs = {}
         for req in self.poll.audited_ballots.filter(is_request=True):
             reqs[req.fingerprint] = req.voter.uuid
         return reqs
 
     def do_get_audit_request(self, fingerprint):
+        if self._snapshot is not None:
+            return self._snapshot['audit_requests'].get(fingerprint)
         try:
             obj = self.poll.audited_ballots.get(
                 fingerprint=fingerprint,
@@ -234,6 +433,8 @@ class ZeusDjangoElection(ZeusCoreElection):
         return obj.voter.uuid
 
     def do_get_audit_publications(self):
+        if self._snapshot is not None:
+            return list(self._snapshot['audit_publications'])
         pubs = []
         for pub in self.poll.audited_ballots.filter(is_request=False):
             pubs.append(pub.fingerprint)
@@ -332,10 +533,15 @@ class ZeusDjangoElection(ZeusCoreElection):
         return self.poll.voters.get(uuid=voter_uuid)
 
     def do_get_voter(self, voter_uuid):
+        if self._snapshot is not None and \
+                voter_uuid in self._snapshot['voters']:
+            return self._snapshot['voters'][voter_uuid]
         v = self._get_voter_object(voter_uuid)
         return v.zeus_string, v.voter_weight
 
     def do_get_voters(self):
+        if self._snapshot is not None:
+            return dict(self._snapshot['voters'])
         voters = {}
         for v in self.poll.voters.all():
             voters[v.uuid] = v.zeus_string, v.voter_weight
@@ -476,7 +682,7 @@ class ZeusDjangoElection(ZeusCoreElection):
             status='finished').order_by('-mix_order')
         if mixes.count() == 0:
             return self.extract_votes_for_mixing()[0]
-        return mixes[0].zeus_mix()
+        return self._load_mix(mixes[0])
 
     def do_store_mix(self, mix):
         pass
@@ -484,7 +690,7 @@ class ZeusDjangoElection(ZeusCoreElection):
     def do_get_all_mixes(self):
         mixes = [self.extract_votes_for_mixing()[0]]
         for mixnet in self.poll.mixes.filter(status='finished').order_by('mix_order'):
-            mixes.append(mixnet.zeus_mix())
+            mixes.append(self._load_mix(mixnet))
         return mixes
 
     def mix(self, ciphers):
@@ -536,7 +742,16 @@ class ZeusDjangoElection(ZeusCoreElection):
     def do_store_results(self, results):
         e = self.poll
         e.result = [results]
+        e.decoded_result = None
         e.save()
+        if e.get_module().module_id == 'score':
+            return
+        # decode the ballots once, for Poll.decoded_ballots; ballots
+        # that do not decode are left for the count to reject
+        nr_candidates = len(self.do_get_candidates())
+        e.decoded_result = pack_decoded_ballots(results, nr_candidates)
+        if e.decoded_result is not None:
+            e.save()
 
     def do_get_results(self):
         return self.poll.result[0]
@@ -553,6 +768,8 @@ class ZeusDjangoElection(ZeusCoreElection):
         voter.save()
 
     def do_get_excluded_voters(self):
+        if self._snapshot is not None:
+            return dict(self._snapshot['excluded_voters'])
         excluded_voters = {}
         for voter in self.poll.voters.filter(
                 excluded_at__isnull=False):
@@ -581,7 +798,10 @@ class ZeusDjangoElection(ZeusCoreElection):
             from zeus.election_modules.sav import count_sav_results_for_poll
             return count_sav_results_for_poll(self.poll)
 
-        return gamma_count_parties(self.do_get_results(), self.do_get_candidates())
+        candidates = self.do_get_candidates()
+        decoded = self.poll.decoded_ballots(len(candidates))
+        return gamma_count_parties(self.do_get_results(), candidates,
+                                   decoded=decoded)
 
     def get_results_pretty_stv(self):
         stv_results = self.poll.stv_results[0]
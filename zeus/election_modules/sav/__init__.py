@@ -4,7 +4,6 @@ from fractions import Fraction
 
 from zeus.election_modules import ElectionModuleBase, election_module
 from django.conf import settings
-from zeus.core import gamma_decode, to_absolute_answers
 
 
 @election_module
@@ -144,11 +143,9 @@ def get_sav_ballots(poll):
     ballots_data = poll.result[0]
     ballots = []
 
-    for ballot in ballots_data:
-        if not ballot:
+    for encoded, ballot in zip(ballots_data, poll.decoded_ballots(cands_count)):
+        if not encoded:
             continue
-        ballot = to_absolute_answers(gamma_decode(ballot, cands_count, cands_count),
-                                     cands_count)
         ballots.append(ballot)
 
     return cands_data, ballots
@@ -10,7 +10,6 @@ from django.conf import settings
 from zeus.election_modules import ElectionModuleBase, election_module
 
 from stv.stv import count_stv, Ballot
-from zeus.core import gamma_decode, to_absolute_answers
 
 
 @election_module
@@ -83,6 +82,7 @@ class StvElection(ElectionModuleBase):
         poll.eligibles_count = int(cleaned_data[0]['eligibles'])
         poll.has_department_limit = cleaned_data[0]['has_department_limit']
         poll.department_limit = int(cleaned_data[0]['department_limit'])
+        poll.stv_count_decimals = cleaned_data[0].get('count_decimals')
 
     def update_answers(self):
         answers = []
@@ -172,7 +172,8 @@ class StvElection(ElectionModuleBase):
         stv_logger.addHandler(handler)
         stv_logger.setLevel(logging.DEBUG)
         results = count_stv(ballots, seats, droop, constituencies, quota_limit,
-                            rnd_gen, logger=stv_logger)
+                            rnd_gen, logger=stv_logger,
+                            decimals=self.poll.stv_count_decimals)
         results = list(results[0:2])
         handler.close()
         stv_stream.seek(0)
@@ -198,10 +199,8 @@ def get_csv_ballots(poll):
 
     ballots_data = poll.result[0]
     ballots = []
-    for ballot in ballots_data:
-        if not ballot:
+    for encoded, ballot in zip(ballots_data, poll.decoded_ballots(cands_count)):
+        if not encoded:
             continue
-        ballot = to_absolute_answers(gamma_decode(ballot, cands_count, cands_count),
-                                     cands_count)
         ballots.append(ballot)
     return ballots
@@ -528,6 +528,14 @@ class SavForm(QuestionBaseForm):
         return self.cleaned_data
 
 
+STV_COUNT_DECIMALS_CHOICES = (
+    ('', _('Floating point')),
+    ('4', _('Fixed point, 4 decimals')),
+    ('6', _('Fixed point, 6 decimals')),
+    ('9', _('Fixed point, 9 decimals')),
+)
+
+
 class StvForm(QuestionBaseForm):
 
     def __init__(self, *args, **kwargs):
@@ -556,6 +564,15 @@ class StvForm(QuestionBaseForm):
                                               required=True,
                                               widget=CandidateWidget(departments=self.department_choices),
                                               label=('Candidate'))
+        decimals_help_text = _("count transferred votes exactly, rounded "
+                               "down to this many decimals")
+        ordered_dict_prepend(self.fields, 'count_decimals',
+                             forms.ChoiceField(
+                                 choices=STV_COUNT_DECIMALS_CHOICES,
+                                 help_text=decimals_help_text,
+                                 label=_("Count arithmetic"),
+                                 required=False))
+
         widget=forms.TextInput(attrs={'hidden': 'True'})
         dep_lim_help_text = _("maximum number of elected from the same constituency")
         dep_lim_label = _("Constituency limit")
@@ -653,6 +670,12 @@ class StvForm(QuestionBaseForm):
         except ValueError:
             raise forms.ValidationError(message)
 
+    def clean_count_decimals(self):
+        decimals = self.cleaned_data.get('count_decimals')
+        if not decimals:
+            return None
+        return int(decimals)
+
     def clean_department_limit(self):
         message = _("Value must be a positive integer")
         dep_limit = self.cleaned_data.get('department_limit')
@@ -0,0 +1,356 @@
+"""
+Binary container for cipher mixes.
+
+A mix file holds the same data as the canonical JSON of a mix, with
+every number stored as a fixed-width big-endian integer, so that it can
+be memory mapped and its rounds read lazily instead of building the
+whole mix in memory.
+
+Layout, version 1:
+
+    header          MIX_FILE_HEADER: magic, version, number width,
+                    number of ciphers, number of rounds,
+                    challenge length, extra length
+    modulus, generator, order, public   width bytes each
+    challenge       ascii
+    extra           canonical JSON of any other keys of the mix
+    original ciphers, mixed ciphers     alpha, beta for every cipher
+    and for every round:
+        ciphers     alpha, beta for every cipher
+        offsets     OFFSET_WIDTH bytes for every cipher
+        randoms     width bytes for every cipher
+"""
+
+import mmap
+import os
+import struct
+from collections.abc import Mapping, Sequence
+
+from zeus.core import ZeusError, to_canonical, from_canonical
+
+
+MIX_FILE_MAGIC = b'ZEUSMIX\0'
+MIX_FILE_VERSION = 1
+MIX_FILE_HEADER = struct.Struct('>8sIIQIII')
+MIX_FILE_CACHE_SIZE = 4
+OFFSET_WIDTH = 4
+
+WRITE_CHUNK_SIZE = 4096
+READ_CHUNK_SIZE = 4096
+
+MIX_NUMBERS = ('modulus', 'generator', 'order', 'public')
+MIX_KEYS = MIX_NUMBERS + ('challenge',
+                          'original_ciphers', 'mixed_ciphers',
+                          'cipher_collections', 'offset_collections',
+                          'random_collections')
+
+_mix_files = {}
+
+
+def _pack_numbers(numbers, width):
+    try:
+        return b''.join([n.to_bytes(width, 'big') for n in numbers])
+    except (OverflowError, AttributeError) as e:
+        m = "Mix value does not fit in %d bytes" % width
+        raise ZeusError(m, e)
+
+
+def _write_ciphers(out, ciphers, width, nr_ciphers):
+    if len(ciphers) != nr_ciphers:
+        m = "Mix ciphers not of the same size"
+        raise ZeusError(m)
+    for i in range(0, nr_ciphers, WRITE_CHUNK_SIZE):
+        numbers = []
+        extend = numbers.extend
+        for cipher in ciphers[i:i + WRITE_CHUNK_SIZE]:
+            if len(cipher) != 2:
+                m = "Invalid cipher in mix"
+                raise ZeusError(m)
+            extend(cipher)
+        out.write(_pack_numbers(numbers, width))
+
+
+def _write_numbers(out, numbers, width, nr_ciphers):
+    if len(numbers) != nr_ciphers:
+        m = "Mix collections not of the same size"
+        raise ZeusError(m)
+    for i in range(0, nr_ciphers, WRITE_CHUNK_SIZE):
+        out.write(_pack_numbers(numbers[i:i + WRITE_CHUNK_SIZE], width))
+
+
+def write_mix_file(mix, out):
+    """Write the mix dict to the binary file object out.
+
+    Raises ZeusError when the mix cannot be represented losslessly,
+    which only happens for malformed mixes.
+    """
+    try:
+        modulus = mix['modulus']
+        challenge = mix['challenge'].encode('ascii')
+        original_ciphers = mix['original_ciphers']
+        mixed_ciphers = mix['mixed_ciphers']
+        cipher_collections = mix['cipher_collections']
+        offset_collections = mix['offset_collections']
+        random_collections = mix['random_collections']
+    except (KeyError, AttributeError, UnicodeError) as e:
+        m = "Invalid cipher mix format"
+        raise ZeusError(m, e)
+
+    extra = dict((k, v) for k, v in mix.items() if k not in MIX_KEYS)
+    extra = to_canonical(extra).encode('utf-8') if extra else b''
+
+    width = (modulus.bit_length() + 7) // 8
+    nr_ciphers = len(original_ciphers)
+    nr_rounds = len(cipher_collections)
+    if (len(offset_collections) != nr_rounds or
+        len(random_collections) != nr_rounds):
+        m = "Invalid cipher mix format: collections not of the same size!"
+        raise ZeusError(m)
+
+    out.write(MIX_FILE_HEADER.pack(MIX_FILE_MAGIC, MIX_FILE_VERSION,
+                                   width, nr_ciphers, nr_rounds,
+                                   len(challenge), len(extra)))
+    out.write(_pack_numbers([mix[k] for k in MIX_NUMBERS], width))
+    out.write(challenge)
+    out.write(extra)
+    _write_ciphers(out, original_ciphers, width, nr_ciphers)
+    _write_ciphers(out, mixed_ciphers, width, nr_ciphers)
+    for ciphers, offsets, randoms in zip(cipher_collections,
+                                         offset_collections,
+                                         random_collections):
+        _write_ciphers(out, ciphers, width, nr_ciphers)
+        _write_numbers(out, offsets, OFFSET_WIDTH, nr_ciphers)
+        _write_numbers(out, randoms, width, nr_ciphers)
+
+
+class MixSection(Sequence):
+    """Lazy view of the numbers, or [alpha, beta] ciphers, of one
+    section of a mix file."""
+
+    def __init__(self, mix_file, name, index, offset, count, width, pairs):
+        self.mix_file = mix_file
+        self.name = name
+        self.index = index
+        self.offset = offset
+        self.count = count
+        self.width = width
+        self.pairs = pairs
+        self.item_size = width * 2 if pairs else width
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.count))]
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("mix section index out of range")
+
+        data = self.mix_file.data
+        width = self.width
+        pos = self.offset + i * self.item_size
+        if not self.pairs:
+            return int.from_bytes(data[pos:pos + width], 'big')
+        mid = pos + width
+        return [int.from_bytes(data[pos:mid], 'big'),
+                int.from_bytes(data[mid:mid + width], 'big')]
+
+    def __iter__(self):
+        data = self.mix_file.data
+        width = self.width
+        item_size = self.item_size
+        from_bytes = int.from_bytes
+        end = self.offset + self.count * item_size
+        for start in range(self.offset, end, READ_CHUNK_SIZE * item_size):
+            chunk = data[start:min(start + READ_CHUNK_SIZE * item_size, end)]
+            if self.pairs:
+                for pos in range(0, len(chunk), item_size):
+                    mid = pos + width
+                    yield [from_bytes(chunk[pos:mid], 'big'),
+                           from_bytes(chunk[mid:mid + width], 'big')]
+            else:
+                for pos in range(0, len(chunk), width):
+                    yield from_bytes(chunk[pos:pos + width], 'big')
+
+    def raw(self):
+        return self.mix_file.data[self.offset:
+                                  self.offset + self.count * self.item_size]
+
+    def __eq__(self, other):
+        if (isinstance(other, MixSection) and other.pairs == self.pairs and
+            other.width == self.width):
+            return other.count == self.count and other.raw() == self.raw()
+        if not isinstance(other, (list, tuple, Sequence)):
+            return NotImplemented
+        if len(other) != self.count:
+            return False
+        return all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # Pool workers map the file themselves rather than receive a copy
+        return (load_mix_section, (self.mix_file.path, self.name, self.index))
+
+
+class MixRounds(Sequence):
+    """The per-round sections of one collection of a mix file."""
+
+    def __init__(self, mix_file, name):
+        self.mix_file = mix_file
+        self.name = name
+
+    def __len__(self):
+        return self.mix_file.nr_rounds
+
+    def __getitem__(self, r):
+        if isinstance(r, slice):
+            return [self[i] for i in range(*r.indices(len(self)))]
+        if r < 0:
+            r += len(self)
+        if not 0 <= r < len(self):
+            raise IndexError("mix round index out of range")
+        return self.mix_file.section(self.name, r)
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, tuple, Sequence)):
+            return NotImplemented
+        if len(other) != len(self):
+            return False
+        return all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+
+class MixFile(Mapping):
+    """Memory mapped mix file, read like the mix dict it was written
+    from. Cipher lists and collections are returned as lazy views."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self.data
+
+        if len(data) < MIX_FILE_HEADER.size:
+            m = "Not a mix file: %s" % (path,)
+            raise ZeusError(m)
+        header = MIX_FILE_HEADER.unpack_from(data, 0)
+        (magic, version, width, nr_ciphers, nr_rounds,
+         challenge_size, extra_size) = header
+        if magic != MIX_FILE_MAGIC:
+            m = "Not a mix file: %s" % (path,)
+            raise ZeusError(m)
+        if version != MIX_FILE_VERSION:
+            m = "Unsupported mix file version: %d" % (version,)
+            raise ZeusError(m)
+
+        self.width = width
+        self.nr_ciphers = nr_ciphers
+        self.nr_rounds = nr_rounds
+
+        values = {}
+        pos = MIX_FILE_HEADER.size
+        for key in MIX_NUMBERS:
+            values[key] = int.from_bytes(data[pos:pos + width], 'big')
+            pos += width
+        values['challenge'] = data[pos:pos + challenge_size].decode('ascii')
+        pos += challenge_size
+        if extra_size:
+            values.update(from_canonical(data[pos:pos + extra_size]))
+        pos += extra_size
+
+        self.ciphers_size = nr_ciphers * 2 * width
+        self.round_size = self.ciphers_size + nr_ciphers * (OFFSET_WIDTH +
+                                                            width)
+        self.rounds_offset = pos + 2 * self.ciphers_size
+        if len(data) != self.rounds_offset + nr_rounds * self.round_size:
+            m = "Truncated mix file: %s" % (path,)
+            raise ZeusError(m)
+
+        values['original_ciphers'] = MixSection(self, 'original_ciphers',
+                                                None, pos, nr_ciphers,
+                                                width, True)
+        pos += self.ciphers_size
+        values['mixed_ciphers'] = MixSection(self, 'mixed_ciphers',
+                                             None, pos, nr_ciphers,
+                                             width, True)
+        for name in ('cipher_collections', 'offset_collections',
+                     'random_collections'):
+            values[name] = MixRounds(self, name)
+        self.values = values
+
+    def section(self, name, index=None):
+        if index is None:
+            return self.values[name]
+
+        nr_ciphers = self.nr_ciphers
+        width = self.width
+        pos = self.rounds_offset + index * self.round_size
+        if name == 'cipher_collections':
+            return MixSection(self, name, index, pos, nr_ciphers,
+                              width, True)
+        pos += self.ciphers_size
+        if name == 'offset_collections':
+            return MixSection(self, name, index, pos, nr_ciphers,
+                              OFFSET_WIDTH, False)
+        pos += nr_ciphers * OFFSET_WIDTH
+        if name == 'random_collections':
+            return MixSection(self, name, index, pos, nr_ciphers,
+                              width, False)
+        raise KeyError(name)
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_mix_file(path):
+    return MixFile(path)
+
+
+def is_mix_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MIX_FILE_MAGIC)) == MIX_FILE_MAGIC
+
+
+def load_mix_section(path, name, index):
+    # Key on the file identity too, so that a path reused for another
+    # mix, e.g. a respooled temporary file, is not read from a stale map
+    st = os.stat(path)
+    key = (path, st.st_ino, st.st_mtime_ns, st.st_size)
+    mix_file = _mix_files.get(key)
+    if mix_file is None:
+        for stale in [k for k in _mix_files if k[0] == path]:
+            del _mix_files[stale]
+        while len(_mix_files) >= MIX_FILE_CACHE_SIZE:
+            del _mix_files[next(iter(_mix_files))]
+        mix_file = _mix_files[key] = MixFile(path)
+    return mix_file.section(name, index)
+
+
+def mix_file_to_canonical(path, out=None):
+    """Convert a mix file to the canonical JSON used by zeus-client."""
+    with read_mix_file(path) as mix:
+        return to_canonical(mix, out=out)
+
+
+def canonical_to_mix_file(inp, out):
+    """Convert canonical mix JSON, a string or file, to a mix file."""
+    write_mix_file(from_canonical(inp), out)
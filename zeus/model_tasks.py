@@ -267,14 +267,16 @@ class PollTasks(TaskModel):
 
     @poll_task('validate_mixing', ('mix_finished',))
     def validate_mixing(self):
-        ciphers = self.zeus.get_mixed_ballots()
-        tally_dict = {'num_tallied': len(ciphers), 'tally': [
-          [{'alpha': c[0], 'beta':c[1]} for c in ciphers]]}
-        tally = datatypes.LDObject.fromDict(tally_dict,
-                                            type_hint='phoebus/Tally')
-        self.encrypted_tally = tally
-        self.save()
-        self.zeus.validate_mixing()
+        zeus = self.zeus
+        with zeus.open_mixes():
+            ciphers = zeus.get_mixed_ballots()
+            tally_dict = {'num_tallied': len(ciphers), 'tally': [
+              [{'alpha': c[0], 'beta':c[1]} for c in ciphers]]}
+            tally = datatypes.LDObject.fromDict(tally_dict,
+                                                type_hint='phoebus/Tally')
+            self.encrypted_tally = tally
+            self.save()
+            zeus.validate_mixing()
 
     @poll_task('validate_voting', ('closed',))
     def validate_voting(self):
@@ -292,7 +294,9 @@ class PollTasks(TaskModel):
             dec.decryption_proofs = [[]]
             dec.save()
         else:
-            self.zeus.compute_zeus_factors()
+            zeus = self.zeus
+            with zeus.open_mixes():
+                zeus.compute_zeus_factors()
 
     @poll_task('partial_decrypt', ('validate_mixing_finished',),
                completed_cb=partial_decryptions_completed_check,
@@ -317,12 +321,16 @@ class PollTasks(TaskModel):
                         'modulus': modulus,
                         'generator': generator,
                         'order': order}
-        self.zeus.add_trustee_factors(zeus_factors)
+        zeus = self.zeus
+        with zeus.open_mixes():
+            zeus.add_trustee_factors(zeus_factors)
         trustee.save()
 
     @poll_task('decrypt', ('partial_decryptions_finished',))
     def decrypt(self):
-        self.zeus.decrypt_ballots()
+        zeus = self.zeus
+        with zeus.open_mixes():
+            zeus.decrypt_ballots()
         self.store_zeus_proofs()
 
     @poll_task('compute_results')
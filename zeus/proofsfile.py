@@ -0,0 +1,395 @@
+"""
+Lazy reader for election proofs files.
+
+A proofs file is the canonical JSON export of a finished election. A
+ProofsFile indexes the byte offsets of its sections once, and decodes
+each section from the memory mapped file only when it is accessed:
+every vote, every mix and each round of its proof, and the factors of
+every trustee. ProofsElection replays such a file without keeping its
+votes in memory, so that it can be verified stage by stage.
+"""
+
+import os
+import re
+import json
+import mmap
+from collections.abc import MutableMapping, Sequence
+
+from zeus.core import ZeusError, ZeusCoreElection, _teller
+
+
+PROOFS_FILE_CACHE_SIZE = 4
+PROOFS_INDEX_MIN_SIZE = 1 << 16
+
+_WHITESPACE = re.compile(rb'[ \t\n\r]*')
+_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"', re.S)
+_SCALAR = re.compile(rb'[^,:\[\]{}" \t\n\r]+')
+# lists at most two deep without strings or objects, such as the
+# ciphers of a mix round, are skipped with a single match
+_NUMBERS = re.compile(rb'\[(?:[^\[\]{}"]*\[[^\[\]{}"]*\])*[^\[\]{}"]*\]')
+
+_proofs_files = {}
+
+
+def _invalid(pos):
+    m = "Invalid proofs file at offset %d" % (pos,)
+    return ZeusError(m)
+
+
+def _skip_whitespace(data, pos):
+    return _WHITESPACE.match(data, pos).end()
+
+
+def _scan_value(data, pos, index):
+    """Return the offset just past the JSON value at pos, recording the
+    member spans of the large objects and arrays within it in index."""
+    c = data[pos:pos + 1]
+    if c == b'{':
+        return _scan_object(data, pos, index)[1]
+    if c == b'[':
+        m = _NUMBERS.match(data, pos)
+        if m is None:
+            return _scan_array(data, pos, index)[1]
+    elif c == b'"':
+        m = _STRING.match(data, pos)
+    else:
+        m = _SCALAR.match(data, pos)
+    if m is None:
+        raise _invalid(pos)
+    return m.end()
+
+
+def _scan_object(data, pos, index):
+    """Return the (start, end) spans of the members of the JSON object
+    at pos by key, and the offset just past it."""
+    start = pos
+    spans = {}
+    if data[pos:pos + 1] != b'{':
+        raise _invalid(pos)
+    pos = _skip_whitespace(data, pos + 1)
+    if data[pos:pos + 1] == b'}':
+        return spans, pos + 1
+
+    while True:
+        m = _STRING.match(data, pos)
+        if m is None:
+            raise _invalid(pos)
+        key = m.group()
+        if b'\\' in key:
+            key = json.loads(key)
+        else:
+            key = key[1:-1].decode('utf-8')
+        pos = _skip_whitespace(data, m.end())
+        if data[pos:pos + 1] != b':':
+            raise _invalid(pos)
+        pos = _skip_whitespace(data, pos + 1)
+        end = _scan_value(data, pos, index)
+        spans[key] = (pos, end)
+        pos = _skip_whitespace(data, end)
+        c = data[pos:pos + 1]
+        if c == b'}':
+            break
+        if c != b',':
+            raise _invalid(pos)
+        pos = _skip_whitespace(data, pos + 1)
+
+    pos += 1
+    if pos - start >= PROOFS_INDEX_MIN_SIZE:
+        index[start] = spans
+    return spans, pos
+
+
+def _scan_array(data, pos, index):
+    """Return the (start, end) spans of the items of the JSON array at
+    pos, and the offset just past it."""
+    start = pos
+    spans = []
+    if data[pos:pos + 1] != b'[':
+        raise _invalid(pos)
+    pos = _skip_whitespace(data, pos + 1)
+    if data[pos:pos + 1] == b']':
+        return spans, pos + 1
+
+    while True:
+        end = _scan_value(data, pos, index)
+        spans.append((pos, end))
+        pos = _skip_whitespace(data, end)
+        c = data[pos:pos + 1]
+        if c == b']':
+            break
+        if c != b',':
+            raise _invalid(pos)
+        pos = _skip_whitespace(data, pos + 1)
+
+    pos += 1
+    if pos - start >= PROOFS_INDEX_MIN_SIZE:
+        index[start] = spans
+    return spans, pos
+
+
+class ProofsValue(Sequence):
+    """Lazy view of a JSON list in a proofs file, decoded on first use.
+
+    It pickles as a reference to its place in the file, so that pool
+    workers decode it themselves.
+    """
+
+    def __init__(self, proofs, start, end):
+        self.proofs = proofs
+        self.start = start
+        self.end = end
+        self._value = None
+
+    def value(self):
+        value = self._value
+        if value is None:
+            value = self._value = self.proofs.decode(self.start, self.end)
+        return value
+
+    def raw(self):
+        return self.proofs.data[self.start:self.end]
+
+    def __len__(self):
+        return len(self.value())
+
+    def __getitem__(self, i):
+        return self.value()[i]
+
+    def __iter__(self):
+        return iter(self.value())
+
+    def __eq__(self, other):
+        if isinstance(other, ProofsValue) and other.raw() == self.raw():
+            return True
+        if not isinstance(other, (list, tuple, Sequence)):
+            return NotImplemented
+        value = self.value()
+        if len(other) != len(value):
+            return False
+        return all(a == b for a, b in zip(value, other))
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (load_proofs_value, (self.proofs.path, self.start, self.end))
+
+
+class ProofsList(Sequence):
+    """The items of a JSON array in a proofs file, each one decoded
+    when it is accessed."""
+
+    def __init__(self, proofs, spans, factory):
+        self.proofs = proofs
+        self.spans = spans
+        self.factory = factory
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        start, end = self.spans[i]
+        return self.factory(self.proofs, start, end)
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, tuple, Sequence)):
+            return NotImplemented
+        if len(other) != len(self):
+            return False
+        return all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+
+class ProofsMapping(MutableMapping):
+    """The members of a JSON object in a proofs file, each one decoded
+    when it is accessed. Members may be replaced or removed, which only
+    affects this view."""
+
+    def __init__(self, proofs, spans, factories):
+        self.proofs = proofs
+        self.spans = spans
+        self.factories = factories
+        self.overrides = {}
+
+    def __getitem__(self, key):
+        overrides = self.overrides
+        if key in overrides:
+            return overrides[key]
+        start, end = self.spans[key]
+        factory = self.factories.get(key, _decode)
+        return factory(self.proofs, start, end)
+
+    def __setitem__(self, key, value):
+        self.spans.pop(key, None)
+        self.overrides[key] = value
+
+    def __delitem__(self, key):
+        if key in self.overrides:
+            del self.overrides[key]
+        else:
+            del self.spans[key]
+
+    def __iter__(self):
+        for key in self.spans:
+            yield key
+        for key in self.overrides:
+            yield key
+
+    def __len__(self):
+        return len(self.spans) + len(self.overrides)
+
+
+def _decode(proofs, start, end):
+    return proofs.decode(start, end)
+
+
+def _list_of(factory):
+    def load_list(proofs, start, end):
+        return ProofsList(proofs, proofs.array_spans(start), factory)
+    return load_list
+
+
+def _mapping_of(factories):
+    def load_mapping(proofs, start, end):
+        spans = dict(proofs.object_spans(start))
+        return ProofsMapping(proofs, spans, factories)
+    return load_mapping
+
+
+MIX_FACTORIES = {
+    'original_ciphers': ProofsValue,
+    'mixed_ciphers': ProofsValue,
+    'cipher_collections': _list_of(ProofsValue),
+    'offset_collections': _list_of(ProofsValue),
+    'random_collections': _list_of(ProofsValue),
+}
+
+TRUSTEE_FACTORS_FACTORIES = {
+    'decryption_factors': ProofsValue,
+}
+
+PROOFS_FACTORIES = {
+    'votes': _list_of(_decode),
+    'mixes': _list_of(_mapping_of(MIX_FACTORIES)),
+    'trustee_factors': _list_of(_mapping_of(TRUSTEE_FACTORS_FACTORIES)),
+    'zeus_decryption_factors': ProofsValue,
+}
+
+
+class ProofsFile(ProofsMapping):
+    """Memory mapped proofs file, read like the exported election it
+    was written from.
+
+    The file is scanned once when opened, and the member spans of its
+    large objects and arrays are kept so that they need not be scanned
+    again when accessed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.index = {}
+
+        data = self.data
+        start = _skip_whitespace(data, 0)
+        spans, end = _scan_object(data, start, self.index)
+        end = _skip_whitespace(data, end)
+        if end != len(data):
+            raise _invalid(end)
+        super(ProofsFile, self).__init__(self, dict(spans), PROOFS_FACTORIES)
+
+    def decode(self, start, end):
+        return json.loads(self.data[start:end])
+
+    def object_spans(self, start):
+        spans = self.index.get(start)
+        if spans is None:
+            spans = _scan_object(self.data, start, self.index)[0]
+        return spans
+
+    def array_spans(self, start):
+        spans = self.index.get(start)
+        if spans is None:
+            spans = _scan_array(self.data, start, self.index)[0]
+        return spans
+
+    def close(self):
+        self.data.close()
+
+
+def read_proofs_file(path):
+    return ProofsFile(path)
+
+
+def load_proofs_value(path, start, end):
+    # Key on the file identity too, so that a proofs file rewritten at
+    # the same path is scanned again rather than read at stale offsets
+    st = os.stat(path)
+    key = (path, st.st_ino, st.st_mtime_ns, st.st_size)
+    proofs = _proofs_files.get(key)
+    if proofs is None:
+        for stale in [k for k in _proofs_files if k[0] == path]:
+            del _proofs_files[stale]
+        while len(_proofs_files) >= PROOFS_FILE_CACHE_SIZE:
+            del _proofs_files[next(iter(_proofs_files))]
+        proofs = _proofs_files[key] = ProofsFile(path)
+    return ProofsValue(proofs, start, end)
+
+
+class ProofsVotes(MutableMapping):
+    """Votes by fingerprint, left in the proofs file until accessed."""
+
+    def __init__(self, refs=None):
+        self.refs = dict(refs) if refs else {}
+
+    def __getitem__(self, fingerprint):
+        ref = self.refs[fingerprint]
+        if isinstance(ref, tuple):
+            votes, index = ref
+            return votes[index]
+        return ref
+
+    def __setitem__(self, fingerprint, vote):
+        self.refs[fingerprint] = vote
+
+    def __delitem__(self, fingerprint):
+        del self.refs[fingerprint]
+
+    def __iter__(self):
+        return iter(self.refs)
+
+    def __len__(self):
+        return len(self.refs)
+
+    def copy(self):
+        return ProofsVotes(self.refs)
+
+
+class ProofsElection(ZeusCoreElection):
+    """ZeusCoreElection that keeps the votes of the proofs file it was
+    loaded from on disk, decoding them one at a time."""
+
+    def do_init_voting(self):
+        super(ProofsElection, self).do_init_voting()
+        self.votes = ProofsVotes()
+
+    def do_store_votes(self, votes):
+        if not isinstance(votes, ProofsList):
+            return super(ProofsElection, self).do_store_votes(votes)
+        refs = self.votes.refs
+        for index, vote in enumerate(votes):
+            refs[vote['fingerprint']] = (votes, index)
+
+    def do_get_votes(self):
+        return self.votes.copy()
+
+
+def load_proofs_election(path, teller=_teller, **kw):
+    """Index the proofs file at path and replay it into a FINISHED
+    ProofsElection, ready to be validated."""
+    with teller.task("Indexing proofs file '%s'" % (path,)):
+        finished = read_proofs_file(path)
+    return ProofsElection.new_at_finished(finished, teller=teller, **kw)
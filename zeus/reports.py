@@ -4,7 +4,7 @@ import csv
 from functools import partial
 
 from io import StringIO
-from zeus.core import gamma_decode
+from zeus.core import gamma_decode_many
 from zeus.utils import CSVReader
 from django.db.models import Count
 from django.utils.translation import ugettext as _
@@ -99,7 +99,9 @@ def election_voters_report(elections):
 
 
 def _single_votes(results, clen):
-    return [sel for sel in results if len(gamma_decode(sel, clen)) == 1]
+    decoded = gamma_decode_many(results, clen)
+    return [sel for sel, selection in zip(results, decoded)
+            if len(selection) == 1]
 
 
 def _get_choices_sums(results, choices_len):
@@ -107,8 +109,8 @@ def _get_choices_sums(results, choices_len):
     for i in range(choices_len+1):
         data[str(i)] = 0
 
-    for encoded in results:
-        chosen_len = len(gamma_decode(encoded, choices_len))
+    for selection in gamma_decode_many(results, choices_len):
+        chosen_len = len(selection)
         data[str(chosen_len)] = data[str(chosen_len)] + 1
 
     return data
@@ -3,18 +3,67 @@
 import tempfile
 import shutil
 import os
+import io
+import json
 import pytest
 
+from contextlib import contextmanager
+
+from hashlib import sha256
+
 from zeus.core import (
     _default_crypto,
     encrypt,
     compute_decryption_factors,
+    verify_decryption_factors,
     combine_decryption_factors,
     decrypt_with_decryptor,
+    decrypt_with_decryptors,
+    batch_inverse,
+    fixed_base_pow,
+    multi_pow,
+    get_random_int,
+    get_crypto_pool,
+    close_crypto_pool,
+    sign_element,
+    verify_element_signature,
+    verify_element_signatures_batch,
+    verify_vote_signature,
+    verify_vote_signatures,
+    RandomnessPool,
+    inverse,
+    jacobi,
+    _python_jacobi,
+    _python_invert,
     from_canonical,
+    to_canonical,
+    iter_canonical,
+    canonical_hash,
     main,
+    ZeusCoreElection,
+    ZeusError,
+    key_public,
+    key_proof,
+    gamma_encode,
+    gamma_decode,
+    gamma_decode_many,
+    gamma_encoding_max,
+    to_absolute_answers,
+    to_relative_answers,
+    to_absolute_answers_many,
+    to_relative_answers_many,
+    pack_selections,
+    pack_decoded_ballots,
+    unpack_selections,
+)
+from zeus.mixfile import (
+    write_mix_file, read_mix_file, is_mix_file, load_mix_section,
+    mix_file_to_canonical, canonical_to_mix_file,
+)
+from zeus.proofsfile import read_proofs_file, load_proofs_value
+from zeus.zeus_sk import (
+    mix_ciphers, verify_cipher_mix, compute_mix_challenge,
 )
-from zeus.zeus_sk import mix_ciphers
 
 
 def test_decryption():
@@ -67,6 +116,452 @@ def test_decryption():
         pts.append(decrypt_with_decryptor(p, g, q, beta, factor))
     assert sorted(pts) == sorted(texts)
 
+    betas = [beta for alpha, beta in cts]
+    for batch_size in (1, 2, 4096):
+        assert decrypt_with_decryptors(p, g, q, betas, master_factors,
+                                       batch_size=batch_size) == pts
+    assert decrypt_with_decryptors(p, g, q, betas, master_factors,
+                                   nr_parallel=2, batch_size=2) == pts
+    elements = [pow(g, x, p) for x in range(2, 7)]
+    assert batch_inverse(elements, p) == [inverse(e, p) for e in elements]
+
+
+def test_fixed_base_pow():
+    g = _default_crypto['generator']
+    p = _default_crypto['modulus']
+    q = _default_crypto['order']
+
+    exponents = [0, 1, 2, 63, 64, 65, q - 1, q, p - 1, p, 2 * p + 3]
+    exponents += [get_random_int(3, q) for _ in range(10)]
+    for e in exponents:
+        assert fixed_base_pow(g, e, p) == pow(g, e, p)
+
+
+def test_arithmetic_backend():
+    g = _default_crypto['generator']
+    p = _default_crypto['modulus']
+    q = _default_crypto['order']
+
+    for x in [0, 1, 2, g, p - 1] + [get_random_int(2, p) for _ in range(20)]:
+        legendre = pow(x, q, p)
+        expected = 0 if x == 0 else (1 if legendre == 1 else -1)
+        assert jacobi(x, p) == expected
+        assert _python_jacobi(x, p) == expected
+    assert _python_jacobi(6, 15) == jacobi(6, 15) == 0
+
+    x = get_random_int(2, p)
+    assert _python_invert(x, p) == inverse(x, p)
+    assert (x * inverse(x, p)) % p == 1
+    with pytest.raises(ZeroDivisionError):
+        _python_invert(6, 15)
+
+    assert type(fixed_base_pow(g, q - 1, p)) is int
+    assert type(multi_pow([g, x], [3, q - 1], p)) is int
+
+
+def test_multi_pow():
+    g = _default_crypto['generator']
+    p = _default_crypto['modulus']
+    q = _default_crypto['order']
+
+    bases = [get_random_int(2, p) for _ in range(6)] + [g]
+    exponents = [get_random_int(3, q) for _ in range(4)] + [0, 17, -5]
+    expected = 1
+    for b, e in zip(bases, exponents):
+        expected = (expected * pow(b, e, p)) % p
+    assert multi_pow(bases, exponents, p) == expected
+    assert multi_pow([], [], p) == 1
+
+
+def test_answers_conversion():
+    assert to_relative_answers([1, 2, 0], 3) == [1, 1, 0]
+    assert to_absolute_answers([1, 1, 0], 3) == [1, 2, 0]
+    assert to_relative_answers([], 0) == []
+
+    nr_candidates = 300
+    choices_list = []
+    for _ in range(20):
+        choices = list(range(nr_candidates))
+        for i in range(nr_candidates - 1, 0, -1):
+            j = get_random_int(0, i + 1)
+            choices[i], choices[j] = choices[j], choices[i]
+        choices_list.append(choices[:get_random_int(0, nr_candidates + 1)])
+    relative_list = to_relative_answers_many(choices_list, nr_candidates)
+    for choices, relative in zip(choices_list, relative_list):
+        remaining = list(range(nr_candidates))
+        for choice, r in zip(choices, relative):
+            assert remaining.index(choice) == r
+            remaining.remove(choice)
+    assert to_absolute_answers_many(relative_list,
+                                    nr_candidates) == choices_list
+
+    for choices in ([3], [-1], [1, 1]):
+        with pytest.raises(ValueError):
+            to_relative_answers(choices, 3)
+    with pytest.raises(IndexError):
+        to_absolute_answers([0, 2], 3)
+
+
+def test_gamma_decode_many():
+    nr_candidates = 6
+    max_encoded = gamma_encoding_max(nr_candidates)
+    encoded = [get_random_int(0, max_encoded + 1) for _ in range(200)]
+    encoded += encoded[:50] + [0]
+    decoded = gamma_decode_many(encoded, nr_candidates, nr_candidates)
+    absolute = gamma_decode_many(encoded, nr_candidates, nr_candidates,
+                                 absolute=True)
+    for e, selection, answers in zip(encoded, decoded, absolute):
+        expected = gamma_decode(e, nr_candidates, nr_candidates)
+        assert selection == expected
+        assert answers == to_absolute_answers(expected, nr_candidates)
+        assert gamma_encode(selection, nr_candidates, nr_candidates) == e
+    assert decoded[0] is not decoded[200]
+
+    data = pack_selections(absolute, nr_candidates)
+    assert unpack_selections(data) == (nr_candidates, absolute)
+    assert unpack_selections(pack_selections([], 3)) == (3, [])
+    with pytest.raises(ZeusError):
+        unpack_selections(data[:-2])
+    with pytest.raises(ZeusError):
+        unpack_selections(data + b'\0\0')
+    with pytest.raises(ZeusError):
+        pack_selections([], 0x10000)
+
+    assert pack_decoded_ballots(encoded, nr_candidates) == data
+    # one ballot out of range leaves all of them to the count
+    assert pack_decoded_ballots(encoded + [max_encoded + 1],
+                                nr_candidates) is None
+
+
+def test_verify_decryption_factors_batch():
+    g = _default_crypto['generator']
+    p = _default_crypto['modulus']
+    q = _default_crypto['order']
+
+    secret = get_random_int(3, q)
+    public = pow(g, secret, p)
+    cts = [encrypt(t, p, g, q, public)[:2] for t in range(10)]
+    factors = compute_decryption_factors(p, g, q, secret, cts, nr_parallel=0)
+    for batch_size in (1, 3, 128):
+        assert verify_decryption_factors(p, g, q, public, cts, factors,
+                                         nr_parallel=0, batch_size=batch_size)
+
+    # A factor outside the group must be caught even inside a batch
+    factor, proof = factors[7]
+    factors[7] = [p - factor, proof]
+    assert not verify_decryption_factors(p, g, q, public, cts, factors,
+                                         nr_parallel=0)
+    factors[7] = [(factor * g) % p, proof]
+    assert not verify_decryption_factors(p, g, q, public, cts, factors,
+                                         nr_parallel=0)
+
+
+def test_verify_element_signatures_batch():
+    g = _default_crypto['generator']
+    p = _default_crypto['modulus']
+    q = _default_crypto['order']
+
+    key = get_random_int(3, q)
+    public = pow(g, key, p)
+    elements = [pow(g, get_random_int(3, q), p) for _ in range(8)]
+    signatures = [sign_element(e, p, g, q, key) for e in elements]
+    assert verify_element_signatures_batch(signatures, p, g, q, public)
+
+    signature = signatures[5]
+    signature['s'] = (signature['s'] + 1) % (p - 1)
+    assert not verify_element_signature(signature, p, g, q, public)
+    assert not verify_element_signatures_batch(signatures, p, g, q, public)
+
+
+def test_verify_vote_signatures():
+    election = ZeusCoreElection.mk_random(nr_candidates=3, nr_trustees=2,
+                                          nr_voters=10, nr_votes=20,
+                                          stage='VOTING')
+    signatures = [v['signature'] for v in election.do_get_votes().values()]
+    vote_infos = [verify_vote_signature(s) for s in signatures]
+    for batch_size in (1, 3, 64):
+        assert verify_vote_signatures(signatures,
+                                      batch_size=batch_size) == vote_infos
+
+    election.set_option(nr_parallel=2)
+    election.validate_voting()
+
+    vote = list(election.do_get_votes().values())[-1]
+    message, e, r, s, null = vote['signature'].rsplit('\n', 4)
+    vote['signature'] = '\n'.join((message, e, r, '%x' % (int(s, 16) + 1),
+                                   null))
+    with pytest.raises(ZeusError):
+        verify_vote_signatures(signatures[:-1] + [vote['signature']])
+    with pytest.raises(ZeusError) as e:
+        election.validate_voting()
+    assert "Invalid vote signature!" in str(e.value)
+
+
+def test_election_constants():
+    election = ZeusCoreElection.mk_random(nr_candidates=3, nr_trustees=2,
+                                          nr_voters=5, nr_votes=0,
+                                          stage='CREATING')
+    calls = []
+    do_get_trustees = election.do_get_trustees
+
+    def counted_do_get_trustees():
+        calls.append(1)
+        return do_get_trustees()
+
+    election.do_get_trustees = counted_do_get_trustees
+    trustees = dict(election.get_trustees())
+    election.get_trustees()
+    assert len(calls) == 1
+
+    public = election.get_election_public()
+    trustee = election.mk_random_trustee()
+    election.add_trustee(key_public(trustee), key_proof(trustee))
+    nr_calls = len(calls)
+    assert len(election.get_trustees()) == len(trustees) + 1
+    assert election.get_election_public() != public
+    assert len(calls) == nr_calls + 1
+
+    election.set_voting()
+    nr_calls = len(calls)
+    election.get_trustees()
+    election.get_trustees()
+    assert len(calls) == nr_calls + 1
+
+
+def test_cast_vote_lock():
+    election = ZeusCoreElection.mk_random(nr_candidates=3, nr_trustees=1,
+                                          nr_voters=3, nr_votes=1,
+                                          stage='VOTING')
+    locked = []
+    validate_submitted_vote = election.validate_submitted_vote
+
+    @contextmanager
+    def lock_cast_votes(voter_key):
+        locked.append(voter_key)
+        yield
+        locked.pop()
+
+    def unlocked_validate_submitted_vote(vote):
+        assert not locked
+        return validate_submitted_vote(vote)
+
+    stored = []
+    do_store_votes = election.do_store_votes
+
+    def recorded_do_store_votes(votes):
+        stored.append(bool(locked))
+        return do_store_votes(votes)
+
+    election.do_lock_cast_votes = lock_cast_votes
+    election.validate_submitted_vote = unlocked_validate_submitted_vote
+    election.do_store_votes = recorded_do_store_votes
+    vote = election.mk_random_vote()[0]
+    signature = election.cast_vote(vote)
+    assert election.verify_vote_signature(signature)['index'] == 1
+    assert not locked
+
+    # audit requests and publications are stored under the lock too
+    vote = election.mk_random_vote(audit_code=12345, publish=1)[0]
+    request = dict(vote)
+    del request['voter_secret']
+    election.cast_vote(request)
+    election.cast_vote(vote)
+    assert stored == [True, True, True]
+    assert not locked
+
+
+def test_randomness_pool():
+    g = _default_crypto['generator']
+    p = _default_crypto['modulus']
+    q = _default_crypto['order']
+
+    pool = RandomnessPool(p, g, q, size=4)
+    assert pool.fill() == 8
+    assert pool.fill() == 0
+    entries = list(pool.signing)
+    taken = [pool.signing_randomness() for _ in range(6)]
+    assert taken[:4] == entries
+    assert len(set(r for r, w in taken)) == 6
+    assert pool.needed.is_set()
+    for r, w in taken:
+        assert pow(g, inverse(w, p - 1), p) == r
+
+    w, commitment = pool.proof_randomness()
+    assert commitment == pow(g, w, p)
+
+    key = get_random_int(3, q)
+    public = pow(g, key, p)
+    element = pow(g, get_random_int(3, q), p)
+    signature = sign_element(element, p, g, q, key)
+    assert verify_element_signature(signature, p, g, q, public)
+
+    pool.clear()
+    assert not pool.signing and not pool.proving
+
+
+def test_crypto_pool_reuse():
+    g = _default_crypto['generator']
+    p = _default_crypto['modulus']
+    q = _default_crypto['order']
+
+    secret = get_random_int(3, q)
+    public = pow(g, secret, p)
+    cts = [encrypt(t, p, g, q, public)[:2] for t in range(10)]
+    try:
+        pool = get_crypto_pool(2)
+        factors = compute_decryption_factors(p, g, q, secret, cts,
+                                             nr_parallel=2)
+        assert [f for f, proof in factors] == [pow(a, secret, p)
+                                               for a, b in cts]
+        assert verify_decryption_factors(p, g, q, public, cts, factors,
+                                         nr_parallel=2, batch_size=3)
+        assert get_crypto_pool(2) is pool
+        assert pool.share(cts) == pool.share([list(c) for c in cts])
+
+        # a pool of a different size is never handed out
+        assert get_crypto_pool(1).nr_parallel == 1
+        pool = get_crypto_pool(2)
+
+        # a failed verification cancels the batches still queued
+        factors[9] = [(factors[9][0] * g) % p, factors[9][1]]
+        assert not verify_decryption_factors(p, g, q, public, cts, factors,
+                                             nr_parallel=2, batch_size=3)
+        assert get_crypto_pool(2) is not pool
+    finally:
+        close_crypto_pool()
+
+
+def test_mix_parallel_chunks():
+    g = _default_crypto['generator']
+    p = _default_crypto['modulus']
+    q = _default_crypto['order']
+
+    public = pow(g, get_random_int(3, q), p)
+    cts = [encrypt(t, p, g, q, public)[:2] for t in range(7)]
+    cfm = {'modulus': p,
+           'generator': g,
+           'order': q,
+           'public': public,
+           'original_ciphers': cts,
+           'mixed_ciphers': cts}
+    try:
+        # fewer rounds than workers, split across cipher ranges
+        mix = mix_ciphers(cfm, nr_rounds=3, nr_parallel=4)
+        assert len(mix['cipher_collections']) == 3
+        assert all(None not in c for c in mix['cipher_collections'])
+        assert verify_cipher_mix(mix, nr_parallel=0)
+    finally:
+        close_crypto_pool()
+
+
+def test_mix_challenge_digest():
+    g = _default_crypto['generator']
+    p = _default_crypto['modulus']
+    q = _default_crypto['order']
+
+    public = pow(g, get_random_int(3, q), p)
+    cts = [encrypt(t, p, g, q, public)[:2] for t in range(5)]
+    cfm = {'modulus': p,
+           'generator': g,
+           'order': q,
+           'public': public,
+           'original_ciphers': cts,
+           'mixed_ciphers': cts}
+    mix = mix_ciphers(cfm, nr_rounds=4)
+
+    def reference(mix):
+        hasher = sha256()
+        for n in ('modulus', 'generator', 'order', 'public'):
+            hasher.update(("%x" % mix[n]).encode())
+        ciphers = mix['original_ciphers'] + mix['mixed_ciphers']
+        for collection in mix['cipher_collections']:
+            ciphers = ciphers + collection
+        for alpha, beta in ciphers:
+            hasher.update(("%x" % alpha).encode())
+            hasher.update(("%x" % beta).encode())
+        return hasher.hexdigest()
+
+    assert mix['challenge'] == compute_mix_challenge(mix) == reference(mix)
+
+    # small and out of range values still hash as their "%x" form
+    mix['mixed_ciphers'] = [[0, 1], [15, 16], [p << 8, -2]]
+    assert compute_mix_challenge(mix) == reference(mix)
+
+
+def test_mix_file():
+    g = _default_crypto['generator']
+    p = _default_crypto['modulus']
+    q = _default_crypto['order']
+
+    public = pow(g, get_random_int(3, q), p)
+    cts = [encrypt(t, p, g, q, public)[:2] for t in range(6)]
+    cfm = {'modulus': p,
+           'generator': g,
+           'order': q,
+           'public': public,
+           'original_ciphers': cts,
+           'mixed_ciphers': cts}
+    mix = mix_ciphers(cfm, nr_rounds=4)
+    mix['extra'] = {'note': 'kept'}
+
+    d = tempfile.mkdtemp(prefix='zeus')
+    try:
+        path = os.path.join(d, 'mix')
+        with open(path, 'wb') as f:
+            write_mix_file(mix, f)
+        assert is_mix_file(path)
+
+        mix_file = read_mix_file(path)
+        assert dict(mix_file) == mix
+        assert mix_file['cipher_collections'][-1] == \
+            mix['cipher_collections'][-1]
+        assert mix_file['offset_collections'][1][2] == \
+            mix['offset_collections'][1][2]
+        assert mix_file_to_canonical(path) == to_canonical(mix)
+        assert compute_mix_challenge(mix_file) == mix['challenge']
+        assert verify_cipher_mix(mix_file, nr_parallel=0)
+        assert verify_cipher_mix(mix_file, nr_parallel=2)
+
+        copy = os.path.join(d, 'copy')
+        with open(copy, 'wb') as f:
+            canonical_to_mix_file(to_canonical(mix), f)
+        with read_mix_file(copy) as copy_file:
+            assert copy_file['mixed_ciphers'] == mix_file['mixed_ciphers']
+        assert load_mix_section(copy, 'mixed_ciphers', None) == \
+            mix['mixed_ciphers']
+
+        # A rewritten file is mapped again, not served from the cache
+        cfm['original_ciphers'] = cfm['mixed_ciphers'] = cts[:4]
+        other = mix_ciphers(cfm, nr_rounds=2)
+        with open(copy, 'wb') as f:
+            write_mix_file(other, f)
+        assert load_mix_section(copy, 'mixed_ciphers', None) == \
+            other['mixed_ciphers']
+        mix_file.close()
+    finally:
+        shutil.rmtree(d)
+
+
+def test_canonical_stream():
+    p = _default_crypto['modulus']
+    obj = {
+        'votes': [{'fingerprint': '%x' % i,
+                   'encrypted_ballot': {'alpha': p - i, 'beta': i}}
+                  for i in range(1500)],
+        'mixes': [{'ciphers': [[i, p - i] for i in range(2100)],
+                   'offsets': tuple(range(5))}],
+        'excluded_voters': {'\u03b1': 'reason "quoted"\n'},
+        'results': [[], {}, None, True, 0.5],
+        'factors': {3: {'empty': []}, 1: [[]]},
+    }
+    expected = json.dumps(obj, sort_keys=True)
+
+    assert ''.join(iter_canonical(obj)) == expected
+    out = io.StringIO()
+    to_canonical(obj, out=out)
+    assert out.getvalue() == expected
+    assert canonical_hash(obj) == sha256(expected.encode()).hexdigest()
+
 
 # Test both single-process and parallel version.
 @pytest.mark.parametrize('processes', [0, 2])
@@ -80,3 +575,60 @@ def test_generate(processes):
             from_canonical(f)
     finally:
         shutil.rmtree(d)
+
+
+def test_validate_pipeline():
+    election = ZeusCoreElection.mk_random(nr_candidates=3, nr_trustees=2,
+                                          nr_voters=10, nr_votes=10,
+                                          nr_rounds=4, stage='FINISHED',
+                                          nr_parallel=2)
+    election.set_option(min_mix_rounds=4)
+    timings = election.validate_pipeline()
+    assert sorted(timings) == sorted(['CREATING', 'VOTING', 'MIXING',
+                                      'DECRYPTING', 'FINISHED'])
+
+    trustee, factors = list(election.do_get_all_trustee_factors().items())[0]
+    factor, proof = factors[0]
+    factors[0] = [factor + 1, proof]
+    pool = get_crypto_pool(2)
+    with pytest.raises(ZeusError) as e:
+        election.validate_pipeline()
+    assert "'DECRYPTING'" in str(e.value)
+    # the proofs still queued were cancelled with the pool
+    assert get_crypto_pool(2) is not pool
+    close_crypto_pool()
+
+
+def test_proofs_file():
+    d = tempfile.mkdtemp(prefix='zeus')
+    try:
+        filename = os.path.join(d, 'election.json')
+        main(['--generate', filename, '--trustees', '1', '--rounds', '4',
+              '--quiet'])
+        with open(filename) as f:
+            finished = from_canonical(f)
+
+        proofs = read_proofs_file(filename)
+        assert sorted(proofs) == sorted(finished)
+        assert list(proofs['votes']) == finished['votes']
+        mix = proofs['mixes'][-1]
+        assert mix['cipher_collections'] == \
+            finished['mixes'][-1]['cipher_collections']
+        assert to_canonical(proofs) == to_canonical(finished)
+
+        election = main(['--election', filename, '--low-memory',
+                         '--parallel', '2', '--quiet'])
+        assert election.election_fingerprint == \
+            finished['election_fingerprint']
+        assert election.do_get_results() == finished['results']
+
+        # A proofs file rewritten at the same path is scanned again
+        span = proofs.spans['results']
+        assert load_proofs_value(filename, *span) == finished['results']
+        proofs.close()
+        with open(filename + '.tmp', 'w') as f:
+            f.write('{"results": [7, 8, 9], "padding": 0}')
+        os.replace(filename + '.tmp', filename)
+        assert list(load_proofs_value(filename, 12, 21)) == [7, 8, 9]
+    finally:
+        shutil.rmtree(d)
@@ -941,6 +941,14 @@ class TestSimpleElection(TestElectionBase):
     def test_election_process(self):
         self.election_process()
 
+    def test_validate_pipeline(self):
+        self.election_process()
+        e = Election.objects.get(uuid=self.e_uuid)
+        for poll in e.polls.all():
+            timings = poll.zeus.validate_pipeline()
+            assert sorted(timings) == sorted(['CREATING', 'VOTING', 'MIXING',
+                                              'DECRYPTING', 'FINISHED'])
+
     def test_broken_mix_election_process(self):
 
         from zeus.model_tasks import poll_task, PollTasks
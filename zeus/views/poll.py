@@ -12,7 +12,6 @@ from django.urls import reverse
 from django.forms import ValidationError
 from django.utils import translation
 from django.utils.translation import ugettext_lazy as _
-from django.db import connection
 from django.db.models import Max
 from django.template.context_processors import csrf
 from django.views.decorators.csrf import csrf_exempt
@@ -961,14 +960,11 @@ def cast(request, election, poll):
         type_hint='phoebus/EncryptedVote').wrapped_obj
     audit_password = request.POST.get('audit_password', None)
 
-    cursor = connection.cursor()
-    try:
-        cursor.execute("SELECT pg_advisory_lock(1)")
-        with transaction.atomic():
-            cast_result = poll.cast_vote(voter, vote, audit_password)
-            poll.logger.info("Poll cast")
-    finally:
-        cursor.execute("SELECT pg_advisory_unlock(1)")
+    # The poll is locked only while the vote is indexed and stored,
+    # see ZeusDjangoElection.do_lock_cast_votes
+    with transaction.atomic():
+        cast_result = poll.cast_vote(voter, vote, audit_password)
+        poll.logger.info("Poll cast")
 
     signature = {'signature': cast_result}
 
@@ -1237,10 +1233,11 @@ def remote_mix(request, election, poll, mix_key):
     if not election.check_mix_key(mix_key):
         raise PermissionDenied
     if method == 'GET':
-        resp = poll.zeus.get_last_mix()
+        zeus = poll.zeus
+        with zeus.open_mixes():
+            resp = to_canonical(zeus.get_last_mix())
         # Use X_SEND_FILE
-        return HttpResponse(to_canonical(resp),
-                        content_type="application/octet-stream")
+        return HttpResponse(resp, content_type="application/octet-stream")
     if method == 'POST':
         data = from_canonical(request.body or '')
         result = poll.add_remote_mix(data)
@@ -2,48 +2,76 @@
 from zeus.core import (
         ZeusError, pow, sha256, ALPHA, BETA,
         get_random_int, bit_iterator, get_random_permutation,
+        fixed_base_pow_mpz, precompute_fixed_base, mpz,
+        crypto_pool, get_shared_ciphers,
         MIN_MIX_ROUNDS, _teller)
-from billiard import Pool
-from Crypto import Random
+from binascii import hexlify
+from itertools import chain
+
+
+MIX_CHUNK_SIZE = 256
 
 
 def reencrypt(modulus, generator, order, public, alpha, beta, secret=None):
     key = get_random_int(3, order) if secret is None else secret
-    alpha = (alpha * pow(generator, key, modulus)) % modulus
-    beta = (beta * pow(public, key, modulus)) % modulus
+    m = mpz(modulus)
+    alpha = int(alpha * fixed_base_pow_mpz(generator, key, modulus) % m)
+    beta = int(beta * fixed_base_pow_mpz(public, key, modulus) % m)
     if secret is None:
         return [alpha, beta, key]
     return [alpha, beta]
 
 
-def compute_mix_challenge(cipher_mix):
+def hash_ciphers(hasher, ciphers, modulus):
+    """Feed ciphers to hasher as their "%x" formatted alphas and betas.
+
+    Numbers below the modulus size are hex encoded through to_bytes,
+    which is much faster than string formatting and gives the same
+    bytes once leading zeros are stripped.
+    """
+    nr_bytes = (modulus.bit_length() + 7) // 8
+    update = hasher.update
+    for cipher in ciphers:
+        a = cipher[ALPHA]
+        b = cipher[BETA]
+        try:
+            a = hexlify(a.to_bytes(nr_bytes, 'big')).lstrip(b'0') or b'0'
+            b = hexlify(b.to_bytes(nr_bytes, 'big')).lstrip(b'0') or b'0'
+        except OverflowError:
+            # negative or oversized, only found in invalid mixes
+            a = ("%x" % cipher[ALPHA]).encode()
+            b = ("%x" % cipher[BETA]).encode()
+        update(a)
+        update(b)
+
+
+def mix_challenge_hasher(modulus, generator, order, public):
     hasher = sha256()
+    for n in (modulus, generator, order, public):
+        hasher.update(("%x" % n).encode())
+    return hasher
 
-    def update(s):
-        hasher.update(s.encode())
-
-    update("%x" % cipher_mix['modulus'])
-    update("%x" % cipher_mix['generator'])
-    update("%x" % cipher_mix['order'])
-    update("%x" % cipher_mix['public'])
-
-    original_ciphers = cipher_mix['original_ciphers']
-    for cipher in original_ciphers:
-        update("%x" % cipher[ALPHA])
-        update("%x" % cipher[BETA])
 
-    mixed_ciphers = cipher_mix['mixed_ciphers']
-    for cipher in mixed_ciphers:
-        update("%x" % cipher[ALPHA])
-        update("%x" % cipher[BETA])
+def compute_mix_challenge_stream(modulus, generator, order, public,
+                                 cipher_lists):
+    """Compute a mix challenge in one pass over cipher_lists, which yields
+    the original ciphers, the mixed ciphers and then every collection
+    in order; each list can be dropped once it has been hashed."""
+    hasher = mix_challenge_hasher(modulus, generator, order, public)
+    for ciphers in cipher_lists:
+        hash_ciphers(hasher, ciphers, modulus)
+    return hasher.hexdigest()
 
-    for ciphers in cipher_mix['cipher_collections']:
-        for cipher in ciphers:
-            update("%x" % cipher[ALPHA])
-            update("%x" % cipher[BETA])
 
-    challenge = hasher.hexdigest()
-    return challenge
+def compute_mix_challenge(cipher_mix):
+    cipher_lists = chain([cipher_mix['original_ciphers'],
+                          cipher_mix['mixed_ciphers']],
+                         cipher_mix['cipher_collections'])
+    return compute_mix_challenge_stream(cipher_mix['modulus'],
+                                        cipher_mix['generator'],
+                                        cipher_mix['order'],
+                                        cipher_mix['public'],
+                                        cipher_lists)
 
 
 def shuffle_ciphers(modulus, generator, order, public, ciphers,
@@ -73,8 +101,61 @@ def shuffle_ciphers(modulus, generator, order, public, ciphers,
     return [mixed_ciphers, mixed_offsets, mixed_randoms]
 
 
-def _shuffle_ciphers(data):
-    return shuffle_ciphers(*data)
+def _reencrypt_ciphers(data):
+    p, g, q, y, ciphers_ref, r, start, end = data
+    ciphers = get_shared_ciphers(ciphers_ref)
+    reencrypted = [reencrypt(p, g, q, y, alpha, beta)
+                   for alpha, beta in ciphers[start:end]]
+    return r, start, reencrypted
+
+
+def parallel_shuffle_ciphers(modulus, generator, order, public, ciphers,
+                             nr_shuffles, nr_parallel,
+                             teller=None, chunk_size=MIX_CHUNK_SIZE):
+    """Produce nr_shuffles shuffles of ciphers, as shuffle_ciphers does,
+    spreading (shuffle, cipher range) chunks over the crypto pool so
+    that every worker has work even for a single shuffle.
+
+    Shuffles are yielded in order, each as soon as it is complete.
+    """
+    nr_ciphers = len(ciphers)
+
+    shuffles = []
+    for _ in range(nr_shuffles):
+        mixed_offsets = get_random_permutation(nr_ciphers)
+        mixed_ciphers = list([None]) * nr_ciphers
+        mixed_randoms = list([None]) * nr_ciphers
+        shuffles.append([mixed_ciphers, mixed_offsets, mixed_randoms])
+
+    if not nr_ciphers:
+        yield from shuffles
+        return
+
+    # Aim for a few chunks per worker so that all of them stay busy
+    # until the end, whatever the number of shuffles.
+    chunks_per_shuffle = -(-nr_parallel * 4 // max(nr_shuffles, 1))
+    d = -(-nr_ciphers // chunks_per_shuffle)
+    d = max(min(d, chunk_size), 1)
+    with crypto_pool(nr_parallel) as pool:
+        ciphers_ref = pool.share(ciphers)
+        data = [
+            (modulus, generator, order, public, ciphers_ref, r, i, i + d)
+            for r in range(nr_shuffles)
+            for i in range(0, nr_ciphers, d)
+        ]
+        for r, start, reencrypted in pool.imap(_reencrypt_ciphers, data):
+            mixed_ciphers, mixed_offsets, mixed_randoms = shuffles[r]
+            i = start
+            for alpha, beta, secret in reencrypted:
+                mixed_randoms[i] = secret
+                mixed_ciphers[mixed_offsets[i]] = [alpha, beta]
+                i += 1
+            if teller:
+                teller.advance(len(reencrypted))
+            # chunks come back in order, so the shuffle is done at its
+            # last one
+            if i >= nr_ciphers:
+                yield shuffles[r]
 
 
 def mix_ciphers(ciphers_for_mixing, nr_rounds=MIN_MIX_ROUNDS,
@@ -84,7 +165,8 @@ def mix_ciphers(ciphers_for_mixing, nr_rounds=MIN_MIX_ROUNDS,
     q = ciphers_for_mixing['order']
     y = ciphers_for_mixing['public']
 
-    original_ciphers = ciphers_for_mixing['mixed_ciphers']
+    # May be a lazy mix file view, the new mix gets a plain list
+    original_ciphers = list(ciphers_for_mixing['mixed_ciphers'])
     nr_ciphers = len(original_ciphers)
 
     teller.task('Mixing %d ciphers for %d rounds' % (nr_ciphers, nr_rounds))
@@ -92,29 +174,41 @@ def mix_ciphers(ciphers_for_mixing, nr_rounds=MIN_MIX_ROUNDS,
     cipher_mix = {'modulus': p, 'generator': g, 'order': q, 'public': y}
     cipher_mix['original_ciphers'] = original_ciphers
 
+    # Build the tables before the pool is first forked so workers inherit them
+    precompute_fixed_base(p, g, y)
+
     with teller.task('Producing final mixed ciphers', total=nr_ciphers):
-        shuffled = shuffle_ciphers(p, g, q, y, original_ciphers, teller=teller)
+        if nr_parallel > 0:
+            [shuffled] = parallel_shuffle_ciphers(p, g, q, y,
+                                                  original_ciphers, 1,
+                                                  nr_parallel, teller=teller)
+        else:
+            shuffled = shuffle_ciphers(p, g, q, y, original_ciphers,
+                                       teller=teller)
         mixed_ciphers, mixed_offsets, mixed_randoms = shuffled
         cipher_mix['mixed_ciphers'] = mixed_ciphers
 
+    # The challenge is hashed as the ciphers are produced
+    hasher = mix_challenge_hasher(p, g, q, y)
+    hash_ciphers(hasher, original_ciphers, p)
+    hash_ciphers(hasher, mixed_ciphers, p)
+
     total = nr_ciphers * nr_rounds
     with teller.task('Producing ciphers for proof', total=total):
         if nr_parallel > 0:
-            pool = Pool(nr_parallel, Random.atfork)
-            data = [
-                (p, g, q, y, original_ciphers)
-                for _ in range(nr_rounds)
-            ]
-            collections = []
-            for r in pool.imap(_shuffle_ciphers, data):
-                teller.advance()
-                collections.append(r)
-            pool.close()
-            pool.join()
+            shuffles = parallel_shuffle_ciphers(p, g, q, y,
+                                                original_ciphers,
+                                                nr_rounds, nr_parallel,
+                                                teller=teller)
         else:
-            collections = [shuffle_ciphers(p, g, q, y,
-                                           original_ciphers, teller=teller)
-                           for _ in range(nr_rounds)]
+            shuffles = (shuffle_ciphers(p, g, q, y,
+                                        original_ciphers, teller=teller)
+                        for _ in range(nr_rounds))
+
+        collections = []
+        for shuffled in shuffles:
+            hash_ciphers(hasher, shuffled[0], p)
+            collections.append(shuffled)
 
         unzipped = [list(x) for x in zip(*collections)]
         cipher_collections, offset_collections, random_collections = unzipped
@@ -123,7 +217,7 @@ def mix_ciphers(ciphers_for_mixing, nr_rounds=MIN_MIX_ROUNDS,
         cipher_mix['offset_collections'] = offset_collections
 
     with teller.task('Producing cryptographic hash challenge'):
-        challenge = compute_mix_challenge(cipher_mix)
+        challenge = hasher.hexdigest()
         cipher_mix['challenge'] = challenge
 
     bits = bit_iterator(int(challenge, 16))
@@ -225,10 +319,16 @@ def verify_mix_round(p, g, q, y, i, bit, original_ciphers, mixed_ciphers,
 
 
 def _verify_mix_round(data):
-    return verify_mix_round(*data)
+    (p, g, q, y, i, bit, original_ref, mixed_ref,
+     ciphers, randoms, offsets) = data
+    original_ciphers = get_shared_ciphers(original_ref)
+    mixed_ciphers = get_shared_ciphers(mixed_ref)
+    return verify_mix_round(p, g, q, y, i, bit,
+                            original_ciphers, mixed_ciphers,
+                            ciphers, randoms, offsets)
 
 
-def verify_cipher_mix(cipher_mix, teller=_teller, nr_parallel=0):
+def _check_cipher_mix(cipher_mix):
     try:
         p = cipher_mix['modulus']
         g = cipher_mix['generator']
@@ -249,44 +349,63 @@ def verify_cipher_mix(cipher_mix, teller=_teller, nr_parallel=0):
         m = "Invalid challenge"
         raise ZeusError(m)
 
-    nr_ciphers = len(original_ciphers)
     nr_rounds = len(cipher_collections)
-    teller.task('Verifying mixing of %d ciphers for %d rounds'
-                 % (nr_ciphers, nr_rounds))
-
     if (len(offset_collections) != nr_rounds or
         len(random_collections) != nr_rounds):
         m = "Invalid cipher mix format: collections not of the same size!"
         raise ZeusError(m)
 
+    # Rounds are fetched one at a time, lazy mixes are not loaded whole
+    rounds = ((i, bit, cipher_collections[i],
+               random_collections[i], offset_collections[i])
+              for i, bit in zip(range(nr_rounds),
+                                bit_iterator(int(challenge, 16))))
+    return p, g, q, y, original_ciphers, mixed_ciphers, nr_rounds, rounds
+
+
+def cipher_mix_tasks(cipher_mix, pool):
+    """Check the format and challenge of cipher_mix, and return the
+    _verify_mix_round arguments that verify its rounds on pool."""
+    (p, g, q, y, original_ciphers, mixed_ciphers,
+     nr_rounds, rounds) = _check_cipher_mix(cipher_mix)
+    original_ref = pool.share(original_ciphers)
+    mixed_ref = pool.share(mixed_ciphers)
+    return [(p, g, q, y, i, bit, original_ref, mixed_ref,
+             ciphers, randoms, offsets)
+            for i, bit, ciphers, randoms, offsets in rounds]
+
+
+def verify_cipher_mix(cipher_mix, teller=_teller, nr_parallel=0):
+    (p, g, q, y, original_ciphers, mixed_ciphers,
+     nr_rounds, rounds) = _check_cipher_mix(cipher_mix)
+
+    nr_ciphers = len(original_ciphers)
+    teller.task('Verifying mixing of %d ciphers for %d rounds'
+                 % (nr_ciphers, nr_rounds))
+
     #if not validate_cryptosystem(p, g, q, teller):
     #    m = "Invalid cryptosystem"
     #    raise AssertionError(m)
 
+    precompute_fixed_base(p, g, y)
+
     total = nr_rounds * nr_ciphers
     with teller.task('Verifying ciphers', total=total):
-        data = []
-        for i, bit in zip(range(nr_rounds), bit_iterator(int(challenge, 16))):
-            ciphers = cipher_collections[i]
-            randoms = random_collections[i]
-            offsets = offset_collections[i]
-            data.append((p, g, q, y,
-                         i, bit, original_ciphers,
-                         mixed_ciphers, ciphers,
-                         randoms, offsets))
-
         if nr_parallel <= 0:
-            for args in data:
-                verify_mix_round(*args, teller=teller)
+            for i, bit, ciphers, randoms, offsets in rounds:
+                verify_mix_round(p, g, q, y, i, bit,
+                                 original_ciphers, mixed_ciphers,
+                                 ciphers, randoms, offsets, teller=teller)
 
         else:
-            pool = Pool(nr_parallel, Random.atfork)
-            try:
+            with crypto_pool(nr_parallel) as pool:
+                original_ref = pool.share(original_ciphers)
+                mixed_ref = pool.share(mixed_ciphers)
+                data = [(p, g, q, y, i, bit, original_ref, mixed_ref,
+                         ciphers, randoms, offsets)
+                        for i, bit, ciphers, randoms, offsets in rounds]
                 for count in pool.imap(_verify_mix_round, data):
                     teller.advance(count)
-            finally:
-                pool.terminate()
-                pool.join()
 
     teller.finish('Verifying mixing')
     return 1